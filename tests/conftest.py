@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+"""
+Shared fixtures of the tests: Small randomly initialized networks with a tiny vocabulary,
+so the tests run without training data or trained weights.
+"""
+
+import sys
+from os import path, environ
+
+environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '3')
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import pytest
+
+NOTES = ['A4', 'C4', 'D4', 'E4', 'F4', 'G4', 'START', 'rest']
+DURS = [0, 0.5, 1.0, 1.5, 2.0]
+
+def build_informations(symbols):
+    """
+    Builds the informations of a vocabulary in the format of midi_generation.get_informations.
+    """
+    symbol_to_int = {symbol: idx for idx, symbol in enumerate(symbols)}
+    int_to_symbol = dict(enumerate(symbols))
+    return (None, set(symbols), len(symbols), symbol_to_int, int_to_symbol, None)
+
+@pytest.fixture
+def informations():
+    return build_informations(NOTES), build_informations(DURS)
+
+@pytest.fixture
+def small_model_factory():
+    """
+    Returns a Function which builds a small random model (see jazz_lstm.generate_lstm_model)
+    with reproducible weights.
+    """
+    from keras.utils import set_random_seed
+    from utils.jazz_lstm import generate_lstm_model
+
+    def factory(seed=0, **model_args):
+        set_random_seed(seed)
+        return generate_lstm_model(len(NOTES), len(DURS), **{'embed': 8, 'rnn_units': 16, **model_args})
+    return factory
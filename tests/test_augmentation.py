@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+
+from numpy import array, array_equal
+from utils.augmentation import ALL_KEYS, build_shift_table, transpose_windows
+from utils.midi_tools import build_note_dict
+from utils.smf import pitch_name_to_midi, midi_to_pitch_name
+from utils.corpus import PAD
+
+NOTES = ['START', 'C4', 'E-4', 'G4', 'B-4', 'rest', 'D5']
+
+def test_shift_table_maps_to_the_transposed_spelling():
+    note_to_int, _ = build_note_dict(NOTES, [0], ALL_KEYS)
+    int_to_note = {idx: note for note, idx in note_to_int.items()}
+    table = build_shift_table(note_to_int, ALL_KEYS, NOTES)
+    # Pitches of the training data keep their spelling, new pitches are named like smf.midi_to_pitch_name
+    spellings = {pitch_name_to_midi(note): note for note in NOTES if note not in ('START', 'rest')}
+
+    for row, semitones in enumerate(ALL_KEYS):
+        for note in NOTES:
+            transposed = int_to_note[table[row, note_to_int[note]]]
+            if note in ('START', 'rest'):
+                assert transposed == note
+            else:
+                midi_pitch = pitch_name_to_midi(note) + semitones
+                assert transposed == spellings.get(midi_pitch, midi_to_pitch_name(midi_pitch))
+
+    shift = {semitones: row for row, semitones in enumerate(ALL_KEYS)}
+    assert int_to_note[table[shift[3], note_to_int['C4']]] == 'E-4'
+    assert int_to_note[table[shift[-3], note_to_int['G4']]] == 'E4'
+    assert int_to_note[table[shift[4], note_to_int['B-4']]] == 'D5'
+
+def test_transpose_windows_uses_the_shift_table():
+    note_to_int, _ = build_note_dict(NOTES, [0], ALL_KEYS)
+    table = build_shift_table(note_to_int, ALL_KEYS, NOTES)
+    windows = array([[note_to_int[note] for note in ['START', 'C4', 'E-4', 'G4']],
+                     [note_to_int[note] for note in ['B-4', 'rest', 'D5', 'C4']]])
+    next_notes = array([note_to_int['B-4'], note_to_int['START']])
+    shifts = array([3, 9])
+
+    transposed, transposed_next = transpose_windows(table, shifts, windows, next_notes)
+    assert array_equal(transposed, [table[shift][window] for shift, window in zip(shifts, windows)])
+    assert array_equal(transposed_next, table[shifts, next_notes])
+
+    # Packed windows: The padding stays, every other token is shifted by 1
+    packed = windows + 1
+    packed[0, 0] = PAD
+    packed_transposed, _ = transpose_windows(table, shifts, packed, next_notes, packed=True)
+    assert packed_transposed[0, 0] == PAD
+    assert array_equal(packed_transposed[:, 1:], transposed[:, 1:] + 1)
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+
+from utils.midi_generation import generate_notes_durs, generate_batch_notes_durs
+
+def test_generate_notes_durs_packed_matches_batch(small_model_factory, informations):
+    # With n=1 both generations draw the same random numbers
+    model = small_model_factory(seed=2, mask_zero=True)
+    for seed in range(3):
+        lick = generate_notes_durs(model, *informations, additional_notes=24, note_rand=0.8, seed=seed, packed=True)
+        batch = generate_batch_notes_durs(model, *informations, 1, additional_notes=24, note_rand=0.8,
+                                          seed=seed, packed=True)
+        assert lick == batch[0]
+
+def test_batch_matches_generate_notes_durs(small_model_factory, informations):
+    model = small_model_factory(seed=1)
+    for seed in range(3):
+        lick = generate_notes_durs(model, *informations, note_rand=0.8, dur_rand=0.5, seed=seed)
+        assert generate_batch_notes_durs(model, *informations, 1, note_rand=0.8, dur_rand=0.5, seed=seed) == [lick]
+
+    # Argmax mode: Every lick of the batch is the lick of generate_notes_durs
+    lick = generate_notes_durs(model, *informations, note_rand=0, dur_rand=0)
+    assert generate_batch_notes_durs(model, *informations, 4, note_rand=0, dur_rand=0) == [lick] * 4
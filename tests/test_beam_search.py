@@ -0,0 +1,16 @@
+#!/usr/bin/env python3
+
+import pytest
+from utils.check_overfitting import build_lick_index
+from utils.midi_generation import generate_beam_notes_durs, check_lick_constraints
+
+@pytest.mark.parametrize('mask_zero', [False, True])
+def test_beam_licks_fulfill_constraints(small_model_factory, informations, mask_zero):
+    model = small_model_factory(seed=3, mask_zero=mask_zero)
+    training_index = build_lick_index([['C4', 'D4', 'E4', 'F4', 'G4'], ['E4', 'D4', 'C4', 'A4'], ['G4', 'G4', 'G4']])
+    constraints = dict(total_quarters=4, overhang=1, end_pitch_classes={0, 4}, max_copy=2,
+                       training_index=training_index)
+    licks = generate_beam_notes_durs(model, *informations, 6, beam_width=4, max_notes=12, seed=0,
+                                     packed=mask_zero, **constraints)
+    assert licks
+    assert all(check_lick_constraints(lick, **constraints) for lick in licks)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+
+from numpy import array, int64, array_equal
+from utils.corpus import (find_lick_offsets, get_windows, get_packed_windows, get_packed_inputs, pack_windows,
+                          save_corpus, load_vocabulary, keep_vocabulary)
+from utils.midi_tools import build_note_dict
+
+def test_pack_windows_matches_packed_inputs():
+    # 2 licks with the START/0 Tokens in front of them (START: 0, duration 0: 0)
+    length = 4
+    notes = array([0] * length + [3, 1, 2, 5, 4, 2] + [0] * length + [1, 2], dtype=int64)
+    durs = array([0] * length + [1, 2, 1, 3, 1, 1] + [0] * length + [2, 2], dtype=int64)
+    corpus = {'notes': notes, 'durs': durs, 'length': length, 'offsets': find_lick_offsets(notes, 0)}
+
+    window_indices = get_packed_windows(corpus)
+    note_windows, dur_windows = get_windows(corpus)
+    packed_notes, packed_durs = pack_windows(note_windows[window_indices], dur_windows[window_indices], 0)
+    expected_notes, expected_durs = get_packed_inputs(corpus, window_indices)
+    assert array_equal(packed_notes, expected_notes)
+    assert array_equal(packed_durs, expected_durs)
+
+def test_keep_vocabulary(tmp_path):
+    # A corpus whose vocabulary was extended (see incremental.update_corpus): The new notes are not sorted
+    notes = ['START', 'START', 'C4', 'E4', 'START', 'START', 'A4']
+    durs = [0, 0, 1.0, 0.5, 0, 0, 2.0]
+    note_to_int, dur_to_int = {'C4': 0, 'E4': 1, 'START': 2, 'A4': 3}, {0: 0, 0.5: 1, 1.0: 2, 2.0: 3}
+    save_corpus(notes, durs, note_to_int, dur_to_int, tmp_path, length=2)
+    assert load_vocabulary(tmp_path) == (note_to_int, dur_to_int)
+
+    # A new extraction: A4 and 2.0 are gone, D4 and 1.5 are new
+    new_notes, new_durs = build_note_dict(['START', 'C4', 'D4', 'E4'], [0, 1.0, 1.5, 0.5])
+    kept_notes, kept_durs = keep_vocabulary(tmp_path, new_notes, new_durs)
+    assert kept_notes == {**note_to_int, 'D4': 4}
+    assert kept_durs == {**dur_to_int, 1.5: 4}
+    # No corpus: The vocabulary is unchanged
+    assert keep_vocabulary(tmp_path / 'missing', new_notes, new_durs) == (new_notes, new_durs)
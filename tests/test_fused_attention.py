@@ -0,0 +1,23 @@
+#!/usr/bin/env python3
+
+from numpy import abs as np_abs
+from test_numpy_backend import get_random_windows
+
+def test_fused_attention_loads_old_weights(small_model_factory, tmp_path):
+    # weights.h5 of the original attention layers (Dense 'Adapt_layer')
+    old_model = small_model_factory(seed=0, fused_attention=False)
+    old_model.save_weights(tmp_path / 'weights.h5')
+    fused_model = small_model_factory(seed=1, fused_attention=True)
+    fused_model.load_weights(tmp_path / 'weights.h5')
+
+    inputs = get_random_windows(old_model.get_layer('note_embedd').input_dim,
+                                old_model.get_layer('dur_embed').input_dim, n=64)
+    for old_outputs, fused_outputs in zip(old_model.predict(inputs, verbose=0), fused_model.predict(inputs, verbose=0)):
+        assert np_abs(old_outputs - fused_outputs).max() < 1e-6
+
+    # And the other way round
+    fused_model.save_weights(tmp_path / 'fused_weights.h5')
+    new_old_model = small_model_factory(seed=2, fused_attention=False)
+    new_old_model.load_weights(tmp_path / 'fused_weights.h5')
+    for old_outputs, new_outputs in zip(old_model.predict(inputs, verbose=0), new_old_model.predict(inputs, verbose=0)):
+        assert np_abs(old_outputs - new_outputs).max() < 1e-6
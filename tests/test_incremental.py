@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import pytest
+from numpy import array_equal
+from utils.jazz_lstm import generate_lstm_model, get_model_settings, save_model_settings, load_model_settings
+from utils.incremental import grow_model
+
+@pytest.mark.parametrize('model_args', [{}, {'mask_zero': True}, {'fused_attention': False}])
+def test_model_settings_rebuild_the_model(small_model_factory, tmp_path, monkeypatch, model_args):
+    monkeypatch.chdir(tmp_path)
+    model = small_model_factory(**model_args)
+    save_model_settings(model, 'both')
+    settings = load_model_settings('both')
+    assert settings == get_model_settings(model)
+    assert settings['rnn_units'] == 16 and settings['embed'] == 8
+
+    # The weights of the model fit into the rebuilt model
+    model.save_weights('weights/both/weights.h5')
+    rebuilt = generate_lstm_model(**settings)
+    rebuilt.load_weights('weights/both/weights.h5')
+    assert load_model_settings('missing') is None
+
+def test_grow_model_keeps_the_trained_weights(small_model_factory):
+    model = small_model_factory(mask_zero=True)
+    grown = grow_model(model, 10, 6, sparse=True)
+    assert get_model_settings(grown) == {**get_model_settings(model), 'n_notes': 10, 'n_durs': 6}
+    old, new = model.get_layer('note_embedd').get_weights()[0], grown.get_layer('note_embedd').get_weights()[0]
+    assert array_equal(new[:len(old)], old)
+    with pytest.raises(ValueError):
+        grow_model(model, 4, 6)
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Tests of the lick server: Latency per request and error replies which keep the server running.
+"""
+
+from asyncio import run, start_server, open_connection, create_task, gather
+from json import loads, dumps
+import pytest
+from utils.lick_server import LickServer, request_licks
+
+class FlakyModel:
+    """
+    Wraps a model: The predictions fail as long as fail is set.
+    """
+
+    def __init__(self, model):
+        self.model, self.fail = model, False
+
+    def predict(self, *args, **kwargs):
+        if self.fail:
+            raise RuntimeError('broken prediction')
+        return self.model.predict(*args, **kwargs)
+
+async def serve(server, scenario):
+    """
+    Runs the batch loops of the server and a TCP server on a free port while scenario(port) runs.
+    """
+    loops = [create_task(server.run_scale(scale)) for scale in server.models]
+    tcp_server = await start_server(server.handle, '127.0.0.1', 0)
+    port = tcp_server.sockets[0].getsockname()[1]
+    try:
+        return await scenario(port)
+    finally:
+        tcp_server.close()
+        for scale_loop in loops:
+            scale_loop.cancel()
+
+async def send_lines(port, lines, n_answers):
+    reader, writer = await open_connection('127.0.0.1', port)
+    for line in lines:
+        writer.write(line + b'\n')
+    await writer.drain()
+    answers = [loads(await reader.readline()) for _ in range(n_answers)]
+    writer.close()
+    return answers
+
+@pytest.fixture
+def server(small_model_factory, informations):
+    model = FlakyModel(small_model_factory())
+    return LickServer({'both': (model, *informations)}, additional_notes=4)
+
+def test_latency_of_each_request(server):
+    async def scenario(port):
+        request = {'scale': 'both', 'count': 2, 'seed': 1}
+        return await gather(send_lines(port, [dumps({**request, 'id': 'short'}).encode()], 3),
+                            send_lines(port, [dumps({**request, 'id': 'long', 'count': 6}).encode()], 7))
+
+    short, long = run(serve(server, scenario))
+    assert short[-1]['done'] and long[-1]['done']
+    assert sorted([short[-1]['latency'], long[-1]['latency']]) == sorted(server.latencies)
+
+def test_errors_keep_the_server_running(server):
+    async def scenario(port):
+        invalid = await send_lines(port, [b'{"scale": ', b'[1, 2]'], 2)
+        server.models['both'][0].fail = True
+        with pytest.raises(ValueError, match='Prediction failed'):
+            await request_licks(port=port, scale='both', count=3, seed=1)
+        server.models['both'][0].fail = False
+        return invalid, await request_licks(port=port, scale='both', count=3, seed=1)
+
+    invalid, licks = run(serve(server, scenario))
+    assert all('Invalid request' in answer['error'] for answer in invalid)
+    assert len(licks) == 3
+    assert server.n_licks == 3
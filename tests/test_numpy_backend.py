@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+
+import pytest
+from numpy import abs as np_abs
+from numpy.random import default_rng
+from utils.numpy_lstm import export_weights, NumpyJazzLSTM
+from utils.corpus import pack_windows
+
+def get_random_windows(n_notes, n_durs, n=32, length=17, seed=0):
+    rng = default_rng(seed)
+    return [rng.integers(0, n_notes, (n, length)), rng.integers(0, n_durs, (n, length))]
+
+@pytest.mark.parametrize('fused_attention', [True, False])
+def test_numpy_predictions_match_keras(small_model_factory, tmp_path, fused_attention):
+    model = small_model_factory(fused_attention=fused_attention)
+    export_weights(model, tmp_path / 'weights.npz')
+    numpy_model = NumpyJazzLSTM(tmp_path / 'weights.npz')
+
+    inputs = get_random_windows(model.get_layer('note_embedd').input_dim, model.get_layer('dur_embed').input_dim)
+    keras_notes, keras_durs = model.predict(inputs, verbose=0)
+    numpy_notes, numpy_durs = numpy_model.predict(inputs)
+    assert np_abs(keras_notes - numpy_notes).max() < 1e-5
+    assert np_abs(keras_durs - numpy_durs).max() < 1e-5
+
+def test_numpy_predictions_match_keras_packed(small_model_factory, tmp_path):
+    # Packed windows: The padding has to be masked like in the Keras model
+    model = small_model_factory(mask_zero=True)
+    export_weights(model, tmp_path / 'weights.npz')
+    numpy_model = NumpyJazzLSTM(tmp_path / 'weights.npz')
+    assert numpy_model.mask_zero and numpy_model.n_notes == model.get_layer('note_height').units
+
+    note_windows, dur_windows = get_random_windows(numpy_model.n_notes, numpy_model.n_durs)
+    # Windows of the generation: Leading START Tokens (6, see conftest.NOTES) + generated notes
+    for row in range(len(note_windows)):
+        note_windows[row, :row % 17] = 6
+    inputs = list(pack_windows(note_windows, dur_windows, 6))
+    keras_notes, keras_durs = model.predict(inputs, verbose=0)
+    numpy_notes, numpy_durs = numpy_model.predict(inputs)
+    assert np_abs(keras_notes - numpy_notes).max() < 1e-5
+    assert np_abs(keras_durs - numpy_durs).max() < 1e-5
@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+
+import pytest
+from numpy import arange, array_equal, concatenate
+from utils.corpus import save_corpus, load_corpus
+from utils.midi_tools import build_note_dict, generate_sequence
+from utils.pipeline import make_dataset, split_licks
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_make_dataset_matches_generate_sequence(tmp_path, packed):
+    # 3 licks with the START/0 Tokens in front of them
+    length = 4
+    licks = [(['C4', 'E4', 'G4'], [0.5, 0.5, 1.0]), (['D4', 'rest', 'F4', 'A4', 'C5'], [1.0, 0.5, 0.5, 1.5, 2.0]),
+             (['E4', 'D4'], [2.0, 2.0])]
+    notes = [token for lick_notes, _ in licks for token in ['START'] * length + lick_notes]
+    durs = [token for _, lick_durs in licks for token in [0] * length + lick_durs]
+    note_to_int, dur_to_int = build_note_dict(notes, durs)
+    (note_inputs, dur_inputs), (next_notes, next_durs) = generate_sequence(notes, durs, note_to_int, dur_to_int, 'both',
+                                                                           length=length, sparse=True, packed=packed)
+
+    save_corpus(notes, durs, note_to_int, dur_to_int, tmp_path, length=length)
+    corpus = load_corpus(tmp_path)
+    window_indices = split_licks(corpus, validation_split=0, packed=packed)[0]
+    if not packed:
+        assert array_equal(window_indices, arange(len(notes) - length))
+    batches = list(make_dataset(corpus, window_indices, batch_size=4, shuffle=False, packed=packed).as_numpy_iterator())
+    assert len(batches) == (len(window_indices) + 3) // 4
+    for batched, expected in zip(zip(*[(*inputs, *outputs) for inputs, outputs in batches]),
+                                 [note_inputs, dur_inputs, next_notes, next_durs]):
+        assert array_equal(concatenate(batched), expected)
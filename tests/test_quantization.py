@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+
+from numpy import load, savez, abs as np_abs, array_equal, int8
+from utils.numpy_lstm import export_weights, NumpyJazzLSTM
+from utils.quantization import export_quantized_weights, QuantizedJazzLSTM
+from test_numpy_backend import get_random_windows
+
+# Largest difference of the probabilities (a model trained for 120 epochs: 0.027 for 2048 training windows)
+TOLERANCE = 0.03
+
+def export_sharp_weights(model, file_path, factor=400):
+    """
+    Exports the weights of a random model with scaled output layers, so the probabilities
+    are peaked like the ones of a trained model instead of nearly uniform.
+    """
+    export_weights(model, file_path)
+    with load(file_path) as weights:
+        weights = {name: weights[name] for name in weights.files}
+    for name in ['note_height_0', 'duration_0']:
+        weights[name] = weights[name] * factor
+    savez(file_path, **weights)
+
+def test_quantized_predictions_within_tolerance(small_model_factory, tmp_path):
+    export_sharp_weights(small_model_factory(), tmp_path / 'weights.npz')
+    export_quantized_weights(tmp_path / 'weights.npz', tmp_path / 'weights_int8.npz')
+    numpy_model = NumpyJazzLSTM(tmp_path / 'weights.npz')
+    quantized_model = QuantizedJazzLSTM(tmp_path / 'weights_int8.npz')
+
+    inputs = get_random_windows(numpy_model.n_notes, numpy_model.n_durs, n=256)
+    float_notes, float_durs = numpy_model.predict(inputs)
+    int8_notes, int8_durs = quantized_model.predict(inputs)
+    assert float_notes.max(axis=-1).mean() > 0.5
+    assert np_abs(float_notes - int8_notes).max() < TOLERANCE
+    assert np_abs(float_durs - int8_durs).max() < TOLERANCE
+    assert (float_notes.argmax(axis=-1) == int8_notes.argmax(axis=-1)).mean() > 0.95
+
+    # Quantized while loading == quantized file
+    for prediction, expected in zip(QuantizedJazzLSTM(tmp_path / 'weights.npz').predict(inputs),
+                                    [int8_notes, int8_durs]):
+        assert array_equal(prediction, expected)
+
+def test_quantized_model_is_smaller_at_runtime(small_model_factory, tmp_path):
+    export_weights(small_model_factory(), tmp_path / 'weights.npz')
+    numpy_model = NumpyJazzLSTM(tmp_path / 'weights.npz')
+    quantized_model = QuantizedJazzLSTM(tmp_path / 'weights.npz')
+    # Only int8 kernels/embeddings are kept in memory (no float32 copies)
+    assert all(kernel.dtype == int8 for kernel, _ in quantized_model.kernels.values())
+    assert all(embedding.dtype == int8 for embedding, _ in quantized_model.embeddings.values())
+    assert all(weight.ndim == 1 for weight in quantized_model.weights.values())
+    assert quantized_model.get_runtime_size() < numpy_model.get_runtime_size() / 2
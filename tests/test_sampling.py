@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+
+from numpy import argsort, take_along_axis, isin
+from numpy.random import default_rng
+from utils.sampling import sample_tokens
+
+def test_top_k_top_p_only_draw_allowed_tokens():
+    rng = default_rng(0)
+    outputs = rng.dirichlet([0.5] * 10, size=64)
+    order = argsort(-outputs, axis=1)
+    # Nucleus: The most likely elements until their probability reaches top_p (the most likely element is always kept)
+    sorted_probs = take_along_axis(outputs, order, axis=1)
+    in_nucleus = (sorted_probs.cumsum(axis=1) - sorted_probs) < 0.6
+
+    for _ in range(50):
+        drawn = sample_tokens(outputs, 1.0, top_k=3, rng=rng)
+        assert all(isin(token, row[:3]) for token, row in zip(drawn, order))
+        drawn = sample_tokens(outputs, 1.0, top_p=0.6, rng=rng)
+        assert all(isin(token, row[keep]) for token, row, keep in zip(drawn, order, in_nucleus))
+        drawn = sample_tokens(outputs, 1.0, top_k=1, top_p=0.6, rng=rng)
+        assert (drawn == order[:, 0]).all()
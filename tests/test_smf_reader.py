@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+
+from fractions import Fraction
+import pytest
+from music21 import stream, note, duration
+from utils.midi_tools import compare_midi_readers, parse_midi_file
+from utils.smf import write_midi_files, write_midi_archive, read_archive_tokens, read_midi_tokens
+
+TRIPLET = Fraction(1, 3)
+# Lick (4/4) with rests, triplets, a note and a rest which cross a barline
+LICK = [['C4', 0.5], ['rest', 0.5], ['E-4', 1.0], ['G4', 3.0], ['rest', 1.0], ['A4', TRIPLET], ['B4', TRIPLET],
+        ['C5', TRIPLET], ['D5', 0.5], ['rest', 1.0], ['F#4', 2.0], ['rest', 1.5]]
+# Tokens of the lick: The elements crossing a barline are tied pieces
+TIED_LICK = [['C4', 0.5], ['rest', 0.5], ['E-4', 1.0], ['G4', 2.0], ['G4', 1.0], ['rest', 1.0], ['A4', TRIPLET],
+             ['B4', TRIPLET], ['C5', TRIPLET], ['D5', 0.5], ['rest', 0.5], ['rest', 0.5], ['F#4', 2.0], ['rest', 1.5]]
+
+def write_lick(file_path, elements):
+    """
+    Writes a lick of (offset, pitch, quarterLength) elements as midi file with music21.
+    """
+    lick = stream.Stream()
+    for offset, pitch, quarter_length in elements:
+        element = note.Note(pitch)
+        element.duration = duration.Duration(quarter_length)
+        lick.insert(offset, element)
+    lick.write('midi', fp=str(file_path))
+
+def test_barline_split_order_matches_music21(tmp_path):
+    # A triplet note which crosses the barline while the next note starts at the barline:
+    # music21 puts the tied rest of the triplet after the new note of the measure
+    write_lick(tmp_path / 'triplet_barline.mid',
+               [(0, 'E4', 3.5), (3.5, 'C4', 2 / 3), (4, 'F#4', 0.75), (4.75, 'A4', 0.25), (5, 'C4', 3)])
+    music21_tokens = parse_midi_file(tmp_path / 'triplet_barline.mid', 'music21')
+    assert ('C4', 0.5) in zip(*music21_tokens)
+    assert parse_midi_file(tmp_path / 'triplet_barline.mid', 'smf') == music21_tokens
+
+def test_compare_midi_readers(tmp_path):
+    write_lick(tmp_path / 'straight.mid', [(0, 'C4', 0.5), (0.5, 'D4', 1.5), (2, 'E4', 4), (6, 'G4', 2)])
+    write_lick(tmp_path / 'triplet_barline.mid',
+               [(0, 'E4', 3.5), (3.5, 'C4', 2 / 3), (4, 'F#4', 0.75), (4.75, 'A4', 0.25), (5, 'C4', 3)])
+    assert compare_midi_readers(str(tmp_path)) == (2, [])
+
+def test_written_licks_round_trip(tmp_path):
+    # Generated licks start with START/0 Tokens, which are not written
+    outputs = [[['START', 0]] * 17 + LICK, [['START', 0]] * 17 + TIED_LICK]
+    midi_files = [tmp_path / 'lick.mid', tmp_path / 'tied_lick.mid']
+    write_midi_files(outputs, midi_files)
+    expected = tuple(map(list, zip(*TIED_LICK)))
+    for midi_file in midi_files:
+        assert parse_midi_file(midi_file, reader='music21') == expected
+        assert parse_midi_file(midi_file, reader='smf') == expected
+
+    write_midi_archive(outputs, ['lick.mid', 'tied_lick.mid'], tmp_path / 'licks.zip')
+    assert read_archive_tokens(tmp_path / 'licks.zip') == {'lick.mid': expected, 'tied_lick.mid': expected}
+
+def test_missing_running_status(tmp_path):
+    # A note on event without status byte after a tempo meta event
+    track = b'\x00\xFF\x51\x03\x07\xA1\x20' + b'\x00\x3C\x40' + b'\x00\xFF\x2F\x00'
+    header = b'MThd' + (6).to_bytes(4, 'big') + (0).to_bytes(2, 'big') + (1).to_bytes(2, 'big') + (480).to_bytes(2, 'big')
+    (tmp_path / 'running_status.mid').write_bytes(header + b'MTrk' + len(track).to_bytes(4, 'big') + track)
+    with pytest.raises(ValueError, match='running_status.mid: Data byte 0x3c without running status at offset 30'):
+        read_midi_tokens(tmp_path / 'running_status.mid')
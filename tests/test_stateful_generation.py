@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+
+import pytest
+from utils.jazz_lstm import generate_inference_models
+from utils.midi_generation import check_stateful_parity, generate_stateful_notes_durs
+
+@pytest.mark.parametrize('fused_attention', [True, False])
+def test_stateful_parity_argmax(small_model_factory, informations, fused_attention):
+    # More notes than the window, so the window slides past every START Token
+    model = small_model_factory(fused_attention=fused_attention)
+    step_model, head_model = generate_inference_models(model)
+    identical, compared = check_stateful_parity(model, step_model, head_model, *informations,
+                                                n=4, additional_notes=24)
+    assert compared > 0
+    assert identical == compared
+
+def test_stateful_parity_sampling(small_model_factory, informations):
+    # With the same seed both generations draw the same random numbers
+    model = small_model_factory(seed=1)
+    step_model, head_model = generate_inference_models(model)
+    identical, compared = check_stateful_parity(model, step_model, head_model, *informations, n=8,
+                                                note_rand=0.8, dur_rand=0.5, seed=3)
+    assert identical == compared
+
+@pytest.mark.parametrize('note_rand, seed', [(0, None), (0.8, 3)])
+def test_stateful_parity_packed(small_model_factory, informations, note_rand, seed):
+    # The windowed model masks the padding, the step model only runs the START Token + the generated notes
+    model = small_model_factory(seed=2, mask_zero=True)
+    step_model, head_model = generate_inference_models(model)
+    identical, compared = check_stateful_parity(model, step_model, head_model, *informations, n=6,
+                                                additional_notes=24, note_rand=note_rand, seed=seed, packed=True)
+    assert compared > 0
+    assert identical == compared
+
+def test_stateful_carried_packed(small_model_factory, informations):
+    model = small_model_factory(seed=2, mask_zero=True)
+    step_model, head_model = generate_inference_models(model)
+    licks = generate_stateful_notes_durs(step_model, head_model, *informations, n=3, additional_notes=24,
+                                         packed=True, seed=0)
+    assert len(licks) == 3 and all(len(lick) > 17 for lick in licks)
+
+def test_stateful_exact_matches_carried_drifts(small_model_factory, informations):
+    # Exact mode reruns the window, the carried states (default) keep the Tokens which have left the window
+    model = small_model_factory(seed=1)
+    step_model, head_model = generate_inference_models(model)
+    identical, compared = check_stateful_parity(model, step_model, head_model, *informations, n=8,
+                                                additional_notes=24, note_rand=0.8, seed=3, exact=True)
+    assert identical == compared
+    identical, compared = check_stateful_parity(model, step_model, head_model, *informations, n=8,
+                                                additional_notes=24, note_rand=0.8, seed=3, exact=False)
+    assert identical < compared
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+This Python File contains Functions for a transposition augmentation of the training data:
+Instead of writing and parsing more midi files, the licks are transposed by semitone offsets
+on the integer tokens. A shift table maps every note integer to the integer of the transposed note,
+so a whole batch of windows is transposed with a single lookup (see pipeline.generate_batches).
+The vocabulary has to contain the transposed notes (see midi_tools.build_note_dict).
+"""
+
+from numpy import array, where, int64
+from utils.smf import midi_to_pitch_name, pitch_name_to_midi
+from utils.corpus import PAD
+
+# Every key: Transpositions from a fourth down to a tritone up
+ALL_KEYS = tuple(range(-5, 7))
+# Tokens which are not transposed
+UNPITCHED = ('START', 'rest')
+
+def get_pitch_spellings(notes):
+    """
+    Small helper Function which returns the spelling of every midi pitch of the notes (midi pitch => name),
+    so a transposed note keeps the spelling of the training data if the pitch already exists (e.g. 'E-4' instead of 'D#4').
+    """
+    spellings = {}
+    for note in sorted(set(notes) - set(UNPITCHED)):
+        spellings.setdefault(pitch_name_to_midi(note), note)
+    return spellings
+
+def transpose_note(note, semitones, spellings):
+    """
+    Function to transpose a note name by semitones (Tokens and rests are not transposed).
+    The spellings (see get_pitch_spellings) determine the name of the transposed pitch,
+    new pitches are named like smf.midi_to_pitch_name.
+    """
+    if note in UNPITCHED or semitones == 0:
+        return note
+    midi_pitch = pitch_name_to_midi(note) + semitones
+    return spellings.get(midi_pitch, midi_to_pitch_name(midi_pitch))
+
+def get_transposed_notes(notes, transpositions):
+    """
+    Function to collect every note of the training data transposed by every offset of transpositions.
+    Returns a set of note names (incl. the original notes and the Tokens), which is the
+    vocabulary of the augmented training data (see midi_tools.build_note_dict).
+    """
+    unique_notes = set(notes)
+    spellings = get_pitch_spellings(unique_notes)
+    return {transpose_note(note, semitones, spellings)
+            for note in unique_notes for semitones in set(transpositions) | {0}}
+
+def build_shift_table(note_to_int, transpositions, used_notes=None):
+    """
+    Function to precompute the shift table of the transpositions:
+    The row idx maps every note integer to the integer of the note transposed by transpositions[idx].
+    Only the used_notes (the notes of the training data, default: every note) have to be transposable,
+    every other note (e.g. an already transposed note of the vocabulary) is mapped to itself.
+    Returns an array with a shape of ( len(transpositions), n_notes ).
+    Raises a ValueError if a transposed note is not part of the vocabulary.
+    """
+    int_to_note = sorted(note_to_int, key=note_to_int.get)
+    used_notes = set(int_to_note if used_notes is None else used_notes)
+    spellings = get_pitch_spellings(int_to_note)
+    table = []
+    for semitones in transpositions:
+        transposed = [transpose_note(note, semitones, spellings) if note in used_notes else note
+                      for note in int_to_note]
+        missing = [note for note in transposed if note not in note_to_int]
+        if missing:
+            raise ValueError(f'Transposition {semitones} needs notes which are not in the vocabulary: {missing} '
+                             f'(see build_note_dict with transpositions)')
+        table.append([note_to_int[note] for note in transposed])
+    return array(table, dtype=int64)
+
+def transpose_windows(shift_table, shifts, note_windows, next_notes, packed=False):
+    """
+    Function to transpose a batch of windows + their following notes:
+    Every row is transposed by the row shifts[row] of the shift table.
+    Packed windows (see corpus.get_packed_inputs) keep their padding, their other tokens are shifted by 1.
+    Returns the transposed windows and notes (new arrays, the corpus is not changed).
+    """
+    if packed:
+        transposed = shift_table[shifts[:, None], (note_windows.astype(int64) - 1).clip(min=0)] + 1
+        return where(note_windows == PAD, PAD, transposed), shift_table[shifts, next_notes]
+    return shift_table[shifts[:, None], note_windows], shift_table[shifts, next_notes]
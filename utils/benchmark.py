@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+This Python File contains a benchmark of the hot paths of the project:
+Extraction of the training data, building the dictionaries, the sequential data,
+a training epoch, the generation of licks, writing midi files and the overfitting check.
+The benchmark runs on a synthetic corpus of random licks (see generate_synthetic_corpus),
+every stage runs in its own process, so the peak memory (RSS) belongs to a single stage.
+The results are saved as JSON and compared with a stored baseline.
+
+Run the benchmark with:  python -m utils.benchmark --sizes 20 200 2000 --output benchmark.json
+Compare with a baseline:  python -m utils.benchmark --baseline benchmarks/baseline.json
+"""
+
+from os import path, makedirs, chdir
+from sys import platform, version as python_version
+from json import dump, load
+from time import perf_counter
+from resource import getrusage, RUSAGE_SELF
+from shutil import rmtree
+from tempfile import mkdtemp
+from argparse import ArgumentParser
+from functools import partial
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from numpy.random import default_rng
+
+# Pitches (midi) for the synthetic licks: Bb major + the altered scale of F7 over 2 octaves
+DIATONIC_PITCHES = [pitch + octave for octave in (0, 12) for pitch in (58, 60, 62, 63, 65, 67, 69)]
+ALTERATED_PITCHES = [pitch + octave for octave in (0, 12) for pitch in (65, 66, 68, 69, 71, 73, 75)]
+# Durations of the synthetic licks (the triplet is written as 3 notes)
+SYNTHETIC_DURATIONS = [0.25, 0.5, 0.5, 0.5, 1.0, 1.5, 'triplet']
+# Length of a lick: 3 bars of 4/4
+LICK_QUARTERS = 12
+# Amount of licks for the stages which generate/write single licks
+GENERATION_LICKS = 10
+
+def generate_synthetic_lick(rng, pitches, rest_rate=0.1):
+    """
+    Function to generate a random lick with a length of 3 bars:
+    Random pitches of the scale, random durations (+ triplets) and some rests.
+    Returns a list of [note, duration] like midi_generation.generate_notes_durs.
+    """
+    from utils.smf import midi_to_pitch_name
+
+    lick, total = [], 0
+    while total < LICK_QUARTERS:
+        dur = SYNTHETIC_DURATIONS[rng.integers(len(SYNTHETIC_DURATIONS))]
+        # Triplet: 3 notes in a quarter
+        durs = [1 / 3] * 3 if dur == 'triplet' else [min(dur, LICK_QUARTERS - total)]
+        for dur in durs:
+            note = 'rest' if rng.random() < rest_rate else midi_to_pitch_name(int(rng.choice(pitches)))
+            lick.append([note, dur])
+        total += sum(durs)
+    return lick
+
+def generate_synthetic_corpus(folder, n_licks, n_generated=100, seed=0):
+    """
+    Function to write a synthetic corpus into a folder (with the layout of the project):
+    > data/diatonic and data/alterated: n_licks random licks (half diatonic, half alterated)
+    > generated_midi/both/Bench_Test: n_generated licks for the overfitting check -
+      every second lick is a copy of a training lick.
+    The licks are written directly as midi files (see smf.write_midi).
+    """
+    from utils.smf import write_midi
+
+    rng = default_rng(seed)
+    training = []
+    for scale, pitches, n in [('diatonic', DIATONIC_PITCHES, (n_licks + 1) // 2),
+                              ('alterated', ALTERATED_PITCHES, n_licks // 2)]:
+        makedirs(path.join(folder, 'data', scale), exist_ok=True)
+        for idx in range(n):
+            lick = generate_synthetic_lick(rng, pitches)
+            write_midi(lick, path.join(folder, 'data', scale, f'lick_{idx}.mid'))
+            training.append(lick)
+
+    generated_folder = path.join(folder, 'generated_midi', 'both', 'Bench_Test')
+    makedirs(generated_folder, exist_ok=True)
+    for idx in range(n_generated):
+        lick = training[idx % len(training)] if idx % 2 else generate_synthetic_lick(rng, DIATONIC_PITCHES)
+        write_midi(lick, path.join(generated_folder, f'Generated_Lick_both_{idx + 1}.mid'))
+
+def prepare_workdir(workdir, n_licks, seed=0):
+    """
+    Prepares the folder of a benchmark run: Synthetic corpus + a first extraction,
+    which fills the cache and writes the corpus (stored/corpus/both) for the following stages.
+    """
+    chdir(workdir)
+    generate_synthetic_corpus('.', n_licks, n_generated=min(n_licks, 100), seed=seed)
+    from utils.midi_tools import extract_notes_and_duration
+    extract_notes_and_duration(scale='diatonic', both=True, show=False, save_data=True)
+    for folder in ['weights/both', 'generated_midi/bench']:
+        makedirs(folder, exist_ok=True)
+
+def load_tokens():
+    """
+    Small helper Function which loads the notes and durations of the (cached) training data.
+    """
+    from utils.midi_tools import extract_notes_and_duration
+    return extract_notes_and_duration(scale='diatonic', both=True, show=False, save_data=False)
+
+def bench_extract(n_licks):
+    """
+    Extraction of the training data without cache (every midi file is parsed).
+    """
+    from utils.midi_tools import extract_notes_and_duration
+    start = perf_counter()
+    extract_notes_and_duration(scale='diatonic', both=True, show=False, save_data=False, cache_folder=None)
+    return perf_counter() - start, n_licks
+
+def bench_build_note_dict(n_licks):
+    """
+    Building the dictionaries of the training data (items: tokens).
+    """
+    from utils.midi_tools import build_note_dict
+    notes, durs = load_tokens()
+    start = perf_counter()
+    build_note_dict(notes, durs)
+    return perf_counter() - start, len(notes)
+
+def bench_generate_sequence(n_licks):
+    """
+    Building the sequential inputs/outputs of the network (items: windows).
+    """
+    from utils.midi_tools import build_note_dict, generate_sequence
+    notes, durs = load_tokens()
+    note_to_int, dur_to_int = build_note_dict(notes, durs)
+    start = perf_counter()
+    inputs, _ = generate_sequence(notes, durs, note_to_int, dur_to_int, 'both')
+    return perf_counter() - start, len(inputs[0])
+
+def bench_train_epoch(n_licks, fused_attention=True, packed=False):
+    """
+    A single training epoch (see jazz_lstm.train) with a batch size of 32 (items: windows).
+    fused_attention selects the attention layer of the model (see jazz_lstm.build_attention_head),
+    packed trains only the windows of the licks (see midi_tools.generate_sequence) - the items are
+    the windows of the unpacked training data, so the throughput is comparable.
+    """
+    from utils.midi_tools import build_note_dict, generate_sequence
+    from utils.jazz_lstm import generate_lstm_model, train
+    notes, durs = load_tokens()
+    note_to_int, dur_to_int = build_note_dict(notes, durs)
+    n_windows = len(notes) - 17
+    inputs, outputs = generate_sequence(notes, durs, note_to_int, dur_to_int, 'both', packed=packed)
+    model = generate_lstm_model(len(note_to_int), len(dur_to_int), fused_attention=fused_attention,
+                                mask_zero=packed)
+    start = perf_counter()
+    train(inputs, outputs, model, 'both', ep=1, checkpoints=False)
+    return perf_counter() - start, n_windows
+
+def bench_generate_notes_durs(n_licks, fused_attention=True):
+    """
+    Generating licks one by one with generate_notes_durs (untrained network, items: licks).
+    fused_attention selects the attention layer of the model (see jazz_lstm.build_attention_head).
+    """
+    from utils.midi_generation import get_informations, generate_notes_durs
+    from utils.jazz_lstm import generate_lstm_model
+    notes_informations, durs_informations = get_informations('both')
+    model = generate_lstm_model(notes_informations[2], durs_informations[2], fused_attention=fused_attention)
+    start = perf_counter()
+    for _ in range(GENERATION_LICKS):
+        generate_notes_durs(model, notes_informations, durs_informations)
+    return perf_counter() - start, GENERATION_LICKS
+
+def bench_generate_midi_seq(n_licks):
+    """
+    Writing licks as midi files with generate_midi_seq (items: licks).
+    """
+    from utils.midi_generation import generate_midi_seq
+    rng = default_rng(0)
+    outputs = [[['START', 0]] * 17 + generate_synthetic_lick(rng, DIATONIC_PITCHES) for _ in range(GENERATION_LICKS)]
+    start = perf_counter()
+    for idx, output in enumerate(outputs):
+        generate_midi_seq(output, 'bench', idx)
+    return perf_counter() - start, GENERATION_LICKS
+
+def bench_overfitting_rate(n_licks):
+    """
+    Overfitting check of the generated licks (incl. the lick index of the training data, items: licks).
+    """
+    from utils.check_overfitting import overfitting_rate
+    start = perf_counter()
+    overfitting_rate('Bench_Test', scale='both')
+    return perf_counter() - start, min(n_licks, 100)
+
+# Every stage of the benchmark (in the order of the project)
+STAGES = {'extract': bench_extract,
+          'build_note_dict': bench_build_note_dict,
+          'generate_sequence': bench_generate_sequence,
+          'train_epoch': bench_train_epoch,
+          # The original attention head (RepeatVector/Permute/Multiply/Lambda) for comparison
+          'train_epoch_legacy_attention': partial(bench_train_epoch, fused_attention=False),
+          # Only the windows of the licks (padding masked)
+          'train_epoch_packed': partial(bench_train_epoch, packed=True),
+          'generate_notes_durs': bench_generate_notes_durs,
+          'generate_notes_durs_legacy_attention': partial(bench_generate_notes_durs, fused_attention=False),
+          'generate_midi_seq': bench_generate_midi_seq,
+          'overfitting_rate': bench_overfitting_rate}
+
+def get_peak_rss():
+    """
+    Small helper Function which returns the peak memory (RSS) of the process in MB.
+    """
+    peak = getrusage(RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return peak / 1024 ** 2 if platform == 'darwin' else peak / 1024
+
+def run_stage(stage, workdir, n_licks):
+    """
+    Runs a single stage in the folder of the benchmark run (in a worker process).
+    Returns the wall time of the stage, the amount of processed items, the throughput (items/s)
+    and the peak memory (RSS in MB) of the process.
+    """
+    chdir(workdir)
+    seconds, items = STAGES[stage](n_licks)
+    return {'wall': seconds, 'items': items, 'throughput': items / seconds if seconds else None,
+            'peak_rss_mb': get_peak_rss()}
+
+def run_in_process(func, *args):
+    """
+    Small helper Function which runs func in a new (spawned) process.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(func, *args).result()
+
+def run_benchmark(sizes=(20, 200), stages=None, repeat=1, seed=0, workdir=None, keep=False, show=True):
+    """
+    Function to run the benchmark for every corpus size (amount of training licks).
+    Every stage is repeated repeat times in a new process: The fastest wall time and the
+    highest peak memory are kept.
+    Returns a Dictionary with the meta data of the run and the results per size and stage.
+    """
+    stages = list(STAGES) if stages is None else stages
+    results = {'meta': {'python': python_version.split()[0], 'platform': platform,
+                        'seed': seed, 'repeat': repeat},
+               'sizes': {}}
+
+    for n_licks in sizes:
+        run_folder = mkdtemp(prefix=f'bench_{n_licks}_') if workdir is None else path.join(workdir, str(n_licks))
+        makedirs(run_folder, exist_ok=True)
+        run_folder = path.abspath(run_folder)
+        run_in_process(prepare_workdir, run_folder, n_licks, seed)
+
+        results['sizes'][str(n_licks)] = {}
+        for stage in stages:
+            runs = [run_in_process(run_stage, stage, run_folder, n_licks) for _ in range(repeat)]
+            best = min(runs, key=lambda run: run['wall'])
+            best['peak_rss_mb'] = max(run['peak_rss_mb'] for run in runs)
+            results['sizes'][str(n_licks)][stage] = best
+            if show:
+                print(f'{n_licks:>6} licks | {stage:<36} {best["wall"]:9.3f} s '
+                      f'{best["throughput"]:12.1f} items/s {best["peak_rss_mb"]:9.1f} MB')
+
+        if not keep:
+            rmtree(run_folder, ignore_errors=True)
+
+    return results
+
+def find_regressions(results, baseline, tolerance=0.2):
+    """
+    Function to compare the results with a baseline (results of an earlier run):
+    A stage is flagged if its wall time or its peak memory is more than tolerance
+    (relative) above the baseline. Only sizes and stages of both runs are compared.
+    Returns a list of the flagged metrics.
+    """
+    regressions = []
+    for n_licks, stages in results['sizes'].items():
+        for stage, result in stages.items():
+            reference = baseline.get('sizes', {}).get(n_licks, {}).get(stage)
+            if reference is None:
+                continue
+            for metric in ['wall', 'peak_rss_mb']:
+                ratio = result[metric] / reference[metric]
+                if ratio > 1 + tolerance:
+                    regressions.append({'size': n_licks, 'stage': stage, 'metric': metric,
+                                        'baseline': reference[metric], 'current': result[metric],
+                                        'ratio': ratio})
+    return regressions
+
+def main():
+    parser = ArgumentParser(description='Benchmark of the hot paths of the project')
+    parser.add_argument('--sizes', nargs='+', type=int, default=[20, 200])
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workdir', default=None, help='Folder for the synthetic corpora (default: temporary)')
+    parser.add_argument('--keep', action='store_true', help='Keep the synthetic corpora')
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--baseline', default=None, help='JSON of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--save-baseline', action='store_true', help='Save the results as new baseline')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.sizes, args.stages, args.repeat, args.seed, args.workdir, args.keep)
+
+    if args.baseline is not None and path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r') as stored:
+            results['regressions'] = find_regressions(results, load(stored), args.tolerance)
+        for regression in results['regressions']:
+            print(f'Regression: {regression["stage"]} ({regression["size"]} licks) {regression["metric"]} '
+                  f'{regression["baseline"]:.3f} => {regression["current"]:.3f} (x{regression["ratio"]:.2f})')
+
+    output = args.baseline if args.save_baseline and args.baseline is not None else args.output
+    if path.dirname(output):
+        makedirs(path.dirname(output), exist_ok=True)
+    with open(output, 'w') as stored:
+        dump(results, stored, indent=2)
+
+    # Failed run if a regression was found
+    return 1 if results.get('regressions') else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
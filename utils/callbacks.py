@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+This Python File contains Keras callbacks which are used during the training (see jazz_lstm.train).
+"""
+
+from time import perf_counter_ns
+from keras.callbacks import Callback
+from utils.instrumentation import is_enabled, record, count, timer
+
+class ThroughputCallback(Callback):
+    """
+    Callback which measures the training samples per second of every epoch.
+    The value is added to the logs as 'samples_per_sec' (so it is part of the history)
+    and recorded as 'train_epoch' event of the instrumentation.
+    > n_samples: Amount of training samples per epoch (without the validation data)
+    """
+
+    def __init__(self, n_samples):
+        super().__init__()
+        self.n_samples = n_samples
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.epoch_start = perf_counter_ns()
+
+    def on_epoch_end(self, epoch, logs=None):
+        duration = perf_counter_ns() - self.epoch_start
+        if logs is not None:
+            logs['samples_per_sec'] = self.n_samples / (duration / 1e9)
+        record('train_epoch', self.epoch_start, duration, epoch=epoch)
+        count('train_samples', self.n_samples, per='train_epoch')
+
+class BatchThroughputCallback(ThroughputCallback):
+    """
+    ThroughputCallback which additionally measures every training batch:
+    > train_batch: Time of the training step of a batch
+    > data_wait: Time between 2 batches (fetching the next batch, other callbacks) -
+      a large part of data_wait shows a data-bound epoch
+    The batch hooks cost some time per batch, so this callback is only used with enabled instrumentation.
+    """
+
+    def on_epoch_begin(self, epoch, logs=None):
+        super().on_epoch_begin(epoch, logs)
+        self.batch_end = self.epoch_start
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self.batch_start = perf_counter_ns()
+        record('data_wait', self.batch_end, self.batch_start - self.batch_end, batch=batch)
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.batch_end = perf_counter_ns()
+        record('train_batch', self.batch_start, self.batch_end - self.batch_start, batch=batch)
+
+class ProgressCallback(Callback):
+    """
+    Callback which sends the logs of every finished epoch into a queue
+    (e.g. a multiprocessing queue of the training scheduler, see scheduler.train_configs):
+    > name: Name of the training run
+    > queue: Queue for (name, epoch, logs)
+    """
+
+    def __init__(self, name, queue):
+        super().__init__()
+        self.name, self.queue = name, queue
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.queue.put((self.name, epoch, {key: float(value) for key, value in (logs or {}).items()}))
+
+def build_throughput_callback(n_samples):
+    """
+    Returns the callback for measuring the throughput of the training:
+    With enabled instrumentation every batch is measured (see BatchThroughputCallback).
+    """
+    if is_enabled():
+        return BatchThroughputCallback(n_samples)
+    return ThroughputCallback(n_samples)
+
+class EvaluationCallback(Callback):
+    """
+    Callback which evaluates the generated licks at chosen epochs like notebook 3, but without
+    writing and parsing midi files: n licks are generated in memory (see midi_generation.generate_batch_notes_durs),
+    mapped to token arrays (see evaluate.encode_licks) and compared with the training data.
+    The results are added to the logs of the epoch (so they are part of the history):
+    > overfitting_rate: Part of the licks which are no copy of a training lick (see check_overfitting.overfitting_rate)
+    > copied_length: Mean length of the longest copied note subsequence of the licks
+    > p_ttest_pitch, p_ks_pitch, p_chi2_pitch (+ _duration): p values of evaluate.evaluate_corpora
+    Note: The history only contains these values for the evaluated epochs,
+    the complete results are collected in results (see get_results).
+    > notes, durs, note_to_int, dur_to_int: Training data with tokens (see midi_tools.extract_notes_and_duration)
+    and its vocabulary
+    > epochs: Evaluated epochs (counted from 1 like the checkpoints, e.g. [5, 35, 70, 80, 90, 180])
+    The other parameters are passed to generate_batch_notes_durs - with a fixed seed every epoch
+    draws the same random numbers, so the differences come from the model.
+    Models with mask_zero (trained with packed windows) generate with packed windows.
+    """
+
+    def __init__(self, notes, durs, note_to_int, dur_to_int, epochs, n=64, length=17, additional_notes=17,
+                 note_rand=0.55, dur_rand=0.1, top_k=None, top_p=None, seed=0, scale='both'):
+        super().__init__()
+        # Local imports: Only needed for the evaluation (midi_generation loads music21)
+        from utils.evaluate import encode_licks
+        from utils.check_overfitting import build_lick_index
+        from utils.midi_generation import reverse_dict
+
+        self.epochs = set(epochs)
+        self.note_to_int, self.dur_to_int = note_to_int, dur_to_int
+        self.generation_args = dict(length=length, additional_notes=additional_notes, note_rand=note_rand,
+                                    dur_rand=dur_rand, top_k=top_k, top_p=top_p, seed=seed)
+        self.n, self.scale = n, scale
+        # Only the Dictionaries of the informations are used by the generation
+        self.notes_informations = (None, None, len(note_to_int), note_to_int, reverse_dict(note_to_int), None)
+        self.durs_informations = (None, None, len(dur_to_int), dur_to_int, reverse_dict(dur_to_int), None)
+
+        # Training data as token arrays + index of its note sequences (mapped to integers)
+        self.training = encode_licks(notes, durs, note_to_int, dur_to_int)
+        self.training_index = build_lick_index([self.training['notes'][start:end]
+                                                for start, end in self.training['offsets']])
+        self.results = []
+
+    def evaluate(self, epoch):
+        """
+        Generates the licks with the current model and returns the DataFrame of evaluate_corpora
+        with the overfitting rate and the mean copied length as additional columns.
+        """
+        from utils.evaluate import encode_licks, evaluate_corpora
+        from utils.check_overfitting import is_copied, longest_copied_subsequence
+        from utils.midi_generation import generate_batch_notes_durs
+
+        with timer('evaluate_epoch', epoch=epoch, n=self.n):
+            packed = bool(self.model.get_layer('note_embedd').mask_zero)
+            outputs = generate_batch_notes_durs(self.model, self.notes_informations, self.durs_informations,
+                                                self.n, packed=packed, **self.generation_args)
+            generated = encode_licks([note for output in outputs for note, _ in output],
+                                     [dur for output in outputs for _, dur in output],
+                                     self.note_to_int, self.dur_to_int)
+
+            licks = [generated['notes'][start:end] for start, end in generated['offsets']]
+            copied = [is_copied(lick, self.training_index) for lick in licks]
+            copied_lengths = [longest_copied_subsequence(lick, self.training_index)[0] for lick in licks]
+
+            results = evaluate_corpora(self.training, [generated], [epoch], self.note_to_int, self.dur_to_int,
+                                       scale=self.scale)
+            results['overfitting_rate'] = 1 - sum(copied) / max(len(licks), 1)
+            results['copied_length'] = sum(copied_lengths) / max(len(licks), 1)
+        return results
+
+    def on_epoch_end(self, epoch, logs=None):
+        if epoch + 1 not in self.epochs:
+            return
+        results = self.evaluate(epoch + 1)
+        self.results.append(results)
+        if logs is not None:
+            logs['overfitting_rate'] = float(results['overfitting_rate'].iloc[0])
+            logs['copied_length'] = float(results['copied_length'].iloc[0])
+            for _, row in results.iterrows():
+                for test in ['p_ttest', 'p_ks', 'p_chi2']:
+                    logs[f'{test}_{row["feature"]}'] = float(row[test])
+
+    def get_results(self):
+        """
+        Returns the results of every evaluated epoch as one DataFrame (see evaluate.evaluate_corpora).
+        """
+        from pandas import concat
+        return concat(self.results, ignore_index=True) if self.results else None
@@ -5,56 +5,111 @@ from utils.midi_tools import extract_notes_and_duration, build_note_dict
 
 def get_lick(folder_name, folder, show=False, scale='both', both=True, train_data=False):
     if train_data:
-        note, dur, names = extract_notes_and_duration(scale=scale, both=both, show=show, send_names=True)
+        note, dur, names = extract_notes_and_duration(scale=scale, both=both, show=show, save_data=False,
+                                                      send_names=True, cache_folder=None)
     else:
-        note, dur, names = extract_notes_and_duration(scale=f'{scale}/{folder_name}', show=show, both=both, length=17, folder=folder, save_data=False, send_names=True)
+        # A folder of generated licks only contains its own scale (see evaluation_runner.get_epoch_files)
+        note, dur, names = extract_notes_and_duration(scale=f'{scale}/{folder_name}', show=show, both=False, length=17, folder=folder, save_data=False, send_names=True, cache_folder=None)
  
     lick_note = extract_lick_elements(note)
     return lick_note, names
 
-def overfitting_rate(epoch_folder_name, scale='both', show=False, both=True):
+def build_lick_index(training_licks):
+    """
+    Creates an index of the note sequences of the training data, so a generated lick can be
+    checked without comparing it to every single training lick:
+    > exact: Dictionary which maps a note sequence (tuple) to the indices of the training licks
+    > ngrams: Dictionary which maps a length n to the set of every note subsequence with the length n
+    """
+    exact, ngrams = {}, {}
+    for idx, lick in enumerate(training_licks):
+        lick = tuple(lick)
+        exact.setdefault(lick, []).append(idx)
+        # Every subsequence of the lick
+        for n in range(1, len(lick) + 1):
+            subsequences = ngrams.setdefault(n, set())
+            for start in range(len(lick) - n + 1):
+                subsequences.add(lick[start:start + n])
+    return {'exact': exact, 'ngrams': ngrams}
+
+def get_training_index(scale='both', show=False, both=True):
+    """
+    Loads the training data of a scale and returns its lick index (see build_lick_index).
+    """
+    training_data, train_names = get_lick(scale, 'data', show=show, scale=scale, both=both, train_data=True)
+    return build_lick_index(training_data)
+
+def is_copied(lick, lick_index):
+    """
+    Checks if the note sequence of a lick is an exact copy of a training lick.
+    """
+    return tuple(lick) in lick_index['exact']
+
+def longest_copied_subsequence(lick, lick_index):
+    """
+    Calculates the length of the longest note subsequence of a lick, which is also part of a training lick.
+    Since every part of a copied subsequence is copied as well, the length can be found with a binary search.
+    Returns the length and the subsequence itself.
+    """
+    lick = tuple(lick)
+    low, high, longest = 0, min(len(lick), max(lick_index['ngrams'], default=0)), ()
+    while low < high:
+        n = (low + high + 1) // 2
+        subsequences = lick_index['ngrams'][n]
+        copied = next((lick[start:start + n] for start in range(len(lick) - n + 1)
+                       if lick[start:start + n] in subsequences), None)
+        if copied is None:
+            high = n - 1
+        else:
+            low, longest = n, copied
+    return low, longest
+
+def overfitting_rate(epoch_folder_name, scale='both', show=False, both=True, training_index=None, send_copied=False):
     """
     Calculates an overfitting score: All Licks and TrainingData in a certain scale folder will be compared. A high score shows low overfitting, while a low score shows a lot overfitted licks (0 = every lick is overfitted and 1 = no lick is overfitted).
     Besides this, this function will return the names of the viable licks (not overfitted).
+    The training data is looked up in a lick index (see build_lick_index), which can be passed as training_index
+    to reuse it for multiple folders. Otherwise it will be created from the training data.
+    If send_copied is set, the length of the longest copied note subsequence of every generated lick
+    will be returned as well (see longest_copied_subsequence) to detect partly copied licks.
     """
-    # Fetch all Licks in zipped format (Note_sequence, Duration_sequence)
+    # Fetch all generated Licks (Note_sequence)
     generated_licks, gen_names = get_lick(epoch_folder_name, 'generated_midi', show=show, scale=scale)
-    training_data, train_names = get_lick(scale, 'data', show=show, scale=scale, both=both, train_data=True)
-    viable_licks = [idx for idx in range(len(generated_licks))]
+    if training_index is None:
+        training_index = get_training_index(scale, show=show, both=both)
     gen_names = [name.split('/')[-1] for name in gen_names]
     # To Test if the modell overfitted and copied training data all licks 
-    # are compared to each other in terms of note sequence 
+    # are compared in terms of note sequence 
     # because the duration will be similar
-    # Get all training data sequences
-    for original_lick in training_data:
-        # Get all generated licks
-        for idx, generated_lick in enumerate(generated_licks):
-            # Compare each original seq to each generated seq
-            if original_lick == generated_lick:
-                if idx not in viable_licks:
-                    continue
-                viable_licks.remove(idx)
-                
-    
+    # Every generated lick is looked up in the index of the training data
+    viable_licks = [idx for idx, generated_lick in enumerate(generated_licks)
+                    if not is_copied(generated_lick, training_index)]
+
     if show:
-        print(f"Epoch 180 got {(len(viable_licks) / len(generated_licks)) * 100} percent of non overfitted results")
+        print(f"{epoch_folder_name} got {(len(viable_licks) / len(generated_licks)) * 100} percent of non overfitted results")
     gen_names = [gen_names[index] for index in viable_licks]
+    if send_copied:
+        copied_lengths = [longest_copied_subsequence(generated_lick, training_index)[0]
+                          for generated_lick in generated_licks]
+        return viable_licks, (len(viable_licks) / len(generated_licks)), gen_names, copied_lengths
     return viable_licks, (len(viable_licks) / len(generated_licks)), gen_names
 
-def plot_overfitting_rate(overfitting_scores, scale):
+def plot_overfitting_rate(overfitting_scores, scale, epochs=None, show=True, dpi=250, folder='imgs'):
     """
-    Shows the percantage of overfitted licks per epoch
+    Shows the percantage of overfitted licks per epoch.
+    The x axis is labeled with the epochs of the scores (the index of the score if epochs is None),
+    the figure is saved as {folder}/overfitting_scores_{scale}.png (see evaluate.finish_figure for show).
     """
-    fig, ax = plt.subplots()
-    sns.lineplot(overfitting_scores)
+    fig, ax = plt.subplots(figsize=(max(6.4, 0.6 * len(overfitting_scores)), 4.8))
     sns.set()
-    plt.title(f'Percantage of new Licks with increasing Epochs ({scale})')
-    plt.ylabel('Percantage')
-    plt.xlabel('Epochs')
-    ax.set_xticks([0, 1, 2, 3, 4, 5])
-    ax.set_xticklabels([5, 35, 70, 80, 90, 180])
-    plt.savefig(f'imgs/overfitting_scores_{scale}.png' , dpi=250)
-    plt.show()
+    sns.lineplot(x=list(range(len(overfitting_scores))), y=list(overfitting_scores), ax=ax)
+    ax.set_title(f'Percantage of new Licks with increasing Epochs ({scale})')
+    ax.set_ylabel('Percantage')
+    ax.set_xlabel('Epochs')
+    ax.set_xticks(list(range(len(overfitting_scores))))
+    if epochs is not None:
+        ax.set_xticklabels(epochs)
+    finish_figure(fig, f'overfitting_scores_{scale}', folder, dpi, show)
 
 def collect_overfitting_and_names(test_folder, scale='both'):
     """
@@ -63,8 +118,10 @@ def collect_overfitting_and_names(test_folder, scale='both'):
     """
     overfitting_scores = []
     viable_names = []
+    # The training data is the same for every folder
+    training_index = get_training_index(scale)
     for folder in test_folder:
-        lick_idx, score, name = overfitting_rate(folder, scale=scale, show=False)
+        lick_idx, score, name = overfitting_rate(folder, scale=scale, show=False, training_index=training_index)
         viable_names.append(name)
         overfitting_scores.append(score)
     return overfitting_scores, viable_names
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+This Python File contains Functions to store the extracted training data in a compact format.
+Notes and durations are saved once as integer arrays (+ the vocabularies and the offsets of every lick),
+the sequential inputs for the network are derived as views of those arrays.
+The arrays are saved as npy files, so they can be loaded memory-mapped (zero-copy).
+"""
+
+from os import path, makedirs
+from json import dump, load
+from fractions import Fraction
+from numpy import (array, save, load as np_load, uint8, uint16, int64,
+                   flatnonzero, concatenate, stack, fromiter, arange, repeat,
+                   minimum, searchsorted, where, asarray, cumprod, zeros)
+from numpy.lib.stride_tricks import sliding_window_view
+from utils.smf import to_quarter_length
+
+# Version of the format - Increased whenever the layout of a corpus folder changes
+CORPUS_VERSION = 1
+# Padding of packed windows - every other token is shifted by 1 (see get_packed_inputs)
+PAD = 0
+
+def get_token_dtype(vocab_size):
+    """
+    Small helper Function which returns the smallest integer type for a vocabulary.
+    """
+    if vocab_size <= 256:
+        return uint8
+    if vocab_size <= 65536:
+        return uint16
+    raise ValueError(f'Vocabulary with {vocab_size} tokens is too big')
+
+def map_to_int(symbols, symbol_to_int):
+    """
+    Function to map a sequence of symbols (notes or durations) to integers at once:
+    The Dictionary lookup is mapped over the sequence directly into a NumPy array
+    without building intermediate lists.
+    Returns an integer array (see get_token_dtype).
+    """
+    return fromiter(map(symbol_to_int.__getitem__, symbols),
+                    dtype=get_token_dtype(len(symbol_to_int)), count=len(symbols))
+
+def encode_dur(dur):
+    """
+    Small helper Function to save a duration (float or Fraction) as [numerator, denominator].
+    """
+    dur = Fraction(dur)
+    return [dur.numerator, dur.denominator]
+
+def decode_dur(dur):
+    """
+    Small helper Function to restore a duration from [numerator, denominator]
+    The Token 0 stays an integer, every other duration is a float or a Fraction like in music21.
+    """
+    numerator, denominator = dur
+    if numerator == 0:
+        return 0
+    return to_quarter_length(Fraction(numerator, denominator))
+
+def find_lick_offsets(note_ints, start_val):
+    """
+    Function to find the licks in a sequence of notes (mapped to integers).
+    Returns an array with a shape of ( n_licks, 2 ) with the first and the last + 1 position
+    of every lick, since the licks are seperated by START Tokens.
+    """
+    is_note = note_ints != start_val
+    previous_is_note = concatenate([[False], is_note[:-1]])
+    next_is_note = concatenate([is_note[1:], [False]])
+    starts = flatnonzero(is_note & ~previous_is_note)
+    ends = flatnonzero(is_note & ~next_is_note) + 1
+    return stack([starts, ends], axis=1).astype(int64)
+
+def save_corpus(notes, durs, note_to_int, dur_to_int, folder, length=17, files=None):
+    """
+    Function to save the notes and durations (see midi_tools.extract_notes_and_duration)
+    in a corpus folder:
+    > notes.npy / durs.npy: The notes/durations mapped to integers (uint8 or uint16)
+    > offsets.npy: The first and the last + 1 position of every lick
+    > meta.json: Version, sequence length and the vocabularies (ordered by their integer value)
+    > files.json: The midi files of the corpus (optional, see save_corpus_arrays)
+    """
+    save_corpus_arrays(map_to_int(notes, note_to_int), map_to_int(durs, dur_to_int), note_to_int, dur_to_int,
+                       folder, length=length, files=files)
+
+def save_corpus_arrays(note_ints, dur_ints, note_to_int, dur_to_int, folder, length=17, files=None):
+    """
+    Function to save notes and durations which are already mapped to integers in a corpus folder (see save_corpus).
+    Files is a list of the midi files of the corpus as [path, modification time, size]
+    (see midi_tools.get_cache_key), so new midi files can be added later (see incremental.update_corpus).
+    """
+    makedirs(folder, exist_ok=True)
+
+    save(path.join(folder, 'notes.npy'), note_ints)
+    save(path.join(folder, 'durs.npy'), dur_ints)
+    save(path.join(folder, 'offsets.npy'), find_lick_offsets(note_ints, note_to_int['START']))
+
+    meta = {'version': CORPUS_VERSION,
+            'length': length,
+            'notes': sorted(note_to_int, key=note_to_int.get),
+            'durs': [encode_dur(dur) for dur in sorted(dur_to_int, key=dur_to_int.get)]}
+    with open(path.join(folder, 'meta.json'), 'w') as store:
+        dump(meta, store)
+
+    if files is not None:
+        with open(path.join(folder, 'files.json'), 'w') as store:
+            dump([list(file_key) for file_key in files], store)
+
+def extend_vocabulary(symbol_to_int, symbols):
+    """
+    Function to append the unknown symbols (notes or durations) to a vocabulary:
+    The known symbols keep their integers, the new symbols get the next integers (sorted like build_note_dict).
+    Returns the extended Dictionary and the list of the new symbols.
+    """
+    new_symbols = sorted(set(symbols) - set(symbol_to_int))
+    extended = dict(symbol_to_int)
+    for symbol in new_symbols:
+        extended[symbol] = len(extended)
+    return extended, new_symbols
+
+def load_vocabulary(folder):
+    """
+    Small helper Function which returns the vocabularies (note_to_int, dur_to_int) of a corpus folder
+    without loading its arrays (None, None if there is no corpus).
+    """
+    if not path.exists(path.join(folder, 'meta.json')):
+        return None, None
+    with open(path.join(folder, 'meta.json'), 'r') as stored:
+        meta = load(stored)
+    return ({note: idx for idx, note in enumerate(meta['notes'])},
+            {decode_dur(dur): idx for idx, dur in enumerate(meta['durs'])})
+
+def keep_vocabulary(folder, note_to_int, dur_to_int):
+    """
+    Function to keep the integers of an existing corpus folder when it is saved again:
+    The notes/durations of the saved vocabulary keep their integers (even if they are not part of the new data),
+    the new notes/durations are appended (see extend_vocabulary). So trained (or grown, see incremental.grow_model)
+    weights stay valid after a new extraction.
+    Returns the vocabularies (unchanged if there is no corpus).
+    """
+    known_notes, known_durs = load_vocabulary(folder)
+    if known_notes is None:
+        return note_to_int, dur_to_int
+    return extend_vocabulary(known_notes, note_to_int)[0], extend_vocabulary(known_durs, dur_to_int)[0]
+
+def load_corpus_files(folder):
+    """
+    Small helper Function which returns the midi files of a corpus folder as [path, modification time, size]
+    (None if the corpus was saved without its midi files).
+    """
+    if not path.exists(path.join(folder, 'files.json')):
+        return None
+    with open(path.join(folder, 'files.json'), 'r') as stored:
+        return load(stored)
+
+def load_corpus(folder, mmap=True):
+    """
+    Function to load a corpus folder (see save_corpus).
+    If mmap is set the arrays are memory-mapped instead of read into memory.
+    Returns a Dictionary with:
+    > notes, durs, offsets: The arrays of the corpus
+    > length: The sequence length
+    > note_to_int, int_to_note, dur_to_int, int_to_dur: The vocabularies
+    """
+    with open(path.join(folder, 'meta.json'), 'r') as binaries:
+        meta = load(binaries)
+
+    if meta['version'] != CORPUS_VERSION:
+        raise ValueError(f'Corpus version {meta["version"]} is not supported (expected {CORPUS_VERSION})')
+
+    mmap_mode = 'r' if mmap else None
+    int_to_note = dict(enumerate(meta['notes']))
+    int_to_dur = {idx: decode_dur(dur) for idx, dur in enumerate(meta['durs'])}
+
+    return {'notes': np_load(path.join(folder, 'notes.npy'), mmap_mode=mmap_mode),
+            'durs': np_load(path.join(folder, 'durs.npy'), mmap_mode=mmap_mode),
+            'offsets': np_load(path.join(folder, 'offsets.npy'), mmap_mode=mmap_mode),
+            'length': meta['length'],
+            'note_to_int': {val: key for key, val in int_to_note.items()},
+            'int_to_note': int_to_note,
+            'dur_to_int': {val: key for key, val in int_to_dur.items()},
+            'int_to_dur': int_to_dur}
+
+def get_windows(corpus):
+    """
+    Function to derive the sequential inputs of the network from a corpus (see midi_tools.generate_sequence).
+    Returns 2 read-only views with a shape of ( m, length ) for notes and durations - no data is copied.
+    """
+    length = corpus['length']
+    note_windows = sliding_window_view(corpus['notes'], length)[:-1]
+    dur_windows = sliding_window_view(corpus['durs'], length)[:-1]
+    return note_windows, dur_windows
+
+def get_packed_windows(corpus):
+    """
+    Function to find the windows of a corpus whose output belongs to a lick:
+    Every note of a lick + the first Token after the lick (the end of the lick).
+    The other windows only contain Tokens (the padding between 2 licks) and predict a Token.
+    Returns the indices of the windows (position of the output - length, like get_windows).
+    """
+    length, n_tokens = corpus['length'], len(corpus['notes'])
+    starts = corpus['offsets'][:, 0]
+    # The Token after the lick (if the corpus doesn't end with the lick)
+    ends = minimum(corpus['offsets'][:, 1], n_tokens - 1)
+    sizes = ends - starts + 1
+    # Every position from the start to the end of every lick
+    positions = repeat(starts - (sizes.cumsum() - sizes), sizes) + arange(sizes.sum())
+    return positions - length
+
+def get_packed_inputs(corpus, window_indices):
+    """
+    Function to build the packed windows for window indices (see get_packed_windows):
+    A window only contains the notes/durations of its own lick + the START/0 Token in front of the lick,
+    every position in front of it is padded with PAD. The tokens are shifted by 1, so the network can mask
+    the padding (see jazz_lstm.generate_lstm_model with mask_zero).
+    Returns 2 arrays with a shape of ( m, length ) for notes and durations.
+    """
+    length = corpus['length']
+    outputs = array(window_indices, dtype=int64) + length
+    lick_starts = corpus['offsets'][:, 0][(searchsorted(corpus['offsets'][:, 0], outputs, side='right') - 1).clip(min=0)]
+    positions = outputs[:, None] - length + arange(length)
+    # The Token in front of the lick is the first position of the window
+    in_lick = positions >= (lick_starts - 1)[:, None]
+    positions = positions.clip(min=0)
+    return (where(in_lick, corpus['notes'][positions].astype(int64) + 1, PAD),
+            where(in_lick, corpus['durs'][positions].astype(int64) + 1, PAD))
+
+def pack_windows(note_windows, dur_windows, start_val):
+    """
+    Function to convert windows of a generation (leading START/0 Tokens + the generated notes/durations)
+    into packed windows like get_packed_inputs: Only the last leading START/0 Token is kept,
+    every position in front of it is padded with PAD, the other tokens are shifted by 1.
+    Returns 2 arrays with the shape of the windows ( m, length ).
+    """
+    note_windows, dur_windows = asarray(note_windows, dtype=int64), asarray(dur_windows, dtype=int64)
+    leading = cumprod(note_windows == start_val, axis=1).astype(bool)
+    # Leading Tokens which are followed by another leading Token
+    padding = zeros(note_windows.shape, dtype=bool)
+    padding[:, :-1] = leading[:, :-1] & leading[:, 1:]
+    return where(padding, PAD, note_windows + 1), where(padding, PAD, dur_windows + 1)
+
+def get_packing_stats(corpus):
+    """
+    Function to compare the windows of a corpus with the packed windows (see get_packed_windows).
+    Returns a Dictionary with the amount of windows, the amount of packed windows and the reduction.
+    """
+    n_windows = len(corpus['notes']) - corpus['length']
+    n_packed = len(get_packed_windows(corpus))
+    return {'windows': n_windows, 'packed_windows': n_packed, 'reduction': 1 - n_packed / n_windows}
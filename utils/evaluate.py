@@ -2,7 +2,13 @@
 
 import seaborn as sns
 import matplotlib.pyplot as plt
+from os import path
+from math import ceil
 from scipy import stats
+from pandas import DataFrame
+from numpy import (arange, zeros, add, concatenate, bincount, broadcast_to, stack,
+                   sqrt, where, abs as np_abs, int64)
+from utils.corpus import map_to_int, find_lick_offsets
 
 def extract_lick_elements(licks):
     """
@@ -13,9 +19,12 @@ def extract_lick_elements(licks):
             if element != "START" and element != 0:
                 vector.append(element)
             # Indicates if the Lick is terminated
-            elif (licks[idx + 1] == "START" or licks[idx + 1] == 0) and vector:
+            elif vector and (idx + 1 == len(licks) or licks[idx + 1] == "START" or licks[idx + 1] == 0):
                 vectors.append(vector)
                 vector = []
+    # The last Lick is not followed by Tokens
+    if vector:
+        vectors.append(vector)
     return vectors
 
 def transform_licks(licks, transformer):
@@ -33,14 +42,36 @@ def transform_licks(licks, transformer):
     overall_transformed = [element for sublist in licks_transformed for element in sublist]
     return licks_transformed, overall_transformed
 
-def comparing_boxplot(overall_arrays, epochs, title, filename):
+def get_grid_shape(n, max_cols=2):
+    """
+    Small helper Function which returns the rows and columns of a subplot grid for n plots
+    (at most max_cols columns, e.g. 3 x 2 for 6 epochs).
+    """
+    cols = max(1, min(n, max_cols))
+    return ceil(n / cols), cols
+
+def finish_figure(fig, filename, folder='imgs', dpi=250, show=True):
+    """
+    Small helper Function which saves a figure as {folder}/{filename}.png and shows it,
+    without show (e.g. for a headless rendering, see evaluation_runner) the figure is closed instead.
+    """
+    fig.savefig(path.join(folder, f'{filename}.png'), dpi=dpi)
+    if show:
+        plt.show()
+    else:
+        plt.close(fig)
+
+def comparing_boxplot(overall_arrays, epochs, title, filename, show=True, dpi=250, folder='imgs'):
     """
     This Function creates 2 Boxplots which shows the data distribution of the overall-array,
     which helps to show similarity and differences.
+    The width of the figure grows with the amount of epochs, the figure is saved as {folder}/{filename}.png
+    (see finish_figure for show).
     """
     sns.set()
     n = len(overall_arrays)
-    fig, axes = plt.subplots(1, n, sharey=True, figsize=(6, 6))
+    fig, axes = plt.subplots(1, n, sharey=True, figsize=(max(6, 0.9 * n), 6), squeeze=False)
+    axes = axes[0]
     fig.tight_layout()
     for index, array in enumerate(overall_arrays):
         sns.boxplot(array, ax=axes[index])
@@ -51,8 +82,7 @@ def comparing_boxplot(overall_arrays, epochs, title, filename):
         else:
             axes[index].title.set_text(f"Ep={epoch}")
         axes[index].tick_params(axis='x', which='both', bottom=False, top=False, labelbottom=False)
-    plt.show()
-    fig.savefig(f'imgs/{filename}.png', dpi=250)
+    finish_figure(fig, filename, folder, dpi, show)
 
 def show_p_val(test_array_note, test_array_dur, overall_notes, overall_durs, epoch):
     """
@@ -74,23 +104,188 @@ def show_p_vals(test_array_note, test_array_dur, overall_notes, overall_durs, ep
         show_p_val(test_array_note[index], test_array_dur[index], 
                    overall_notes, overall_durs, epoch)
 
-def plot_data_distribution(overall, overall_gen, title, epochs, filename):
+def plot_data_distribution(overall, overall_gen, title, epochs, filename, show=True, dpi=250, folder='imgs', max_cols=2):
     """
     Function to make Subplot of all Data Distribution (Density)
-    for generated Licks at certain epochs
+    for generated Licks at certain epochs.
+    The grid is sized to the amount of epochs (see get_grid_shape), unused subplots are hidden.
+    The figure is saved as {folder}/{filename}.png (see finish_figure for show).
     """
     sns.set()
-    fig, axes = plt.subplots(3, 2, sharey=True, figsize=(10, 10))
+    rows, cols = get_grid_shape(len(epochs), max_cols)
+    fig, axes = plt.subplots(rows, cols, sharey=True, figsize=(5 * cols, 10 / 3 * rows), squeeze=False)
     fig.tight_layout()
-    outer_index = 0
-    for i in range(3):
-        for j in range(2):
-            epoch = epochs[outer_index]
-            array = overall_gen[outer_index]
-            sns.histplot(overall, kde=True, ax=axes[i, j])
-            sns.histplot(array, kde=True, ax=axes[i, j])
-            axes[i, j].title.set_text(f"Ep={epoch}")
-            outer_index += 1
+    for outer_index, ax in enumerate(axes.flat):
+        if outer_index >= len(epochs):
+            ax.set_visible(False)
+            continue
+        sns.histplot(overall, kde=True, ax=ax)
+        sns.histplot(overall_gen[outer_index], kde=True, ax=ax)
+        ax.title.set_text(f"Ep={epochs[outer_index]}")
     fig.suptitle(title, y=1.05)
-    fig.savefig(f'imgs/{filename}.png', dpi=250)
-    plt.show()
+    finish_figure(fig, filename, folder, dpi, show)
+
+def get_lick_mask(offsets, size):
+    """
+    Function to mark every position of a token sequence which belongs to a lick
+    (see corpus.find_lick_offsets) - the vectorized version of extract_lick_elements.
+    Returns a boolean array with the length size.
+    """
+    marks = zeros(size + 1, dtype=int64)
+    add.at(marks, offsets[:, 0], 1)
+    add.at(marks, offsets[:, 1], -1)
+    return marks.cumsum()[:-1] > 0
+
+def encode_licks(notes, durs, note_to_int, dur_to_int):
+    """
+    Function to map the notes and durations (see midi_tools.extract_notes_and_duration)
+    to integer arrays with a shared vocabulary.
+    Returns a Dictionary with the notes, durs and offsets of the licks like a corpus (see corpus.load_corpus).
+    """
+    note_ints = map_to_int(notes, note_to_int)
+    return {'notes': note_ints,
+            'durs': map_to_int(durs, dur_to_int),
+            'offsets': find_lick_offsets(note_ints, note_to_int['START'])}
+
+def count_tokens(corpora, key, vocab_size):
+    """
+    Function to calculate the histograms of the notes or durations (key) of multiple corpora
+    with a single bincount: Every token is shifted by the index of its corpus * vocab_size.
+    Only tokens inside a lick are counted.
+    Returns an array with a shape of ( n_corpora, vocab_size ).
+    """
+    shifted = [corpus[key][get_lick_mask(corpus['offsets'], len(corpus[key]))].astype(int64) + idx * vocab_size
+               for idx, corpus in enumerate(corpora)]
+    counts = bincount(concatenate(shifted), minlength=len(corpora) * vocab_size)
+    return counts.reshape(len(corpora), vocab_size)
+
+def histogram_moments(histograms):
+    """
+    Calculates the size, the mean and the (sample) variance of the samples behind histograms
+    with a shape of ( n, vocab_size ) - the value of a token is its integer.
+    """
+    values = arange(histograms.shape[1])
+    n = histograms.sum(axis=1)
+    mean = histograms @ values / n
+    var = (histograms * (values - mean[:, None]) ** 2).sum(axis=1) / (n - 1)
+    return n, mean, var
+
+def ttest_from_histograms(train_histogram, histograms):
+    """
+    T-test (like stats.ttest_ind with equal variances) of the training data against every
+    generated histogram, calculated from the moments of the histograms.
+    Returns the t statistics and the p values.
+    """
+    n_train, mean_train, var_train = histogram_moments(train_histogram[None])
+    n_gen, mean_gen, var_gen = histogram_moments(histograms)
+    dof = n_train + n_gen - 2
+    pooled_var = ((n_train - 1) * var_train + (n_gen - 1) * var_gen) / dof
+    t = (mean_train - mean_gen) / sqrt(pooled_var * (1 / n_train + 1 / n_gen))
+    return t, 2 * stats.t.sf(np_abs(t), dof)
+
+def ks_from_histograms(train_histogram, histograms):
+    """
+    Two sample Kolmogorov-Smirnov test of the training data against every generated histogram:
+    The statistic is the largest distance of the cumulative distributions.
+    Returns the statistics and the (asymptotic) p values.
+    """
+    train_cdf = train_histogram.cumsum() / train_histogram.sum()
+    cdfs = histograms.cumsum(axis=1) / histograms.sum(axis=1, keepdims=True)
+    d = np_abs(cdfs - train_cdf).max(axis=1)
+    n_train, n_gen = train_histogram.sum(), histograms.sum(axis=1)
+    return d, stats.kstwo.sf(d, (n_train * n_gen / (n_train + n_gen)).round()).clip(0, 1)
+
+def chi2_from_histograms(train_histogram, histograms):
+    """
+    Chi-square test of independence (like stats.chi2_contingency without correction)
+    of the training data against every generated histogram.
+    Tokens which appear in neither of the 2 datasets are ignored.
+    Returns the statistics, the degrees of freedom and the p values.
+    """
+    # Contingency tables with a shape of ( n, 2, vocab_size )
+    tables = stack([broadcast_to(train_histogram, histograms.shape), histograms], axis=1)
+    col_totals = tables.sum(axis=1, keepdims=True)
+    row_totals = tables.sum(axis=2, keepdims=True)
+    expected = row_totals * col_totals / tables.sum(axis=(1, 2), keepdims=True)
+
+    used = col_totals > 0
+    chi2 = where(used, (tables - expected) ** 2 / where(used, expected, 1), 0).sum(axis=(1, 2))
+    dof = used.sum(axis=(1, 2)) - 1
+    return chi2, dof, stats.chi2.sf(chi2, dof)
+
+def evaluate_corpora(training, generated, epochs, note_to_int, dur_to_int, scale='both', send_histograms=False):
+    """
+    Function to compare the pitches and durations of generated licks with the training data.
+    training and every element of generated are Dictionaries with the notes, durs and offsets
+    (see encode_licks) with the same vocabulary (note_to_int, dur_to_int).
+    The histograms of all epochs are calculated in one pass (see count_tokens), every test
+    is calculated for all epochs at once based on these histograms.
+    Returns a DataFrame with one row per epoch and feature ('pitch' or 'duration'):
+    > n_train, n_generated, mean_train, mean_generated: Amount and mean of the integers
+    > t_stat, p_ttest: T-test (see show_p_val)
+    > ks_stat, p_ks: Kolmogorov-Smirnov test
+    > chi2_stat, dof, p_chi2: Chi-square test
+    send_histograms will additionally return a DataFrame with the count of every token
+    per epoch and feature (the training data has the epoch 0).
+    """
+    results, histogram_rows = [], []
+    features = [('pitch', 'notes', note_to_int), ('duration', 'durs', dur_to_int)]
+    for feature, key, symbol_to_int in features:
+        histograms = count_tokens([training] + list(generated), key, len(symbol_to_int))
+        train_histogram, gen_histograms = histograms[0], histograms[1:]
+
+        n_train, mean_train, _ = histogram_moments(train_histogram[None])
+        n_gen, mean_gen, _ = histogram_moments(gen_histograms)
+        t, p_t = ttest_from_histograms(train_histogram, gen_histograms)
+        d, p_ks = ks_from_histograms(train_histogram, gen_histograms)
+        chi2, dof, p_chi2 = chi2_from_histograms(train_histogram, gen_histograms)
+
+        results += [{'scale': scale, 'epoch': epoch, 'feature': feature,
+                     'n_train': int(n_train[0]), 'n_generated': int(n_gen[idx]),
+                     'mean_train': mean_train[0], 'mean_generated': mean_gen[idx],
+                     't_stat': t[idx], 'p_ttest': p_t[idx],
+                     'ks_stat': d[idx], 'p_ks': p_ks[idx],
+                     'chi2_stat': chi2[idx], 'dof': int(dof[idx]), 'p_chi2': p_chi2[idx]}
+                    for idx, epoch in enumerate(epochs)]
+
+        if send_histograms:
+            symbols = sorted(symbol_to_int, key=symbol_to_int.get)
+            histogram_rows += [{'scale': scale, 'epoch': epoch, 'feature': feature,
+                                'token': symbols[token], 'value': token, 'count': int(count)}
+                               for epoch, histogram in zip([0] + list(epochs), histograms)
+                               for token, count in enumerate(histogram) if count]
+
+    if send_histograms:
+        return DataFrame(results), DataFrame(histogram_rows)
+    return DataFrame(results)
+
+def evaluate_epochs(test_folder, epochs, scale='both', length=17, send_histograms=False, **extract_args):
+    """
+    Function to evaluate the generated licks of several epoch folders (e.g. 'Ep5_Test')
+    in generated_midi/{scale} against the training data of the scale like in notebook 3.
+    The training data of 'both' contains the diatonic and alterated licks, an epoch folder
+    only contains its own licks (like evaluation_runner.run_evaluation).
+    Every folder is extracted only once, the notes/durations of all folders are mapped to
+    a shared vocabulary (see build_note_dict), so the integers are comparable.
+    Additional arguments (e.g. workers, reader, cache_folder) are passed to extract_notes_and_duration,
+    the midi files are only cached if a cache_folder is passed.
+    Returns the results of evaluate_corpora.
+    """
+    # Local import: midi_tools loads music21
+    from utils.midi_tools import extract_notes_and_duration, build_note_dict
+
+    extract_args = {'cache_folder': None, **extract_args}
+    both = scale == 'both'
+    train_scale = 'diatonic' if both else scale
+    token_lists = [extract_notes_and_duration(scale=train_scale, show=False, both=both, length=length,
+                                              save_data=False, **extract_args)]
+    # An epoch folder only contains its own licks (both=True would add the licks of generated_midi/diatonic)
+    token_lists += [extract_notes_and_duration(scale=f'{scale}/{folder}', show=False, both=False, length=length,
+                                               folder='generated_midi', save_data=False, **extract_args)
+                    for folder in test_folder]
+
+    note_to_int, dur_to_int = build_note_dict([note for notes, _ in token_lists for note in notes],
+                                              [dur for _, durs in token_lists for dur in durs])
+    corpora = [encode_licks(notes, durs, note_to_int, dur_to_int) for notes, durs in token_lists]
+    return evaluate_corpora(corpora[0], corpora[1:], epochs, note_to_int, dur_to_int,
+                            scale=scale, send_histograms=send_histograms)
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+This Python File contains an evaluation runner which creates the validation report of notebook 3
+(distribution tests, overfitting rates and figures of every scale and epoch folder) at once:
+> Every (scale, epoch folder) job is extracted and checked for copied licks in a process pool,
+  the results are cached on disk (stored/evaluation) under a hash of the midi files of the job,
+  so only changed or new folders are evaluated again
+> The statistical tests of a scale are calculated for all epochs at once (see evaluate.evaluate_corpora)
+> Every figure is rendered headless (Agg backend) in the process pool, layouts are sized to the amount
+  of epochs and a figure is only rendered again if its data changed
+"""
+
+from os import path, makedirs, environ, replace, getpid, cpu_count
+from json import dump, dumps, load
+from hashlib import sha1
+from pickle import dump as pickle_dump, load as pickle_load, dumps as pickle_dumps
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+
+# Version of the cached results: A new version invalidates every cached job
+EVALUATION_VERSION = 2
+SCALES = ('both', 'diatonic', 'alterated')
+
+# Titles and filenames of the figures of notebook 3
+FIGURE_NAMES = {'both': {'boxplot': ('Compare Pitch Distribution of Both-scaled Licks', 'Boxplots_Both_scales'),
+                         'label': 'Both Scales', 'file': 'both_scales', 'overfitting': 'Both'},
+                'diatonic': {'boxplot': ('Compare Pitch Distribution of Diatonic Licks', 'Boxplots_diatonic'),
+                             'label': 'Diatonic', 'file': 'diatonic', 'overfitting': 'Diatonic'},
+                'alterated': {'boxplot': ('Compare Pitch Distribution of Alterated Licks', 'Boxplots_alterated'),
+                              'label': 'Alterated', 'file': 'alterated', 'overfitting': 'Alterated'}}
+
+def set_headless(threads=1):
+    """
+    Initializer of the process pool: Figures are rendered without a display (Agg backend)
+    and every process uses threads threads for the math libraries.
+    The environment variables have to be set before numpy/matplotlib are imported.
+    """
+    environ['MPLBACKEND'] = 'Agg'
+    for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']:
+        environ[variable] = str(threads)
+
+def get_training_files(scale, folder='data'):
+    """
+    Small helper Function which returns the (sorted) midi files of the training data of a scale:
+    'both' contains the diatonic and alterated training data.
+    """
+    from utils.midi_tools import read_midi_data
+
+    both = scale == 'both'
+    midi_data, _ = read_midi_data('diatonic' if both else scale, both, folder=folder)
+    return sorted(midi_data)
+
+def get_epoch_files(scale, epoch_folder, folder='generated_midi'):
+    """
+    Small helper Function which returns the (sorted) midi files of an epoch folder (e.g. generated_midi/both/Ep5_Test).
+    """
+    from utils.midi_tools import read_midi_data
+
+    midi_data, _ = read_midi_data(f'{scale}/{epoch_folder}', both=False, folder=folder)
+    return sorted(midi_data)
+
+def hash_files(midi_files):
+    """
+    Function to hash the content of midi files (+ their names):
+    The hash only changes if a midi file is changed, added, removed or renamed.
+    """
+    files_hash = sha1()
+    for midi_file in midi_files:
+        with open(midi_file, 'rb') as binaries:
+            files_hash.update(f'{path.basename(midi_file)}:{sha1(binaries.read()).hexdigest()};'.encode())
+    return files_hash.hexdigest()
+
+def get_job_key(kind, **params):
+    """
+    Small helper Function which returns the key of a cached job: A hash of the kind of the job,
+    its parameters (incl. the hashes of its midi files) and the version of the cached results.
+    """
+    return sha1(dumps({'kind': kind, 'version': EVALUATION_VERSION, **params}, sort_keys=True).encode()).hexdigest()
+
+def load_cached_result(key, cache_folder):
+    """
+    Function to load the cached result of a job (None if the job is not cached).
+    """
+    cache_file = path.join(cache_folder, f'{key}.pkl')
+    if not path.exists(cache_file):
+        return None
+    with open(cache_file, 'rb') as binaries:
+        return pickle_load(binaries)
+
+def store_cached_result(key, result, cache_folder):
+    """
+    Function to save the result of a job in the cache (under a temporary name first like midi_tools.store_cached_lick).
+    """
+    cache_file = path.join(cache_folder, f'{key}.pkl')
+    temp_file = f'{cache_file}.{getpid()}.tmp'
+    with open(temp_file, 'wb') as store:
+        pickle_dump(result, store)
+    replace(temp_file, cache_file)
+
+def get_tokens(midi_files, length=17, parse_cache=None, reader='music21', send_files=False):
+    """
+    Function to get the notes and durations of midi files with START/0 Tokens in front of every lick
+    like midi_tools.extract_notes_and_duration (the parsed midi files are cached in parse_cache if it is set).
+    If send_files is set, the midi file of every lick is returned as well (midi files without notes
+    contain no lick, see evaluate.extract_lick_elements).
+    """
+    from utils.midi_tools import parse_midi_files
+
+    licks, _ = parse_midi_files(midi_files, cache_folder=parse_cache, reader=reader)
+    notes, durs, lick_files = [], [], []
+    for midi_file, (lick_notes, lick_durs) in zip(midi_files, licks):
+        notes += length * ['START'] + lick_notes
+        durs += length * [0] + lick_durs
+        if lick_notes:
+            lick_files.append(midi_file)
+    if send_files:
+        return notes, durs, lick_files
+    return notes, durs
+
+def evaluate_training(midi_files, length=17, parse_cache=None, reader='music21'):
+    """
+    Job of the process pool: Extracts the training data of a scale.
+    Returns a Dictionary with the notes, durations and the note sequences of the licks.
+    """
+    from utils.evaluate import extract_lick_elements
+
+    notes, durs = get_tokens(midi_files, length, parse_cache, reader)
+    return {'notes': notes, 'durs': durs, 'licks': extract_lick_elements(notes)}
+
+def evaluate_epoch_folder(midi_files, training_licks, length=17, parse_cache=None, reader='music21'):
+    """
+    Job of the process pool: Extracts the generated licks of an epoch folder and compares them with
+    the training licks (see check_overfitting.overfitting_rate).
+    Returns a Dictionary with the notes, durations, the overfitting rate, the names of the viable licks
+    and the length of the longest copied note subsequence of every lick.
+    """
+    from utils.evaluate import extract_lick_elements
+    from utils.check_overfitting import build_lick_index, is_copied, longest_copied_subsequence
+
+    notes, durs, lick_files = get_tokens(midi_files, length, parse_cache, reader, send_files=True)
+    generated_licks = extract_lick_elements(notes)
+    training_index = build_lick_index(training_licks)
+    viable = [not is_copied(lick, training_index) for lick in generated_licks]
+    return {'notes': notes, 'durs': durs,
+            'overfitting_rate': sum(viable) / len(generated_licks) if generated_licks else float('nan'),
+            'viable_names': [path.basename(midi_file) for midi_file, is_viable in zip(lick_files, viable) if is_viable],
+            'copied_lengths': [longest_copied_subsequence(lick, training_index)[0] for lick in generated_licks]}
+
+def run_jobs(executor, jobs, cache_folder):
+    """
+    Function to run jobs (key => (function, arguments)) in the process pool, cached jobs are loaded from the cache.
+    Returns a Dictionary key => result and the amount of cached jobs.
+    """
+    results = {key: load_cached_result(key, cache_folder) for key in jobs}
+    futures = {key: executor.submit(function, *args) for key, (function, args) in jobs.items() if results[key] is None}
+    for key, future in futures.items():
+        results[key] = future.result()
+        store_cached_result(key, results[key], cache_folder)
+    return results, len(jobs) - len(futures)
+
+def render_figure(plot_name, args, kwargs):
+    """
+    Job of the process pool: Renders a figure of evaluate/check_overfitting without showing it.
+    """
+    from utils.evaluate import comparing_boxplot, plot_data_distribution
+    from utils.check_overfitting import plot_overfitting_rate
+
+    plots = {'comparing_boxplot': comparing_boxplot, 'plot_data_distribution': plot_data_distribution,
+             'plot_overfitting_rate': plot_overfitting_rate}
+    plots[plot_name](*args, show=False, **kwargs)
+
+def build_figures(scale, training, folders, epochs, img_folder='imgs', dpi=250):
+    """
+    Function to build the figures of a scale like notebook 3: Boxplots of the pitches,
+    distributions of the pitches and durations per epoch and the overfitting rates.
+    The notes/durations of the training data and every epoch folder are mapped to a shared vocabulary.
+    Returns a list of (filename, plot name, arguments, keyword arguments).
+    """
+    from utils.evaluate import extract_lick_elements, transform_licks
+    from utils.midi_tools import build_note_dict
+
+    note_to_int, dur_to_int = build_note_dict(training['notes'] + [note for folder in folders for note in folder['notes']],
+                                              training['durs'] + [dur for folder in folders for dur in folder['durs']])
+    overall_notes = transform_licks(extract_lick_elements(training['notes']), note_to_int)[1]
+    overall_durs = transform_licks(extract_lick_elements(training['durs']), dur_to_int)[1]
+    notes_gen = [transform_licks(extract_lick_elements(folder['notes']), note_to_int)[1] for folder in folders]
+    durs_gen = [transform_licks(extract_lick_elements(folder['durs']), dur_to_int)[1] for folder in folders]
+
+    names = FIGURE_NAMES[scale]
+    options = {'dpi': dpi, 'folder': img_folder}
+    box_title, box_file = names['boxplot']
+    return [(box_file, 'comparing_boxplot', ([overall_notes] + notes_gen, [0] + list(epochs), box_title, box_file), options),
+            (f'Histplot_notes_{names["file"]}', 'plot_data_distribution',
+             (overall_notes, notes_gen, f'Data Distribution Notes - {names["label"]}', list(epochs),
+              f'Histplot_notes_{names["file"]}'), options),
+            (f'Histplot_durs_{names["file"]}', 'plot_data_distribution',
+             (overall_durs, durs_gen, f'Data Distribution Durs - {names["label"]}', list(epochs),
+              f'Histplot_durs_{names["file"]}'), options),
+            (f'overfitting_scores_{names["overfitting"]}', 'plot_overfitting_rate',
+             ([folder['overfitting_rate'] for folder in folders], names['overfitting']), {'epochs': list(epochs), **options})]
+
+def render_figures(executor, figures, cache_folder, img_folder='imgs'):
+    """
+    Function to render figures (see build_figures) in the process pool.
+    A figure is only rendered if its data changed since the last rendering (hashes in {cache_folder}/figures.json)
+    or the image doesn't exist.
+    Returns the amount of rendered and skipped figures.
+    """
+    hash_file = path.join(cache_folder, 'figures.json')
+    rendered_hashes = {}
+    if path.exists(hash_file):
+        with open(hash_file, 'r') as stored:
+            rendered_hashes = load(stored)
+
+    futures = {}
+    for filename, plot_name, args, kwargs in figures:
+        figure_hash = sha1(pickle_dumps((plot_name, args, kwargs, EVALUATION_VERSION))).hexdigest()
+        if rendered_hashes.get(filename) == figure_hash and path.exists(path.join(img_folder, f'{filename}.png')):
+            continue
+        futures[filename] = (figure_hash, executor.submit(render_figure, plot_name, args, kwargs))
+
+    for filename, (figure_hash, future) in futures.items():
+        future.result()
+        rendered_hashes[filename] = figure_hash
+    with open(hash_file, 'w') as store:
+        dump(rendered_hashes, store, indent=2)
+    return len(futures), len(figures) - len(futures)
+
+def run_evaluation(test_folder, epochs, scales=SCALES, length=17, workers=None, cache_folder='stored/evaluation',
+                   parse_cache=None, reader='music21', render=True, img_folder='imgs', dpi=250,
+                   data_folder='data', generated_folder='generated_midi', show=True):
+    """
+    Function to create the validation report of notebook 3 for every scale and epoch folder:
+    > test_folder: Epoch folders in generated_midi/{scale} (e.g. ['Ep5_Test', 'Ep35_Test']), epochs: Their epochs
+    > workers: Amount of processes (default: one per job, at most the cpu cores)
+    > cache_folder: Folder of the cached jobs and the hashes of the rendered figures
+    > parse_cache: Folder of the parsed midi files (see midi_tools.parse_midi_files), None: No cache
+    > render: Renders every figure of notebook 3 into img_folder (without showing them)
+    The training data of 'both' contains the diatonic and alterated licks, an epoch folder
+    only contains its own licks.
+    Returns a Dictionary with:
+    > results: DataFrame of the distribution tests (see evaluate.evaluate_corpora) of every scale
+    > overfitting: DataFrame with the overfitting rate and the mean copied length of every scale and epoch
+    > viable_names: Dictionary scale => list of the names of the viable licks per epoch folder
+    > stats: Amount of cached/evaluated jobs and rendered/skipped figures
+    """
+    from pandas import DataFrame, concat
+    from utils.evaluate import encode_licks, evaluate_corpora
+    from utils.midi_tools import build_note_dict
+
+    if len(test_folder) != len(epochs):
+        raise ValueError(f'Every epoch folder needs its epoch: {len(test_folder)} folders, {len(epochs)} epochs')
+    makedirs(cache_folder, exist_ok=True)
+    if render:
+        makedirs(img_folder, exist_ok=True)
+
+    # Hash the midi files of every job
+    training_files = {scale: get_training_files(scale, data_folder) for scale in scales}
+    epoch_files = {(scale, folder): get_epoch_files(scale, folder, generated_folder)
+                   for scale in scales for folder in test_folder}
+    params = {'length': length, 'reader': reader}
+    training_keys = {scale: get_job_key('training', scale=scale, files=hash_files(training_files[scale]), **params)
+                     for scale in scales}
+
+    n_jobs = len(training_files) + len(epoch_files)
+    workers = workers or max(1, min(n_jobs, cpu_count() or 1))
+    stats = {}
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'), initializer=set_headless) as executor:
+        # 1: Training data of every scale
+        jobs = {training_keys[scale]: (evaluate_training, (training_files[scale], length, parse_cache, reader))
+                for scale in scales}
+        training_results, stats['cached_training'] = run_jobs(executor, jobs, cache_folder)
+        training = {scale: training_results[training_keys[scale]] for scale in scales}
+
+        # 2: Every epoch folder of every scale (depends on the training data of its scale)
+        epoch_keys = {job: get_job_key('epoch', scale=job[0], folder=job[1], files=hash_files(midi_files),
+                                       training=training_keys[job[0]], **params)
+                      for job, midi_files in epoch_files.items()}
+        jobs = {epoch_keys[job]: (evaluate_epoch_folder, (midi_files, training[job[0]]['licks'], length,
+                                                          parse_cache, reader))
+                for job, midi_files in epoch_files.items()}
+        epoch_results, stats['cached_epochs'] = run_jobs(executor, jobs, cache_folder)
+        stats['evaluated_jobs'] = n_jobs - stats['cached_training'] - stats['cached_epochs']
+
+        # 3: Statistical tests of all epochs of a scale at once (shared vocabulary of a scale)
+        results, overfitting, viable_names, figures = [], [], {}, []
+        for scale in scales:
+            folders = [epoch_results[epoch_keys[(scale, folder)]] for folder in test_folder]
+            token_lists = [(training[scale]['notes'], training[scale]['durs'])] + \
+                          [(folder['notes'], folder['durs']) for folder in folders]
+            note_to_int, dur_to_int = build_note_dict([note for notes, _ in token_lists for note in notes],
+                                                      [dur for _, durs in token_lists for dur in durs])
+            corpora = [encode_licks(notes, durs, note_to_int, dur_to_int) for notes, durs in token_lists]
+            results.append(evaluate_corpora(corpora[0], corpora[1:], epochs, note_to_int, dur_to_int, scale=scale))
+
+            overfitting += [{'scale': scale, 'epoch': epoch, 'folder': folder_name,
+                             'overfitting_rate': folder['overfitting_rate'],
+                             'copied_length': sum(folder['copied_lengths']) / max(1, len(folder['copied_lengths']))}
+                            for epoch, folder_name, folder in zip(epochs, test_folder, folders)]
+            viable_names[scale] = [folder['viable_names'] for folder in folders]
+            if render:
+                figures += build_figures(scale, training[scale], folders, epochs, img_folder, dpi)
+
+        # 4: Every figure at once
+        stats['rendered_figures'], stats['skipped_figures'] = render_figures(executor, figures, cache_folder,
+                                                                             img_folder) if render else (0, 0)
+
+    if show:
+        print(f'Evaluated {stats["evaluated_jobs"]} of {n_jobs} jobs '
+              f'({stats["cached_training"] + stats["cached_epochs"]} cached), '
+              f'rendered {stats["rendered_figures"]} figures ({stats["skipped_figures"]} unchanged)')
+    return {'results': concat(results, ignore_index=True), 'overfitting': DataFrame(overfitting),
+            'viable_names': viable_names, 'stats': stats}
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+This Python File contains Functions to update a trained model with new licks instead of a full retraining:
+> update_corpus: Only new midi files are parsed and appended to the saved corpus, new notes/durations
+  are appended to the vocabulary (the integers of the known notes/durations never change)
+> grow_model: The embeddings and the outputs of a trained model are extended for the new notes/durations,
+  the trained weights are kept
+> incremental_update: Both steps + a short training of the grown model with the whole corpus (fine-tuning)
+"""
+
+from os import path
+from numpy import concatenate
+from utils.corpus import (load_corpus, load_corpus_files, save_corpus_arrays, map_to_int, get_token_dtype,
+                          extend_vocabulary)
+from utils.midi_tools import read_midi_data, parse_midi_files, get_cache_key
+from utils.augmentation import get_transposed_notes
+
+def update_corpus(scale='diatonic', both=True, folder='data', workers=1, cache_folder='stored/cache',
+                  reader='music21', transpositions=None):
+    """
+    Function to add the new midi files of the training data to the saved corpus
+    (stored/corpus/both or stored/corpus/{scale}, see midi_tools.extract_notes_and_duration):
+    Only the midi files which are not part of the corpus are parsed, their licks are appended
+    (with the START/0 Tokens in front of every lick) and the vocabularies are extended (see corpus.extend_vocabulary).
+    Changed or removed midi files can't be updated this way - they are reported and need a new extraction.
+    Transpositions add the transposed new notes to the vocabulary as well (like build_note_dict).
+    Returns the updated corpus (see corpus.load_corpus) and a Dictionary with the added files,
+    the new notes/durations and the changed/removed files.
+    """
+    corpus_folder = f'stored/corpus/{"both" if both else scale}'
+    files = load_corpus_files(corpus_folder)
+    if files is None:
+        raise ValueError(f'{corpus_folder} has no list of its midi files - extract the training data once '
+                         f'with extract_notes_and_duration(save_data=True)')
+    corpus = load_corpus(corpus_folder, mmap=False)
+
+    # Compare the midi files with the files of the corpus
+    midi_data, _ = read_midi_data(scale, both, folder=folder)
+    known = {file_path: [mtime, size] for file_path, mtime, size in files}
+    new_files = [midi_file for midi_file in midi_data if path.abspath(midi_file) not in known]
+    current = {path.abspath(midi_file) for midi_file in midi_data}
+    changed = [file_path for file_path, *key in files
+               if file_path in current and list(get_cache_key(file_path)[1:]) != key]
+    removed = [file_path for file_path, *_ in files if file_path not in current]
+
+    stats = {'added_files': new_files, 'new_notes': [], 'new_durs': [], 'changed_files': changed,
+             'removed_files': removed}
+    if not new_files:
+        return corpus, stats
+
+    # Parse only the new midi files
+    licks, _ = parse_midi_files(new_files, workers=workers, cache_folder=cache_folder, reader=reader)
+    notes, durs = [], []
+    for lick_notes, lick_durs in licks:
+        notes += corpus['length'] * ['START'] + lick_notes
+        durs += corpus['length'] * [0] + lick_durs
+
+    # Append the new notes/durations to the vocabularies
+    vocab_notes = notes if transpositions is None else get_transposed_notes(notes, transpositions)
+    note_to_int, stats['new_notes'] = extend_vocabulary(corpus['note_to_int'], vocab_notes)
+    dur_to_int, stats['new_durs'] = extend_vocabulary(corpus['dur_to_int'], durs)
+
+    # The integer type may grow with the vocabulary
+    note_ints = concatenate([corpus['notes'].astype(get_token_dtype(len(note_to_int))), map_to_int(notes, note_to_int)])
+    dur_ints = concatenate([corpus['durs'].astype(get_token_dtype(len(dur_to_int))), map_to_int(durs, dur_to_int)])
+    save_corpus_arrays(note_ints, dur_ints, note_to_int, dur_to_int, corpus_folder, length=corpus['length'],
+                       files=files + [get_cache_key(midi_file) for midi_file in new_files])
+
+    return load_corpus(corpus_folder), stats
+
+def grow_model(model, n_notes, n_durs, sparse=False):
+    """
+    Function to extend a trained model (see jazz_lstm.generate_lstm_model) to a bigger vocabulary:
+    A new model with n_notes/n_durs is created with the dimensions of the trained model,
+    every weight is copied - the embeddings and the output layers keep their trained rows/columns,
+    only the rows/columns of the new notes/durations are new.
+    The biases of the new outputs start at the smallest trained bias, so the new notes/durations
+    are unlikely until the model is trained with them.
+    Returns the new (compiled) model.
+    """
+    # Local import: The keras model is only needed for the update
+    from utils.jazz_lstm import generate_lstm_model, get_model_settings
+
+    settings = get_model_settings(model)
+    if n_notes < settings['n_notes'] or n_durs < settings['n_durs']:
+        raise ValueError(f'The vocabulary can only grow: {settings["n_notes"]} notes/{settings["n_durs"]} durations '
+                         f'=> {n_notes} notes/{n_durs} durations')
+
+    grown = generate_lstm_model(**{**settings, 'n_notes': n_notes, 'n_durs': n_durs},
+                                scale=model.name.split('_')[-1], sparse=sparse)
+
+    for layer in grown.layers:
+        if not layer.weights:
+            continue
+        trained = model.get_layer(layer.name).get_weights()
+        weights = layer.get_weights()
+        for new, old in zip(weights, trained):
+            if layer.name in ('note_height', 'duration') and new.ndim == 1:
+                # Output bias: The new outputs start with the smallest trained bias
+                new[:] = old.min()
+            # Embeddings: Rows of the trained notes/durations, outputs: Columns of the trained notes/durations
+            new[tuple(slice(0, size) for size in old.shape)] = old
+        layer.set_weights(weights)
+
+    return grown
+
+def incremental_update(scale='diatonic', both=True, ep=10, bs=32, patience=5, seed=None, folder='data',
+                       workers=1, reader='music21', transpositions=None, verbose=0, show=True, model_args=None):
+    """
+    Function to update the model of a scale with the new midi files of the training data:
+    > 1: The new midi files are added to the corpus (see update_corpus)
+    > 2: The trained model (weights/both/weights.h5 or weights/{scale}/weights.h5) is extended
+      to the new vocabulary (see grow_model)
+    > 3: The grown model is fine-tuned for ep epochs with the whole corpus (see jazz_lstm.train_stream,
+      optionally with the transposition augmentation), the weights are saved in the same weights folder
+    The trained model is rebuilt with the parameters saved next to its weights (see jazz_lstm.save_model_settings).
+    Weights which were trained without them need the parameters of generate_lstm_model as model_args
+    (e.g. {'rnn_units': 128, 'mask_zero': True}, default: the defaults of generate_lstm_model).
+    Models with mask_zero are fine-tuned with packed windows.
+    If there are no new midi files, nothing is trained.
+    Returns the statistics of update_corpus and the keras History of the fine-tuning (or None).
+    """
+    # Local import: The keras model is only needed for the update
+    from utils.jazz_lstm import generate_lstm_model, train_stream, load_model_settings
+
+    weights_folder = 'both' if both else scale
+    old_corpus = load_corpus(f'stored/corpus/{weights_folder}')
+    n_notes, n_durs = len(old_corpus['note_to_int']), len(old_corpus['dur_to_int'])
+    settings = {**(load_model_settings(weights_folder) or {'n_notes': n_notes, 'n_durs': n_durs}), **(model_args or {})}
+    if (settings['n_notes'], settings['n_durs']) != (n_notes, n_durs):
+        raise ValueError(f'weights/{weights_folder} has {settings["n_notes"]} notes/{settings["n_durs"]} durations, '
+                         f'the corpus {n_notes} notes/{n_durs} durations - the weights belong to another vocabulary')
+
+    corpus, stats = update_corpus(scale, both, folder=folder, workers=workers, reader=reader,
+                                  transpositions=transpositions)
+    if show:
+        print(f'Added {len(stats["added_files"])} midi files, new notes: {stats["new_notes"]}, '
+              f'new durations: {stats["new_durs"]}')
+        for file_path in stats['changed_files'] + stats['removed_files']:
+            print(f'Changed/removed (needs a new extraction): {file_path}')
+    if not stats['added_files']:
+        return stats, None
+
+    # The trained model with the old vocabulary
+    model = generate_lstm_model(**settings, scale=weights_folder)
+    model.load_weights(f'weights/{weights_folder}/weights.h5')
+    model = grow_model(model, len(corpus['note_to_int']), len(corpus['dur_to_int']), sparse=True)
+
+    history = train_stream(corpus, model, scale, both=both, verbose=verbose, bs=bs, ep=ep,
+                           checkpoints=False, patience=patience, seed=seed, transpositions=transpositions,
+                           packed=settings.get('mask_zero', False))
+    return stats, history
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+This Python File contains an optional instrumentation of the hot paths (prediction, sampling,
+parsing/writing midi files, training epochs) with named timers and counters.
+The instrumentation is disabled by default - a disabled timer returns a shared empty context,
+so the instrumented Functions run (nearly) as fast as without instrumentation.
+It is enabled with enable() or the environment variable JAZZ_INSTRUMENT=1.
+The results can be shown as a summary (see report) or exported as Chrome trace
+(see export_chrome_trace, viewable in chrome://tracing or https://ui.perfetto.dev).
+"""
+
+from os import environ, getpid
+from json import dump
+from time import perf_counter_ns
+from threading import get_ident
+from contextlib import nullcontext
+from numpy import array, percentile
+
+# Instrumentation state (module level, so every module uses the same timers)
+ENABLED = environ.get('JAZZ_INSTRUMENT', '0').lower() in ('1', 'true', 'yes')
+# Maximal amount of events kept for the Chrome trace (the summary covers every event)
+MAX_TRACE_EVENTS = 1_000_000
+
+NULL_TIMER = nullcontext()
+TIMINGS, COUNTERS, TRACE_EVENTS = {}, {}, []
+# Counters which are divided by the total time of a timer (see count)
+RATES = {}
+START_NS = perf_counter_ns()
+
+def enable(enabled=True):
+    """
+    Enables (or disables) the instrumentation.
+    """
+    global ENABLED
+    ENABLED = enabled
+
+def is_enabled():
+    """
+    Returns if the instrumentation is enabled.
+    """
+    return ENABLED
+
+def reset():
+    """
+    Deletes every recorded timing, counter and trace event.
+    """
+    global START_NS
+    TIMINGS.clear()
+    COUNTERS.clear()
+    RATES.clear()
+    TRACE_EVENTS.clear()
+    START_NS = perf_counter_ns()
+
+class Timer:
+    """
+    Context manager which measures the time of its block and records it as event (see record).
+    """
+    __slots__ = ('name', 'args', 'start')
+
+    def __init__(self, name, args):
+        self.name, self.args = name, args
+
+    def __enter__(self):
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, perf_counter_ns() - self.start, **self.args)
+        return False
+
+def timer(name, **args):
+    """
+    Returns a timer for the block of a with statement:
+        with timer('predict', step=idx):
+            model.predict(...)
+    The arguments (args) are saved in the Chrome trace.
+    If the instrumentation is disabled, the shared empty context is returned.
+    """
+    if not ENABLED:
+        return NULL_TIMER
+    return Timer(name, args)
+
+def record(name, start_ns, duration_ns, **args):
+    """
+    Records a finished event with its start (perf_counter_ns) and its duration in nanoseconds.
+    Can be used for events which are not measured with a timer (e.g. keras callbacks).
+    """
+    if not ENABLED:
+        return
+    TIMINGS.setdefault(name, []).append(duration_ns)
+    if len(TRACE_EVENTS) < MAX_TRACE_EVENTS:
+        TRACE_EVENTS.append((name, start_ns, duration_ns, get_ident(), args))
+
+def count(name, value=1, per=None):
+    """
+    Increases the counter name by value.
+    If per is the name of a timer, the summary additionally contains the counter per second
+    of this timer (e.g. count('generated_tokens', per='generate_notes_durs') => tokens/sec).
+    """
+    if not ENABLED:
+        return
+    COUNTERS[name] = COUNTERS.get(name, 0) + value
+    if per is not None:
+        RATES[name] = per
+
+def summary():
+    """
+    Returns a Dictionary with the statistics of every timer (count, total, mean, p50, p99, max in seconds)
+    and every counter (+ the counter per second for counters with a timer, see count).
+    """
+    timers = {}
+    for name, durations in TIMINGS.items():
+        seconds = array(durations) / 1e9
+        timers[name] = {'count': len(seconds), 'total': float(seconds.sum()), 'mean': float(seconds.mean()),
+                        'p50': float(percentile(seconds, 50)), 'p99': float(percentile(seconds, 99)),
+                        'max': float(seconds.max())}
+
+    counters = {}
+    for name, value in COUNTERS.items():
+        counters[name] = {'value': value}
+        if name in RATES and RATES[name] in timers and timers[RATES[name]]['total'] > 0:
+            counters[name]['per_second'] = value / timers[RATES[name]]['total']
+    return {'timers': timers, 'counters': counters}
+
+def report():
+    """
+    Returns the summary as readable table (sorted by the total time of the timers).
+    """
+    results = summary()
+    lines = [f'{"Timer":<28}{"count":>9}{"total s":>11}{"mean ms":>11}{"p50 ms":>11}{"p99 ms":>11}{"max ms":>11}']
+    for name, stats in sorted(results['timers'].items(), key=lambda item: -item[1]['total']):
+        lines.append(f'{name:<28}{stats["count"]:>9}{stats["total"]:>11.3f}{stats["mean"] * 1e3:>11.3f}'
+                     f'{stats["p50"] * 1e3:>11.3f}{stats["p99"] * 1e3:>11.3f}{stats["max"] * 1e3:>11.3f}')
+    if results['counters']:
+        lines.append(f'\n{"Counter":<28}{"value":>12}{"per second":>14}')
+        for name, stats in results['counters'].items():
+            per_second = f'{stats["per_second"]:>14.1f}' if 'per_second' in stats else f'{"-":>14}'
+            lines.append(f'{name:<28}{stats["value"]:>12}{per_second}')
+    return '\n'.join(lines)
+
+def export_chrome_trace(file_path):
+    """
+    Exports every recorded event as Chrome trace (JSON with complete events, times in microseconds).
+    The counters are added as counter events at the end of the trace.
+    """
+    pid = getpid()
+    events = [{'name': name, 'ph': 'X', 'ts': (start - START_NS) / 1e3, 'dur': duration / 1e3,
+               'pid': pid, 'tid': tid, 'args': args}
+              for name, start, duration, tid, args in TRACE_EVENTS]
+    end = max([event['ts'] + event['dur'] for event in events], default=0)
+    events += [{'name': name, 'ph': 'C', 'ts': end, 'pid': pid, 'args': {name: value}}
+               for name, value in COUNTERS.items()]
+
+    with open(file_path, 'w') as trace:
+        dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, trace, default=str)
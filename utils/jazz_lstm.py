@@ -10,40 +10,66 @@ from keras.layers import (LSTM, Input, Dense, Activation, Embedding,
                           TimeDistributed, Permute, RepeatVector,
                           Dropout)
 
+from keras.layers import Layer
 from keras.backend import sum as k_sum
 from keras.models import Model, Sequential
-from os import path
+from keras.saving import register_keras_serializable
+from os import path, makedirs
+from json import dump, load
+import tensorflow as tf
+from utils.callbacks import build_throughput_callback
 
-def generate_lstm_model(n_notes, n_durs, embed=100, rnn_units=256, dense_units=256, scale='both'):
+@register_keras_serializable(package='jazz_lstm')
+class FusedAttention(Layer):
     """
-    This Function creates the model for the Neural Network.
-    Since this project is using a LSTM model, Recurrent Units are needed.
-    Besides this the model will use a mechanic called 'Attention',
-    which is commonly used in a translation domain to predict a word
-    based on a last word.
+    Attention Mechanism of build_attention_head as a single layer:
+    The scores of the hidden states (tanh of a Dense layer with 1 unit) are normalized with a softmax
+    and the context vector is calculated as weighted sum of the hidden states with one einsum -
+    without the repeated weight matrix of RepeatVector/Permute/Multiply and without a Lambda layer.
+    The weights (kernel ( rnn_units, 1 ) + bias ( 1, )) are the weights of the Dense layer 'Adapt_layer',
+    so weights.h5 files of both versions can be loaded into each other.
+    Masked time steps (e.g. padding) get no attention.
     """
 
-    # Network take 2 Inputs: 1 for duration + 1 for notes
-    # Attention needs no predetermined input length
-    note_in = Input(shape=(None, ), name='note_input')
-    dur_in = Input(shape=(None, ), name='dur_input')
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.supports_masking = True
 
-    # Emedding Layer: translates mapped notes in vectors
-    note_embedding = Embedding(n_notes, embed, name='note_embedd')(note_in)
-    dur_embedding = Embedding(n_durs, embed, name='dur_embed')(dur_in)
+    def build(self, input_shape):
+        # Same order and shapes as the weights of a Dense layer
+        self.kernel = self.add_weight(name='kernel', shape=(input_shape[-1], 1), initializer='glorot_uniform')
+        self.bias = self.add_weight(name='bias', shape=(1, ), initializer='zeros')
+        super().build(input_shape)
 
-    # Concat Layer: Aggregate both vectors as a new input for the recurrent layer
-    concat_layer = concatenate([note_embedding, dur_embedding],
-                               name='concat_layer')
+    def call(self, inputs, mask=None):
+        # Scores with a shape ( batch, length )
+        scores = tf.tanh(tf.einsum('btu,uo->bt', inputs, self.kernel) + self.bias)
+        if mask is not None:
+            scores = tf.where(mask, scores, tf.fill(tf.shape(scores), float('-inf')))
+        attention = tf.nn.softmax(scores, axis=-1)
+        # Context vector: Weighted sum of the hidden states over the length-Dimension
+        return tf.einsum('bt,btu->bu', attention, inputs)
 
-    # 2 LSTM Layers as recurrent part: Every layer can send every hidden state to the next layer
-    model = LSTM(rnn_units, return_sequences=True, name='First_LSTM')(concat_layer)
-    model = LSTM(rnn_units, return_sequences=True, name='Second_LSTM')(model)
+    def compute_mask(self, inputs, mask=None):
+        # The length-Dimension is reduced
+        return None
 
-    # Dropout Layer: Fight overfitting
-    model = Dropout(0.3)(model)
+    def compute_output_shape(self, input_shape):
+        return (input_shape[0], input_shape[-1])
+
+def build_attention_head(model, n_notes, n_durs, rnn_units=256, fused_attention=True):
+    """
+    This Function builds the Attention Mechanism on top of the hidden states of the last
+    LSTM layer (shape ( length, rnn_units )) and the 2 Outputs for notes and durations.
+    The Function is shared by the training model and the inference models, so
+    the layer names (and weights) are always the same.
+    With fused_attention the context vector is calculated by a single layer (see FusedAttention),
+    otherwise by the original layers (Dense, Softmax, RepeatVector, Permute, Multiply, Lambda).
+    """
 
-    # Building the Attention Mechanism
+    if fused_attention:
+        hws = FusedAttention(name='Adapt_layer')(model)
+        return build_outputs(hws, n_notes, n_durs)
 
     # Adaption function as a Dense Layer is reshaped to a vector with a shape ( 1, length )
     adapt_func = Dense(1, activation='tanh', name='Adapt_layer')(model)
@@ -65,6 +91,13 @@ def generate_lstm_model(n_notes, n_durs, embed=100, rnn_units=256, dense_units=2
                  output_shape=(rnn_units, ),
                  name='Context_Vector')(hws)
 
+    return build_outputs(hws, n_notes, n_durs)
+
+def build_outputs(hws, n_notes, n_durs):
+    """
+    Small helper Function which builds the 2 Outputs for notes and durations on top of the context vector.
+    """
+
     # First Output - Notepitch
     note_out = Dense(n_notes,
                      activation='softmax',
@@ -75,20 +108,126 @@ def generate_lstm_model(n_notes, n_durs, embed=100, rnn_units=256, dense_units=2
                     activation='softmax',
                     name='duration')(hws)
 
+    return note_out, dur_out
+
+def generate_lstm_model(n_notes, n_durs, embed=100, rnn_units=256, dense_units=256, scale='both', sparse=False,
+                        fused_attention=True, mask_zero=False):
+    """
+    This Function creates the model for the Neural Network.
+    Since this project is using a LSTM model, Recurrent Units are needed.
+    Besides this the model will use a mechanic called 'Attention',
+    which is commonly used in a translation domain to predict a word
+    based on a last word.
+    If sparse is set, the model is trained with integer outputs instead of One-Hot-Coded outputs
+    (see midi_tools.generate_sequence).
+    fused_attention selects the attention layer (see build_attention_head) - both versions
+    have the same weights.
+    With mask_zero the model takes packed windows (see corpus.get_packed_inputs): The inputs are
+    shifted by 1 and the padding (0) is masked in the LSTM layers and the attention layer,
+    so the embeddings have an additional row (the weights differ from a model without mask_zero).
+    """
+    # Only the fused attention layer supports masks
+    if mask_zero and not fused_attention:
+        raise ValueError('mask_zero needs the fused attention layer (fused_attention=True)')
+
+    # Network take 2 Inputs: 1 for duration + 1 for notes
+    # Attention needs no predetermined input length
+    note_in = Input(shape=(None, ), name='note_input')
+    dur_in = Input(shape=(None, ), name='dur_input')
+
+    # Emedding Layer: translates mapped notes in vectors
+    note_embedding = Embedding(n_notes + mask_zero, embed, mask_zero=mask_zero, name='note_embedd')(note_in)
+    dur_embedding = Embedding(n_durs + mask_zero, embed, mask_zero=mask_zero, name='dur_embed')(dur_in)
+
+    # Concat Layer: Aggregate both vectors as a new input for the recurrent layer
+    concat_layer = concatenate([note_embedding, dur_embedding],
+                               name='concat_layer')
+
+    # 2 LSTM Layers as recurrent part: Every layer can send every hidden state to the next layer
+    model = LSTM(rnn_units, return_sequences=True, name='First_LSTM')(concat_layer)
+    model = LSTM(rnn_units, return_sequences=True, name='Second_LSTM')(model)
+
+    # Dropout Layer: Fight overfitting
+    model = Dropout(0.3)(model)
+
+    # Building the Attention Mechanism + Outputs
+    note_out, dur_out = build_attention_head(model, n_notes, n_durs, rnn_units, fused_attention)
+
     # Combine the created input layers + output layers in one model
     final_model = Model([note_in, dur_in],
                         [note_out, dur_out],
                         name=f'Jazz_LSTM_{scale}')
 
     # Categorical Crossentropy since its a classification problem with One-Hot-Coded Training data
+    # (Sparse Categorical Crossentropy for integer Training data)
     # Adam as optimizer since adam works pretty well
-    final_model.compile(loss=['categorical_crossentropy',
-                              'categorical_crossentropy'],
+    loss = 'sparse_categorical_crossentropy' if sparse else 'categorical_crossentropy'
+    final_model.compile(loss=[loss, loss],
                         optimizer='adam')
 
     return final_model
 
-def train(inputs, outputs, model, folder, both=True, verbose=0, bs=32, ep=100, checkpoints=True, patience=5):
+def get_model_settings(model):
+    """
+    Function to read the parameters of generate_lstm_model from the layers of a model:
+    n_notes, n_durs, embed, rnn_units, fused_attention and mask_zero.
+    Returns a Dictionary which can be passed to generate_lstm_model.
+    """
+    note_embedding = model.get_layer('note_embedd')
+    mask_zero = bool(note_embedding.mask_zero)
+    return {'n_notes': note_embedding.input_dim - mask_zero,
+            'n_durs': model.get_layer('dur_embed').input_dim - mask_zero,
+            'embed': note_embedding.output_dim,
+            'rnn_units': model.get_layer('First_LSTM').units,
+            'fused_attention': isinstance(model.get_layer('Adapt_layer'), FusedAttention),
+            'mask_zero': mask_zero}
+
+def save_model_settings(model, folder):
+    """
+    Function to save the parameters of a model (see get_model_settings) as weights/{folder}/model.json,
+    so the model of the weights can be rebuilt (see load_model_settings).
+    """
+    makedirs(f'weights/{folder}', exist_ok=True)
+    with open(f'weights/{folder}/model.json', 'w') as store:
+        dump(get_model_settings(model), store)
+
+def load_model_settings(folder):
+    """
+    Small helper Function which returns the saved parameters of the model of weights/{folder}
+    (see save_model_settings) - None for weights which were trained without them.
+    """
+    if not path.exists(f'weights/{folder}/model.json'):
+        return None
+    with open(f'weights/{folder}/model.json', 'r') as stored:
+        return load(stored)
+
+def build_callbacks(folder, verbose=0, checkpoints=True, patience=5, monitor='loss'):
+    """
+    Function to create the callbacks of the training (see train):
+    2 checkpoints (the first is optional) and early stopping.
+    Monitor is the logged value of the checkpoints and the early stopping (e.g. 'val_loss').
+    """
+    if checkpoints:
+        first_checkpoint = ModelCheckpoint(path.join(f'weights/{folder}/', 'weights-improvement-{epoch:02d}-{loss:.4f}.h5'),
+                                           monitor=monitor,
+                                           verbose=verbose,
+                                           save_best_only=True,
+                                           mode='min')
+
+    second_checkpoint = ModelCheckpoint(path.join(f'weights/{folder}/', 'weights.h5'),
+                                        monitor=monitor,
+                                        verbose=verbose,
+                                        save_best_only=True,
+                                        mode='min')
+
+    early_stop = EarlyStopping(monitor=monitor,
+                               restore_best_weights=True,
+                               patience=patience)
+
+    return [first_checkpoint, second_checkpoint, early_stop] if checkpoints else [early_stop, second_checkpoint]
+
+def train(inputs, outputs, model, folder, both=True, verbose=0, bs=32, ep=100, checkpoints=True, patience=5,
+          callbacks=None, monitor='loss'):
     """
     Wrapper function for building a training environment for the model.
     inputs/outputs and model are the obligatory parameters for the training.
@@ -100,35 +239,123 @@ def train(inputs, outputs, model, folder, both=True, verbose=0, bs=32, ep=100, c
     Ep determines the amount of training epoches.
     For consistency and a more comfortable training 2 checkpoints are implemented.
     For fighting overfitting early stopping is implemented (regulated with patience).
+    Both monitor the training loss, monitor='val_loss' selects the epochs by the validation loss.
+    The training samples per second of every epoch are added to the logs (see callbacks.ThroughputCallback).
+    Additional keras callbacks can be passed with callbacks.
     Since the model is implented with keras the format for saving the structured data
-    is h5.
+    is h5, the parameters of the model are saved next to the weights (see save_model_settings).
+    The Function returns the keras History of the training.
     """
 
     folder = 'both' if both else folder
     folder_path = f'weights/{folder}/'
-    if checkpoints:
-        first_checkpoint = ModelCheckpoint(path.join(f'weights/{folder}/', 'weights-improvement-{epoch:02d}-{loss:.4f}.h5'),
-                                           monitor='loss',
-                                           verbose=verbose,
-                                           save_best_only=True,
-                                           mode='min')
+    extra_callbacks = callbacks or []
+    callbacks = build_callbacks(folder, verbose=verbose, checkpoints=checkpoints, patience=patience,
+                                monitor=monitor)
+    # Samples per second of every epoch (keras takes the last 30 percent as validation data)
+    callbacks.append(build_throughput_callback(int(len(inputs[0]) * (1 - 0.3))))
+    callbacks += extra_callbacks
 
-    second_checkpoint = ModelCheckpoint(path.join(f'weights/{folder}/', 'weights.h5'),
-                                        monitor='loss',
-                                        verbose=verbose,
-                                        save_best_only=True,
-                                        mode='min')
+    model.save_weights(folder_path, 'weights.h5')
+    save_model_settings(model, folder)
+    return model.fit(inputs, outputs,
+                     verbose=verbose,
+                     epochs=ep, batch_size=bs,
+                     validation_split=0.3,
+                     shuffle=True,
+                     callbacks=callbacks)
 
-    early_stop = EarlyStopping(monitor='loss',
-                               restore_best_weights=True,
-                               patience=patience)
+def train_stream(corpus, model, folder, both=True, verbose=0, bs=32, ep=100, checkpoints=True, patience=5,
+                 validation_split=0.3, seed=None, callbacks=None, transpositions=None, packed=False):
+    """
+    Streaming version of train: Instead of fully materialized inputs/outputs
+    the batches are built on the fly from a corpus (see corpus.load_corpus and pipeline.make_dataset).
+    Validation_split determines the part of the licks (not of the windows) used for the validation,
+    the seed makes the split and the shuffling reproducible.
+    The model has to be created with sparse outputs (see generate_lstm_model).
+    Transpositions (semitone offsets) transpose the training windows randomly in every epoch
+    (see pipeline.make_dataset), the validation data is not transposed.
+    If packed is set, only the windows of the licks are trained (see corpus.get_packed_windows) -
+    the model has to be created with mask_zero.
+    Every other parameter has the same meaning as in train (the keras History is returned as well).
+    """
+    # Only needed for streaming - keeps tensorflow.data out of the other functions
+    from utils.pipeline import split_licks, make_dataset
 
-    callbacks = [first_checkpoint, second_checkpoint, early_stop] if checkpoints else [early_stop, second_checkpoint]
+    folder = 'both' if both else folder
+    extra_callbacks = callbacks or []
+    callbacks = build_callbacks(folder, verbose=verbose, checkpoints=checkpoints, patience=patience)
+    save_model_settings(model, folder)
 
-    model.save_weights(folder_path, 'weights.h5')
-    model.fit(inputs, outputs,
-              verbose=verbose,
-              epochs=ep, batch_size=bs,
-              validation_split=0.3,
-              shuffle=True,
-              callbacks=callbacks)
+    train_windows, validation_windows = split_licks(corpus, validation_split=validation_split, seed=seed,
+                                                    packed=packed)
+    callbacks.append(build_throughput_callback(len(train_windows)))
+    callbacks += extra_callbacks
+    train_data = make_dataset(corpus, train_windows, batch_size=bs, shuffle=True, seed=seed,
+                              transpositions=transpositions, packed=packed)
+    validation_data = make_dataset(corpus, validation_windows, batch_size=bs, shuffle=False, packed=packed)
+
+    return model.fit(train_data,
+                     validation_data=validation_data if len(validation_windows) else None,
+                     verbose=verbose,
+                     epochs=ep,
+                     callbacks=callbacks)
+
+def generate_inference_models(model, scale='both'):
+    """
+    This Function creates 2 models for an incremental generation based on the weights
+    of a trained model (see generate_lstm_model):
+    > 1: Step model: Takes new notes/durations + the states of both LSTM layers and
+    returns the hidden states of the last LSTM layer + the new states.
+    So each new token costs one recurrent step instead of running over the whole sequence.
+    > 2: Head model: Takes a buffer of hidden states with a shape ( length, rnn_units )
+    and applies the Attention Mechanism to predict the next note/duration.
+    Dropout is skipped since its inactive while predicting.
+    The head model uses the same attention layer as the trained model (see FusedAttention).
+    Models with mask_zero (packed windows) keep their shifted embeddings: The step model takes
+    the notes/durations shifted by 1 without any padding (see midi_generation.generate_stateful_notes_durs
+    with packed), the head model predicts the unshifted notes/durations.
+    """
+
+    # Fetch the network dimensions from the trained model
+    note_embedding = model.get_layer('note_embedd')
+    dur_embedding = model.get_layer('dur_embed')
+    rnn_units = model.get_layer('First_LSTM').units
+    mask_zero = bool(note_embedding.mask_zero)
+    n_notes, embed = note_embedding.input_dim - mask_zero, note_embedding.output_dim
+    n_durs = dur_embedding.input_dim - mask_zero
+    fused_attention = isinstance(model.get_layer('Adapt_layer'), FusedAttention)
+
+    # Step model: Inputs for notes/durations + the states of both LSTM layers
+    note_in = Input(shape=(None, ), name='note_input')
+    dur_in = Input(shape=(None, ), name='dur_input')
+    states_in = [Input(shape=(rnn_units, ), name=name)
+                 for name in ['first_h', 'first_c', 'second_h', 'second_c']]
+
+    concat_layer = concatenate([Embedding(n_notes + mask_zero, embed, name='note_embedd')(note_in),
+                                Embedding(n_durs + mask_zero, embed, name='dur_embed')(dur_in)],
+                               name='concat_layer')
+
+    # Both LSTM layers continue with the given states and return their new states
+    hidden, first_h, first_c = LSTM(rnn_units, return_sequences=True, return_state=True,
+                                    name='First_LSTM')(concat_layer, initial_state=states_in[:2])
+    hidden, second_h, second_c = LSTM(rnn_units, return_sequences=True, return_state=True,
+                                      name='Second_LSTM')(hidden, initial_state=states_in[2:])
+
+    step_model = Model([note_in, dur_in] + states_in,
+                       [hidden, first_h, first_c, second_h, second_c],
+                       name=f'Jazz_LSTM_Step_{scale}')
+
+    # Head model: Attention Mechanism over a buffer of hidden states
+    hidden_in = Input(shape=(None, rnn_units), name='hidden_input')
+    head_model = Model(hidden_in,
+                       build_attention_head(hidden_in, n_notes, n_durs, rnn_units, fused_attention),
+                       name=f'Jazz_LSTM_Head_{scale}')
+
+    # Copy the trained weights into the inference models
+    for inference_model in [step_model, head_model]:
+        for layer in inference_model.layers:
+            if layer.weights:
+                layer.set_weights(model.get_layer(layer.name).get_weights())
+
+    return step_model, head_model
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+This Python File contains a local server for generating Jazz Licks.
+The models of every scale are loaded once and stay in memory, requests are sent as
+JSON lines over TCP. Concurrent requests of the same scale are merged into shared
+batched predictions (see generate_batch_notes_durs): After every prediction step,
+finished licks leave the batch and the licks of new requests join it.
+
+Start the server with:  python -m utils.lick_server --scales both diatonic alterated
+Request (one JSON line):  {"scale": "both", "count": 4, "note_rand": 0.55, "dur_rand": 0.1, "seed": 1}
+Optional keys: "top_k", "top_p", "format" ("tokens" or "midi"), "id"
+The server answers with one JSON line per finished lick and a last line with "done"
+(or "error" if the request failed, e.g. a failed prediction or an invalid JSON line).
+The request {"command": "stats"} returns the latency (p50/p99) and the licks per second.
+"""
+
+from asyncio import (Event, Queue, get_running_loop, start_server, open_connection,
+                     run as run_async, create_task)
+from argparse import ArgumentParser
+from base64 import b64encode, b64decode
+from collections import deque
+from functools import partial
+from json import loads, dumps
+from time import perf_counter
+from numpy import array, stack, full, zeros, concatenate, percentile, int64
+from numpy.random import SeedSequence, default_rng
+from utils.midi_generation import get_informations, get_model_inputs
+from utils.sampling import sample_tokens
+from utils.corpus import encode_dur, decode_dur
+from utils.smf import encode_lick
+
+def load_model(scale, backend='keras'):
+    """
+    Function to load the model and the informations of a scale like notebook 2:
+    > keras: generate_lstm_model + weights/{scale}/weights.h5
+    > numpy: NumpyJazzLSTM with weights/{scale}/weights.npz (see numpy_lstm.export_weights)
+    Returns the model, the note informations and the duration informations.
+    """
+    notes_informations, durs_informations = get_informations(scale)
+    if backend == 'numpy':
+        from utils.numpy_lstm import NumpyJazzLSTM
+        model = NumpyJazzLSTM(f'weights/{scale}/weights.npz')
+    elif backend == 'keras':
+        from utils.jazz_lstm import generate_lstm_model
+        model = generate_lstm_model(notes_informations[2], durs_informations[2])
+        model.load_weights(f'weights/{scale}/weights.h5')
+    else:
+        raise ValueError(f'Unknown backend {backend}')
+    return model, notes_informations, durs_informations
+
+class LickRequest:
+    """
+    A single generation request: Its settings, a Generator for every lick
+    (so the result of a seed does not depend on the other requests in the batch -
+    apart from floating point differences of differently sized predictions),
+    a Queue for the finished licks and its latency (or error) once it is completed.
+    """
+
+    def __init__(self, scale, count=1, note_rand=0.55, dur_rand=0.1, seed=None,
+                 top_k=None, top_p=None, format='tokens', id=None):
+        if count < 1:
+            raise ValueError('A request needs a count of at least 1')
+        self.scale, self.count, self.id = scale, count, id
+        self.note_rand, self.dur_rand = note_rand, dur_rand
+        self.top_k, self.top_p, self.format = top_k, top_p, format
+        self.rngs = [default_rng(child) for child in SeedSequence(seed).spawn(count)]
+        self.results = Queue()
+        self.remaining = count
+        self.start = perf_counter()
+        self.latency, self.error = None, None
+
+class LickRow:
+    """
+    A single lick of a request inside the batch of a scale: Its index in the request,
+    the input window ( length, ) and the generated notes/durations.
+    """
+
+    def __init__(self, request, index, note_window, dur_window):
+        self.request, self.index = request, index
+        self.note_window, self.dur_window = note_window, dur_window
+        self.output = []
+
+class LickServer:
+    """
+    Server which keeps the models of several scales in memory (see load_model)
+    and runs one batch loop per scale (see run_scale).
+    > length, additional_notes: See generate_notes_durs
+    > max_batch: Maximal amount of licks of a shared prediction
+    > history: Amount of finished requests for the latency statistics
+    """
+
+    def __init__(self, models, length=17, additional_notes=17, max_batch=256, history=1000):
+        self.models = models
+        self.length, self.additional_notes, self.max_batch = length, additional_notes, max_batch
+        self.pending = {scale: deque() for scale in models}
+        self.wakeup = {scale: Event() for scale in models}
+        self.latencies = deque(maxlen=history)
+        self.n_licks, self.n_predictions, self.started = 0, 0, perf_counter()
+
+    def submit(self, request):
+        """
+        Adds the licks of a request to the pending licks of its scale.
+        The licks join the batch at the next prediction step.
+        """
+        if request.scale not in self.models:
+            raise ValueError(f'Scale {request.scale} is not loaded')
+        _, notes_informations, durs_informations = self.models[request.scale]
+        note_start, dur_start = notes_informations[3]['START'], durs_informations[3][0]
+        for index in range(request.count):
+            self.pending[request.scale].append(LickRow(request, index, full(self.length, note_start),
+                                                       full(self.length, dur_start)))
+        self.wakeup[request.scale].set()
+
+    async def run_scale(self, scale):
+        """
+        Batch loop of a scale: Every step predicts the next note/duration of all active licks
+        at once (in a worker thread, so the server keeps accepting requests).
+        The notes/durations are drawn with the settings and Generators of every request.
+        NumPy models with mask_zero get packed windows (see midi_generation.get_model_inputs).
+        """
+        model, notes_informations, durs_informations = self.models[scale]
+        int_to_note, int_to_dur = notes_informations[4], durs_informations[4]
+        start_val = notes_informations[3]['START']
+        packed = getattr(model, 'mask_zero', False)
+        loop = get_running_loop()
+        rows = []
+
+        while True:
+            # Wait for new licks if the batch is empty
+            if not rows and not self.pending[scale]:
+                self.wakeup[scale].clear()
+                await self.wakeup[scale].wait()
+
+            # New licks join the batch
+            while self.pending[scale] and len(rows) < self.max_batch:
+                rows.append(self.pending[scale].popleft())
+
+            note_input = stack([row.note_window for row in rows])
+            dur_input = stack([row.dur_window for row in rows])
+            by_request = {}
+            for idx, row in enumerate(rows):
+                by_request.setdefault(row.request, []).append(idx)
+            try:
+                pred_notes, pred_durs = await loop.run_in_executor(
+                    None, partial(model.predict, get_model_inputs(note_input, dur_input, start_val, packed),
+                                  verbose=0, batch_size=len(rows)))
+            except Exception as error:
+                # A failed prediction fails the requests of the batch, the loop keeps serving
+                for request in by_request:
+                    self.fail(request, f'Prediction failed: {error!r}')
+                rows = []
+                continue
+            self.n_predictions += 1
+
+            # Draw the notes/durations for the licks of every request
+            note_vals, dur_vals = zeros(len(rows), dtype=int64), zeros(len(rows), dtype=int64)
+            failed = set()
+            for request, idx in by_request.items():
+                rngs = [request.rngs[rows[row_idx].index] for row_idx in idx]
+                try:
+                    note_vals[idx] = sample_tokens(pred_notes[idx], request.note_rand, request.top_k,
+                                                   request.top_p, rngs)
+                    dur_vals[idx] = sample_tokens(pred_durs[idx], request.dur_rand, request.top_k,
+                                                  request.top_p, rngs)
+                except Exception as error:
+                    # Invalid sampling settings only fail their own request
+                    self.fail(request, f'Sampling failed: {error!r}')
+                    failed.add(request)
+
+            # Slide the windows, finished licks leave the batch
+            active = []
+            for row, note_val, dur_val in zip(rows, note_vals, dur_vals):
+                if row.request in failed:
+                    continue
+                row.output.append([int_to_note[note_val], int_to_dur[dur_val]])
+                row.note_window = append_window(row.note_window, note_val)
+                row.dur_window = append_window(row.dur_window, dur_val)
+                if note_val == start_val or len(row.output) == self.additional_notes:
+                    self.finish(row)
+                else:
+                    active.append(row)
+            rows = active
+
+    def finish(self, row):
+        """
+        Sends a finished lick to its request. The last lick of a request
+        records the latency of the request and closes its Queue.
+        """
+        request = row.request
+        request.results.put_nowait(format_lick(row))
+        request.remaining -= 1
+        self.n_licks += 1
+        if request.remaining == 0:
+            request.latency = perf_counter() - request.start
+            self.latencies.append(request.latency)
+            request.results.put_nowait(None)
+
+    def fail(self, request, error):
+        """
+        Fails a request: Its pending licks are dropped and its Queue is closed with the error.
+        The licks of the request which are already sent stay valid.
+        """
+        request.error = error
+        request.remaining = 0
+        self.pending[request.scale] = deque(row for row in self.pending[request.scale] if row.request is not request)
+        request.results.put_nowait(None)
+
+    def stats(self):
+        """
+        Returns the latency of the last requests (p50/p99 in seconds), the generated licks per second
+        (since the start of the server) and the average size of a shared prediction.
+        """
+        latencies = array(self.latencies) if self.latencies else array([0.0])
+        uptime = perf_counter() - self.started
+        return {'requests': len(self.latencies),
+                'p50': float(percentile(latencies, 50)),
+                'p99': float(percentile(latencies, 99)),
+                'licks_per_sec': self.n_licks / uptime,
+                'licks': self.n_licks,
+                'predictions': self.n_predictions}
+
+    async def handle(self, reader, writer):
+        """
+        Handles a connection: Every line is a request (JSON), the licks are sent back
+        as soon as they are finished.
+        """
+        while line := await reader.readline():
+            try:
+                message = loads(line)
+                if not isinstance(message, dict):
+                    raise ValueError('A request has to be a JSON object')
+            except ValueError as error:
+                writer.write((dumps({'id': None, 'error': f'Invalid request: {error}'}) + '\n').encode())
+                await writer.drain()
+                continue
+            if message.get('command') == 'stats':
+                writer.write((dumps(self.stats()) + '\n').encode())
+                await writer.drain()
+                continue
+
+            try:
+                request = LickRequest(**message)
+                self.submit(request)
+            except (TypeError, ValueError) as error:
+                writer.write((dumps({'id': message.get('id'), 'error': str(error)}) + '\n').encode())
+                await writer.drain()
+                continue
+
+            while (lick := await request.results.get()) is not None:
+                index, notes, durs = lick
+                answer = {'id': request.id, 'index': index}
+                if request.format == 'midi':
+                    answer['midi'] = b64encode(encode_lick(zip(notes, durs))).decode()
+                else:
+                    answer.update(notes=notes, durs=[encode_dur(dur) for dur in durs])
+                writer.write((dumps(answer) + '\n').encode())
+                await writer.drain()
+
+            if request.error is None:
+                answer = {'id': request.id, 'done': True, 'latency': request.latency}
+            else:
+                answer = {'id': request.id, 'error': request.error}
+            writer.write((dumps(answer) + '\n').encode())
+            await writer.drain()
+
+        writer.close()
+
+    async def serve(self, host='127.0.0.1', port=8765):
+        """
+        Starts the batch loop of every scale and accepts connections until the server is stopped.
+        """
+        loops = [create_task(self.run_scale(scale)) for scale in self.models]
+        server = await start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+        for scale_loop in loops:
+            scale_loop.cancel()
+
+def append_window(window, value):
+    """
+    Small helper Function to slide an input window: The oldest element is dropped, value is added.
+    """
+    return concatenate([window[1:], [value]])
+
+def format_lick(row):
+    """
+    Small helper Function which returns the index, notes and durations of a finished lick
+    without the Tokens (START and duration 0).
+    """
+    elements = [(note, dur) for note, dur in row.output if note != 'START' and dur != 0]
+    return row.index, [note for note, _ in elements], [dur for _, dur in elements]
+
+async def request_licks(host='127.0.0.1', port=8765, **request):
+    """
+    Client Function: Sends a single request (see LickRequest) to a running server.
+    Returns a list with the (notes, durations) of every lick (or the midi bytes if format is 'midi'),
+    ordered by their index.
+    """
+    reader, writer = await open_connection(host, port)
+    writer.write((dumps(request) + '\n').encode())
+    await writer.drain()
+
+    licks = {}
+    while True:
+        answer = loads(await reader.readline())
+        if 'error' in answer:
+            raise ValueError(answer['error'])
+        if answer.get('done'):
+            break
+        if 'midi' in answer:
+            licks[answer['index']] = b64decode(answer['midi'])
+        else:
+            licks[answer['index']] = (answer['notes'], [decode_dur(dur) for dur in answer['durs']])
+
+    writer.close()
+    await writer.wait_closed()
+    return [licks[index] for index in sorted(licks)]
+
+async def request_stats(host='127.0.0.1', port=8765):
+    """
+    Client Function: Returns the statistics of a running server (see LickServer.stats).
+    """
+    reader, writer = await open_connection(host, port)
+    writer.write((dumps({'command': 'stats'}) + '\n').encode())
+    await writer.drain()
+    stats = loads(await reader.readline())
+    writer.close()
+    await writer.wait_closed()
+    return stats
+
+def main():
+    parser = ArgumentParser(description='Local server for generating Jazz Licks')
+    parser.add_argument('--scales', nargs='+', default=['both', 'diatonic', 'alterated'])
+    parser.add_argument('--backend', default='keras', choices=['keras', 'numpy'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=256)
+    args = parser.parse_args()
+
+    models = {scale: load_model(scale, args.backend) for scale in args.scales}
+    server = LickServer(models, max_batch=args.max_batch)
+    print(f'Serving {", ".join(args.scales)} on {args.host}:{args.port}')
+    run_async(server.serve(args.host, args.port))
+
+if __name__ == '__main__':
+    main()
@@ -5,12 +5,22 @@ dependent on the predictions of a previously trained network.
 """
 
 from pickle import load
-from utils.jazz_lstm import generate_lstm_model
+from os import path
 from utils.midi_tools import build_note_dict
-from numpy import reshape, argmax, append, log, exp, array
-from numpy.random import randint, choice
+from utils.corpus import load_corpus, get_windows, pack_windows, PAD
+from numpy import (reshape, argmax, append, log, exp, array, full, ones, zeros,
+                   flatnonzero, newaxis, concatenate, float32, inf, argsort, take_along_axis,
+                   where, isin, arange, unique, unravel_index, broadcast_to, int64)
+from numpy.random import randint
+from utils.sampling import sample_tokens, get_rng, TINY
+from utils.smf import write_midi_files, write_midi_archive, pitch_name_to_midi
+from utils.instrumentation import timer, record, count
+from time import perf_counter_ns
 from music21 import stream, instrument, duration as m21_dur, note as m21_note
 
+# Tolerance for comparing durations in quarters (floats of Fractions)
+QUARTER_EPS = 1e-6
+
 def get_notes_and_durs(scale):
     """
     Function to load the Generated Note Vectors from the previously
@@ -44,7 +54,35 @@ def get_informations(scale='both'):
     3. Number of Unique Durations/Notes
     4. Dictionary Duration/Note to Integer
     5. Dictionary Integer to Duration/Note
-    6. Inputs for the network (From previous pickle.dump)
+    6. Inputs for the network
+    The informations are loaded from the corpus folder (stored/corpus) -
+    older stored binaries (pickle dump) are used if there is no corpus.
+    """
+    if not path.exists(f'stored/corpus/{scale}/meta.json'):
+        return get_pickled_informations(scale)
+
+    # Memory-mapped corpus
+    corpus = load_corpus(f'stored/corpus/{scale}')
+    note_to_int, int_to_note = corpus['note_to_int'], corpus['int_to_note']
+    dur_to_int, int_to_dur = corpus['dur_to_int'], corpus['int_to_dur']
+
+    # Note/Duration Vectors: Map the integers back to the symbols
+    note_vec = array(list(note_to_int), dtype=object)[corpus['notes']]
+    dur_vec = array(list(dur_to_int), dtype=object)[corpus['durs']]
+
+    # Inputs for Network - Views of the corpus
+    note_input, dur_input = get_windows(corpus)
+
+    # Put all information in a Tuple
+    notes_informations = (note_vec, set(note_to_int), len(note_to_int), note_to_int, int_to_note, note_input)
+    durs_informations = (dur_vec, set(dur_to_int), len(dur_to_int), dur_to_int, int_to_dur, dur_input)
+
+    return notes_informations, durs_informations
+
+def get_pickled_informations(scale='both'):
+    """
+    Function to reproduce all important informations of a scale (see get_informations)
+    from the older stored binaries (pickle dump).
     """
     # Note/Duration Vectors
     note_vec, dur_vec = get_notes_and_durs(scale)
@@ -72,7 +110,7 @@ def get_informations(scale='both'):
 
     return notes_informations, durs_informations
 
-def set_randomize_val(output, rand_val):
+def set_randomize_val(output, rand_val, top_k=None, top_p=None, rng=None):
     """
     Function to generate a more or less randomized output based on the rand_val
     If rand val is set 0: The Network will generate an output which corresponds
@@ -80,23 +118,23 @@ def set_randomize_val(output, rand_val):
     If not: A data distribution will be simulated, which will be further used as
     a base to draw elements from.
     The more the rand_val is set to 1, the more randomized the output sequence will be.
+    Top_k/top_p restrict the drawn elements to the most likely ones and rng makes the
+    result reproducible (see sampling.sample_tokens).
+    """
+    return sample_tokens(output, rand_val, top_k=top_k, top_p=top_p, rng=rng)
+
+def set_randomize_vals(outputs, rand_val, top_k=None, top_p=None, rng=None):
+    """
+    Vectorized version of set_randomize_val for a whole batch of network outputs
+    with a shape of ( n, x ).
+    Returns an array with one drawn element per row - the rand_val has the same meaning
+    as in set_randomize_val.
     """
-    # Get the most likely output
-    if rand_val == 0:
-        return argmax(output)
-    # Get a randomized output based on the rand_val
-    else:
-        # Generate a probabilistic data distribution
-        output = log(output) / rand_val
-        output_exp = exp(output)
-        output = output_exp / sum(output_exp)
-        # Based on probability p: Draw more or less
-        # randomized elements from the sequence
-        return choice(len(output), p=output)
+    return sample_tokens(outputs, rand_val, top_k=top_k, top_p=top_p, rng=rng)
 
 def generate_notes_durs(model, note_informations, durs_informations, 
                         length=17, additional_notes=17, note_rand=0.55,
-                        dur_rand=0.1):
+                        dur_rand=0.1, top_k=None, top_p=None, seed=None, packed=False):
     """
     Function to generate a sequence which corresponds to a new generated lick.
     The sequence can be further translated in midi format.
@@ -121,6 +159,13 @@ def generate_notes_durs(model, note_informations, durs_informations,
     the more the value is to 1 the more randomized the duration pattern will be.
     Note: The duration wont have a big variance so a big number wont affect the sequence 
     that much.
+
+    5: Top k / Top p: Draw notes and durations only from the top_k most likely elements
+    or from the most likely elements which add up to the probability top_p (nucleus sampling).
+
+    6: Seed: Seed (or numpy Generator) for reproducible sequences.
+
+    7: Packed: Has to be set for models which were trained with packed windows (see generate_batch_notes_durs).
     """
         
         
@@ -135,6 +180,11 @@ def generate_notes_durs(model, note_informations, durs_informations,
     notes = ['START'] * length
     durations = [0] * length
     
+    # Generator for drawing the notes/durations
+    rng = get_rng(seed)
+    # Start of the generation (instrumentation)
+    start_ns = perf_counter_ns()
+
     # Fill output sequence with Tokens to determine the output length
     pred_output = [[note, dur] for note, dur in zip(notes, durations)]
     # Input sequence for notes based on START Tokens - determines the length
@@ -145,15 +195,17 @@ def generate_notes_durs(model, note_informations, durs_informations,
     for idx in range(additional_notes):
         
         # Put the input information in a right format
-        pred_input = [array([note_input]),
-                      array([dur_input])]
+        pred_input = get_model_inputs(array([note_input]), array([dur_input]),
+                                      note_to_int['START'], packed)
         
         # Let the network predict new notes + durations based on the input
-        pred_notes, pred_durs = model.predict(pred_input, verbose=0)
+        with timer('predict', step=idx):
+            pred_notes, pred_durs = model.predict(pred_input, verbose=0)
         
         # Get a more or less randomized prediction based on the predicted network output 
-        randomized_note_val = set_randomize_val(pred_notes[0], note_rand)
-        randomized_dur_val = set_randomize_val(pred_durs[0], dur_rand)
+        with timer('sampling'):
+            randomized_note_val = set_randomize_val(pred_notes[0], note_rand, top_k, top_p, rng)
+            randomized_dur_val = set_randomize_val(pred_durs[0], dur_rand, top_k, top_p, rng)
         
         # Map the predicted note/duration back to a note/duration symbol
         generated_note = int_to_note[randomized_note_val]
@@ -175,9 +227,504 @@ def generate_notes_durs(model, note_informations, durs_informations,
         # Break if the generated note is a Token
         if generated_note == 'START':
             break
+
+    # Generated Tokens per second (instrumentation)
+    record('generate_notes_durs', start_ns, perf_counter_ns() - start_ns)
+    count('generated_tokens', len(pred_output) - length, per='generate_notes_durs')
         
     return pred_output
 
+def get_model_inputs(note_input, dur_input, start_val, packed=False):
+    """
+    Small helper Function which returns the inputs of the model for windows of the generation:
+    The windows themselves or packed windows for packed models (see corpus.pack_windows).
+    """
+    if packed:
+        return list(pack_windows(note_input, dur_input, start_val))
+    return [note_input, dur_input]
+
+def generate_batch_notes_durs(model, note_informations, durs_informations, n,
+                              length=17, additional_notes=17, note_rand=0.55,
+                              dur_rand=0.1, top_k=None, top_p=None, seed=None, packed=False):
+    """
+    Batched version of generate_notes_durs which generates n licks at once.
+    Every step runs a single prediction with a shape of ( n, length ) instead of
+    n predictions with a batch size of 1.
+    A lick is terminated (masked) as soon as its generated note is a Token,
+    terminated licks are not part of the following predictions.
+    The Function returns a list of n sequences in the format of generate_notes_durs.
+    The optional parameters have the same meaning as in generate_notes_durs.
+    Packed models (trained with packed windows, see generate_lstm_model with mask_zero) need packed set:
+    The inputs are padded in front of the START Token and shifted by 1 (see corpus.get_packed_inputs).
+    """
+
+    # Fecth Note and Duration information
+    note_to_int, int_to_note = note_informations[3], note_informations[4]
+    dur_to_int, int_to_dur = durs_informations[3], durs_informations[4]
+
+    # Generator for drawing the notes/durations
+    rng = get_rng(seed)
+    # Start of the generation (instrumentation)
+    start_ns = perf_counter_ns()
+
+    # Every lick starts with START and 0 Tokens
+    pred_outputs = [[['START', 0] for _ in range(length)] for _ in range(n)]
+    # Input matrices with a shape of ( n, length ) based on the Tokens
+    note_input = full((n, length), note_to_int['START'])
+    dur_input = full((n, length), dur_to_int[0])
+    start_val = note_to_int['START']
+
+    # Packed windows: Padding + a single START/0 Token, every token is shifted by 1
+    offset = int(packed)
+    if packed:
+        note_input[:, :-1], dur_input[:, :-1] = PAD, PAD
+        note_input[:, -1] += offset
+        dur_input[:, -1] += offset
+
+    # Mask of licks which are not terminated
+    active = ones(n, dtype=bool)
+
+    for idx in range(additional_notes):
+
+        # Indices of the licks which are still generated
+        rows = flatnonzero(active)
+        if len(rows) == 0:
+            break
+
+        # Let the network predict new notes + durations for all active licks at once
+        with timer('predict', step=idx, rows=len(rows)):
+            pred_notes, pred_durs = model.predict([note_input[rows], dur_input[rows]],
+                                                  verbose=0, batch_size=len(rows))
+
+        # Get more or less randomized predictions for the whole batch
+        with timer('sampling', rows=len(rows)):
+            randomized_note_vals = set_randomize_vals(pred_notes, note_rand, top_k, top_p, rng)
+            randomized_dur_vals = set_randomize_vals(pred_durs, dur_rand, top_k, top_p, rng)
+        count('batch_generated_tokens', len(rows), per='generate_batch_notes_durs')
+
+        # Map the predictions back to note/duration symbols
+        for row, note_val, dur_val in zip(rows, randomized_note_vals, randomized_dur_vals):
+            pred_outputs[row].append([int_to_note[note_val], int_to_dur[dur_val]])
+
+        # Slide the window: Drop the oldest element and add the prediction
+        note_input[rows, :-1] = note_input[rows, 1:]
+        dur_input[rows, :-1] = dur_input[rows, 1:]
+        note_input[rows, -1] = randomized_note_vals + offset
+        dur_input[rows, -1] = randomized_dur_vals + offset
+
+        # Mask every lick whose generated note is a Token
+        active[rows[randomized_note_vals == start_val]] = False
+
+    # Generated Tokens per second (instrumentation)
+    record('generate_batch_notes_durs', start_ns, perf_counter_ns() - start_ns, n=n)
+
+    return pred_outputs
+
+def get_prefix_states(step_model, note_val, dur_val, length, rnn_units):
+    """
+    Function to run length Tokens (note_val/dur_val) through the step model one by one
+    (see generate_inference_models), starting with zero states.
+    Returns the hidden states of the last LSTM layer with a shape of ( length, rnn_units )
+    and the states of both LSTM layers after every amount of Tokens (index 0: the zero states)
+    as 4 arrays with a shape of ( length + 1, rnn_units ).
+    """
+    states = [zeros((1, rnn_units), dtype=float32) for _ in range(4)]
+    hidden_states, prefix_states = [], [[state[0]] for state in states]
+    for _ in range(length):
+        hidden, *states = step_model.predict_on_batch([full((1, 1), note_val), full((1, 1), dur_val)] + states)
+        hidden_states.append(hidden[0, 0])
+        for prefix_state, state in zip(prefix_states, states):
+            prefix_state.append(state[0])
+    return array(hidden_states), [array(prefix_state) for prefix_state in prefix_states]
+
+def generate_stateful_notes_durs(step_model, head_model, note_informations, durs_informations,
+                                 n=1, length=17, additional_notes=17, note_rand=0.55,
+                                 dur_rand=0.1, top_k=None, top_p=None, seed=None, exact=False, packed=False):
+    """
+    Incremental version of generate_batch_notes_durs based on the inference models
+    of generate_inference_models (jazz_lstm).
+    The windowed model runs both LSTM layers over its whole sliding window for every new note,
+    every window starts with zero states and the leading START Tokens of the window.
+    > exact=False (default): The states of the LSTM layers and a buffer of the last length hidden states
+    (for the Attention Mechanism) are carried from step to step, so every new note/duration
+    costs a single recurrent step. This is not a replacement of the windowed generation:
+    the states still contain the notes/durations which have left the window, so the
+    licks drift from generate_batch_notes_durs after the first prediction.
+    > exact=True: Generates the same licks as generate_batch_notes_durs (same seed, see check_stateful_parity).
+    The states and hidden states of the leading START Tokens are computed once for all licks,
+    but every step still runs the generated notes/durations of the window through the LSTM layers
+    (O(length^2) recurrent steps per lick like the windowed generation, on average half of them).
+    Packed models (see generate_batch_notes_durs) need packed set: The padding is masked by the
+    windowed model, so the LSTM layers only run over a single START Token + the generated
+    notes/durations (shifted by 1) and the buffer grows with the generated notes up to length.
+    The Function returns a list of n sequences in the format of generate_notes_durs.
+    """
+
+    # Fecth Note and Duration information
+    note_to_int, int_to_note = note_informations[3], note_informations[4]
+    dur_to_int, int_to_dur = durs_informations[3], durs_informations[4]
+    start_val = note_to_int['START']
+
+    # Generator for drawing the notes/durations
+    rng = get_rng(seed)
+    # Start of the generation (instrumentation)
+    start_ns = perf_counter_ns()
+
+    # Every lick starts with START and 0 Tokens
+    pred_outputs = [[['START', 0] for _ in range(length)] for _ in range(n)]
+
+    # Run the Tokens through the LSTM layers once (the same for every lick)
+    # The hidden states build the buffer for the Attention Mechanism
+    # Packed windows: A single START/0 Token, every token is shifted by 1
+    offset = int(packed)
+    n_prefix = 1 if packed else length
+    rnn_units = head_model.input_shape[-1]
+    prefix_hidden, prefix_states = get_prefix_states(step_model, start_val + offset, dur_to_int[0] + offset,
+                                                     n_prefix, rnn_units)
+    hidden_buffer = broadcast_to(prefix_hidden, (n, n_prefix, rnn_units)).copy()
+    states = [broadcast_to(prefix_state[-1], (n, rnn_units)).copy() for prefix_state in prefix_states]
+
+    # Generated notes/durations of every lick (exact mode)
+    generated_notes = zeros((n, additional_notes), dtype=int64)
+    generated_durs = zeros((n, additional_notes), dtype=int64)
+
+    # Mask of licks which are not terminated
+    active = ones(n, dtype=bool)
+
+    for idx in range(additional_notes):
+
+        # Indices of the licks which are still generated
+        rows = flatnonzero(active)
+        if len(rows) == 0:
+            break
+
+        # Apply the Attention Mechanism on the buffered hidden states
+        with timer('predict', step=idx, rows=len(rows)):
+            pred_notes, pred_durs = head_model.predict_on_batch(hidden_buffer[rows])
+
+        # Get more or less randomized predictions for the whole batch
+        with timer('sampling', rows=len(rows)):
+            randomized_note_vals = set_randomize_vals(pred_notes, note_rand, top_k, top_p, rng)
+            randomized_dur_vals = set_randomize_vals(pred_durs, dur_rand, top_k, top_p, rng)
+        count('stateful_generated_tokens', len(rows), per='generate_stateful_notes_durs')
+
+        # Map the predictions back to note/duration symbols
+        for row, note_val, dur_val in zip(rows, randomized_note_vals, randomized_dur_vals):
+            pred_outputs[row].append([int_to_note[note_val], int_to_dur[dur_val]])
+        generated_notes[rows, idx], generated_durs[rows, idx] = randomized_note_vals, randomized_dur_vals
+
+        # Mask every lick whose generated note is a Token
+        active[rows[randomized_note_vals == start_val]] = False
+
+        # No further recurrent step is needed after the last prediction
+        if idx == additional_notes - 1:
+            break
+
+        if exact:
+            # Window of the next step: n_tokens START Tokens + the last generated notes/durations
+            n_generated = min(idx + 1, length)
+            n_tokens = min(length - n_generated, n_prefix)
+            with timer('recurrent_step', step=idx, rows=len(rows)):
+                hidden, *_ = step_model.predict_on_batch(
+                    [generated_notes[rows, idx + 1 - n_generated:idx + 1] + offset,
+                     generated_durs[rows, idx + 1 - n_generated:idx + 1] + offset]
+                    + [broadcast_to(prefix_state[n_tokens], (len(rows), rnn_units)) for prefix_state in prefix_states])
+            window = concatenate([broadcast_to(prefix_hidden[:n_tokens], (len(rows), n_tokens, rnn_units)),
+                                  hidden], axis=1)
+            # Packed windows grow until they are full
+            if window.shape[1] != hidden_buffer.shape[1]:
+                hidden_buffer = zeros((n, ) + window.shape[1:], dtype=window.dtype)
+            hidden_buffer[rows] = window
+            continue
+
+        # A single recurrent step with the predicted note/duration
+        with timer('recurrent_step', step=idx, rows=len(rows)):
+            hidden, *new_states = step_model.predict_on_batch([randomized_note_vals[:, newaxis] + offset,
+                                                               randomized_dur_vals[:, newaxis] + offset]
+                                                              + [state[rows] for state in states])
+
+        # Update the states + slide the buffer of hidden states (packed: the buffer grows up to length)
+        for state, new_state in zip(states, new_states):
+            state[rows] = new_state
+        if hidden_buffer.shape[1] < length:
+            hidden_buffer = concatenate([hidden_buffer, zeros((n, 1, rnn_units), dtype=hidden_buffer.dtype)], axis=1)
+            hidden_buffer[rows, -1] = hidden[:, -1]
+        else:
+            hidden_buffer[rows] = concatenate([hidden_buffer[rows, 1:], hidden], axis=1)
+
+    # Generated Tokens per second (instrumentation)
+    record('generate_stateful_notes_durs', start_ns, perf_counter_ns() - start_ns, n=n)
+
+    return pred_outputs
+
+def check_stateful_parity(model, step_model, head_model, note_informations, durs_informations,
+                          n=1, length=17, additional_notes=17, note_rand=0, dur_rand=0, seed=None, exact=True,
+                          packed=False):
+    """
+    Compares the incremental generation (generate_stateful_notes_durs) with the
+    windowed generation (generate_batch_notes_durs), default in argmax mode (note_rand=0 and dur_rand=0)
+    and in exact mode (exact=False shows the drift of the carried states).
+    With the same seed both generations draw the same random numbers.
+    Packed has to be set for models which were trained with packed windows (see generate_batch_notes_durs).
+    Returns the number of identical generated note/duration pairs and the number of compared pairs
+    (equal numbers in exact mode).
+    """
+    windowed = generate_batch_notes_durs(model, note_informations, durs_informations, n,
+                                         length=length, additional_notes=additional_notes,
+                                         note_rand=note_rand, dur_rand=dur_rand, seed=seed, packed=packed)
+    stateful = generate_stateful_notes_durs(step_model, head_model, note_informations,
+                                            durs_informations, n, length=length,
+                                            additional_notes=additional_notes,
+                                            note_rand=note_rand, dur_rand=dur_rand, seed=seed, exact=exact,
+                                            packed=packed)
+
+    # Compare only the generated part of both sequences
+    compared = [(windowed_pair, stateful_pair) for windowed_lick, stateful_lick in zip(windowed, stateful)
+                for windowed_pair, stateful_pair in zip(windowed_lick[length:], stateful_lick[length:])]
+    identical = sum(windowed_pair == stateful_pair for windowed_pair, stateful_pair in compared)
+    # Both generations have to stop at the same position
+    compared_count = max(len(compared), sum(len(lick) - length for lick in windowed),
+                         sum(len(lick) - length for lick in stateful))
+    return identical, compared_count
+
+def get_pitch_classes(int_to_note):
+    """
+    Small helper Function which returns the pitch class of every note integer (-1 for rests and Tokens).
+    """
+    return array([pitch_name_to_midi(int_to_note[idx]) % 12 if int_to_note[idx] not in ('START', 'rest') else -1
+                  for idx in range(len(int_to_note))])
+
+def get_copied_ngrams(training_index, max_copy):
+    """
+    Small helper Function which returns the note subsequences of the training data with the length max_copy + 1
+    (see check_overfitting.build_lick_index) - a lick containing one of them copies more than max_copy notes.
+    """
+    if max_copy is None:
+        return set()
+    return training_index['ngrams'].get(max_copy + 1, set())
+
+def check_lick_constraints(output, total_quarters=12, overhang=1, end_pitch_classes=None,
+                           max_copy=8, training_index=None):
+    """
+    Function to check if a generated sequence (format of generate_notes_durs) fulfills the constraints
+    of the beam search (see generate_beam_notes_durs):
+    > The last note starts before total_quarters (default: 3 bars) and ends at most overhang quarters after it,
+      every note before it ends before total_quarters
+    > The last note is no rest, its pitch class is in end_pitch_classes (if set)
+    > The lick is no copy of a training lick and copies at most max_copy notes of a training lick
+    Returns if the lick is usable.
+    """
+    lick = [[note, dur] for note, dur in output if note != 'START' and dur != 0]
+    if not lick or lick[-1][0] == 'rest':
+        return False
+
+    # Every note before the last one ends before total_quarters
+    ends = [sum(float(dur) for _, dur in lick[:idx + 1]) for idx in range(len(lick))]
+    if any(end >= total_quarters - QUARTER_EPS for end in ends[:-1]):
+        return False
+    if not total_quarters - QUARTER_EPS <= ends[-1] <= total_quarters + overhang + QUARTER_EPS:
+        return False
+    if end_pitch_classes is not None and pitch_name_to_midi(lick[-1][0]) % 12 not in end_pitch_classes:
+        return False
+
+    if training_index is not None:
+        # Local import: check_overfitting loads the plot libraries
+        from utils.check_overfitting import is_copied
+        notes = tuple(note for note, _ in lick)
+        if is_copied(notes, training_index):
+            return False
+        copied_ngrams = get_copied_ngrams(training_index, max_copy)
+        if copied_ngrams and any(notes[start:start + max_copy + 1] in copied_ngrams
+                                 for start in range(len(notes) - max_copy)):
+            return False
+    return True
+
+def beam_search_groups(model, note_informations, durs_informations, first_notes, first_durs, first_scores,
+                       beam_width, length, total_quarters, overhang, max_notes, end_pitch_classes,
+                       copied_ngrams, max_copy, note_k, dur_k, packed=False):
+    """
+    Beam search of generate_beam_notes_durs: Every group starts with its first note/duration
+    and keeps the beam_width best unfinished licks (sum of the joint log probabilities).
+    The beams of all groups are predicted together with a single prediction per step
+    (packed windows for packed models, see get_model_inputs).
+    Returns a list with the finished licks of every group as (normalized score, notes, durs).
+    """
+    note_to_int, int_to_note = note_informations[3], note_informations[4]
+    dur_to_int, int_to_dur = durs_informations[3], durs_informations[4]
+    start_val, zero_dur = note_to_int['START'], dur_to_int[0]
+
+    # Durations in quarters + notes which can end a lick (no rests, pitch class of end_pitch_classes)
+    dur_values = array([float(int_to_dur[idx]) for idx in range(len(int_to_dur))])
+    pitch_classes = get_pitch_classes(int_to_note)
+    can_end = pitch_classes >= 0
+    if end_pitch_classes is not None:
+        can_end &= isin(pitch_classes, list(end_pitch_classes))
+
+    # One beam per group: Window of the START Tokens + the first note/duration
+    n_groups = len(first_notes)
+    groups = arange(n_groups)
+    note_input = concatenate([full((n_groups, length - 1), start_val), first_notes[:, newaxis]], axis=1)
+    dur_input = concatenate([full((n_groups, length - 1), zero_dur), first_durs[:, newaxis]], axis=1)
+    cumulative = dur_values[first_durs]
+    scores = first_scores
+    histories = [([note], [dur]) for note, dur in zip(first_notes, first_durs)]
+    finished = [[] for _ in range(n_groups)]
+
+    for idx in range(max_notes - 1):
+        if len(groups) == 0:
+            break
+
+        # Let the network predict the next notes + durations for the beams of every group at once
+        with timer('predict', step=idx, rows=len(groups)):
+            pred_notes, pred_durs = model.predict(get_model_inputs(note_input, dur_input, start_val, packed),
+                                                  verbose=0, batch_size=len(groups))
+        count('beam_predicted_rows', len(groups), per='generate_beam_notes_durs')
+
+        # Joint log probabilities of the note_k most likely notes x the dur_k most likely durations
+        # (the Tokens are no candidates: A lick is finished by its last note)
+        note_logs, dur_logs = log(pred_notes + TINY), log(pred_durs + TINY)
+        note_logs[:, start_val], dur_logs[:, zero_dur] = -inf, -inf
+        top_notes = argsort(-note_logs, axis=1)[:, :note_k]
+        top_durs = argsort(-dur_logs, axis=1)[:, :dur_k]
+        joint = (scores[:, newaxis, newaxis] + take_along_axis(note_logs, top_notes, axis=1)[:, :, newaxis]
+                 + take_along_axis(dur_logs, top_durs, axis=1)[:, newaxis, :])
+
+        # Length constraint: A note which reaches total_quarters has to end the lick
+        ends = (cumulative[:, newaxis] + dur_values[top_durs])[:, newaxis, :]
+        reaches_end = ends >= total_quarters - QUARTER_EPS
+        valid = ~reaches_end | ((ends <= total_quarters + overhang + QUARTER_EPS) & can_end[top_notes][:, :, newaxis])
+        joint = where(valid, joint, -inf)
+
+        # Best candidates of every group - the copy constraint is only checked for the considered candidates
+        parents, new_notes, new_durs, new_scores = [], [], [], []
+        for group in unique(groups):
+            rows = flatnonzero(groups == group)
+            candidates = joint[rows].ravel()
+            n_live = 0
+            for candidate in argsort(-candidates):
+                if candidates[candidate] == -inf or n_live == beam_width or len(finished[group]) >= beam_width:
+                    break
+                row, note_idx, dur_idx = unravel_index(candidate, (len(rows), note_k, dur_k))
+                row = rows[row]
+                note_val, dur_val = top_notes[row, note_idx], top_durs[row, dur_idx]
+                notes = histories[row][0] + [note_val]
+                if max_copy is not None and len(notes) > max_copy and \
+                        tuple(int_to_note[val] for val in notes[-max_copy - 1:]) in copied_ngrams:
+                    continue
+
+                if reaches_end[row, 0, dur_idx]:
+                    # Normalized by the amount of notes, so shorter licks are not preferred
+                    finished[group].append((candidates[candidate] / len(notes), notes, histories[row][1] + [dur_val]))
+                else:
+                    parents.append(row)
+                    new_notes.append(note_val)
+                    new_durs.append(dur_val)
+                    new_scores.append(candidates[candidate])
+                    n_live += 1
+
+        # Groups with enough finished licks are not continued
+        keep = [idx for idx, parent in enumerate(parents) if len(finished[groups[parent]]) < beam_width]
+        parents = array(parents, dtype=int)[keep]
+        new_notes = array(new_notes, dtype=int)[keep]
+        new_durs = array(new_durs, dtype=int)[keep]
+
+        # Slide the windows of the continued beams
+        note_input = concatenate([note_input[parents, 1:], new_notes[:, newaxis]], axis=1)
+        dur_input = concatenate([dur_input[parents, 1:], new_durs[:, newaxis]], axis=1)
+        cumulative = cumulative[parents] + dur_values[new_durs]
+        scores = array(new_scores, dtype=float)[keep]
+        histories = [(histories[parent][0] + [note], histories[parent][1] + [dur])
+                     for parent, note, dur in zip(parents, new_notes, new_durs)]
+        groups = groups[parents]
+
+    return finished
+
+def generate_beam_notes_durs(model, note_informations, durs_informations, n,
+                             beam_width=8, length=17, total_quarters=12, overhang=1, max_notes=32,
+                             end_pitch_classes=None, max_copy=8, training_index=None,
+                             note_k=8, dur_k=4, note_rand=0.55, dur_rand=0.1, max_rounds=3,
+                             seed=None, send_scores=False, packed=False):
+    """
+    Function to generate n licks with a batched beam search instead of drawing every note:
+    Every lick gets a randomly drawn first note/duration (note_rand/dur_rand like generate_notes_durs,
+    so the n licks are different), the rest of the lick is the most likely continuation
+    (sum of the log probabilities of the notes and the durations) found by a beam search
+    with beam_width beams. All beams of all licks are predicted together.
+    The constraints are checked during the search, so only usable licks are generated
+    (see check_lick_constraints):
+    > total_quarters / overhang: The length of the lick (default: 3 bars), the last note may exceed it by overhang quarters
+    > end_pitch_classes: Pitch classes of the last note, e.g. the chord tones of Bbmaj9: {10, 2, 5, 9, 0}
+      (default: every pitch, no rest)
+    > max_copy: Maximal amount of consecutive notes copied from a training lick (None: no limit).
+      The training licks are taken from note_informations or from a lick index (see check_overfitting.build_lick_index).
+    > max_notes: Maximal amount of notes of a lick
+    > note_k / dur_k: Amount of the most likely notes/durations which are considered for every beam
+    Licks of a round which found no usable continuation (or a lick of another group) are searched again
+    with a new first note (at most max_rounds rounds).
+    Packed has to be set for models which were trained with packed windows (see generate_batch_notes_durs).
+    The Function returns a list of (at most) n sequences in the format of generate_notes_durs
+    (+ the normalized log probabilities of the licks if send_scores is set).
+    """
+    # Local import: check_overfitting loads the plot libraries
+    from utils.check_overfitting import build_lick_index
+    from utils.evaluate import extract_lick_elements
+
+    note_to_int, int_to_note = note_informations[3], note_informations[4]
+    dur_to_int, int_to_dur = durs_informations[3], durs_informations[4]
+    if training_index is None and max_copy is not None:
+        training_index = build_lick_index(extract_lick_elements(list(note_informations[0])))
+    copied_ngrams = get_copied_ngrams(training_index, max_copy)
+
+    # Generator for drawing the first notes/durations
+    rng = get_rng(seed)
+    start_ns = perf_counter_ns()
+
+    # Prediction of the START window: Base of every first note/duration
+    start_input = get_model_inputs(full((1, length), note_to_int['START']), full((1, length), dur_to_int[0]),
+                                   note_to_int['START'], packed)
+    with timer('predict', step='start', rows=1):
+        pred_notes, pred_durs = model.predict(start_input, verbose=0)
+    pred_notes[:, note_to_int['START']], pred_durs[:, dur_to_int[0]] = 0, 0
+    note_logs, dur_logs = log(pred_notes[0] + TINY), log(pred_durs[0] + TINY)
+
+    licks, found = [], set()
+    for _ in range(max_rounds):
+        missing = n - len(licks)
+        if missing == 0:
+            break
+        first_notes = set_randomize_vals(pred_notes.repeat(missing, axis=0), note_rand, rng=rng)
+        first_durs = set_randomize_vals(pred_durs.repeat(missing, axis=0), dur_rand, rng=rng)
+        finished = beam_search_groups(model, note_informations, durs_informations, first_notes, first_durs,
+                                      note_logs[first_notes] + dur_logs[first_durs],
+                                      beam_width, length, total_quarters, overhang, max_notes, end_pitch_classes,
+                                      copied_ngrams, max_copy, note_k, dur_k, packed)
+
+        # Best lick of every group which is not already a lick of another group
+        for group_licks in finished:
+            for score, notes, durs in sorted(group_licks, key=lambda lick: -lick[0]):
+                key = (tuple(notes), tuple(durs))
+                if key not in found and (training_index is None or
+                                         tuple(int_to_note[val] for val in notes) not in training_index['exact']):
+                    found.add(key)
+                    licks.append((score, notes, durs))
+                    break
+
+    record('generate_beam_notes_durs', start_ns, perf_counter_ns() - start_ns, n=n)
+
+    # Format of generate_notes_durs: START Tokens + notes/durations + the terminating Token
+    outputs = [[['START', 0] for _ in range(length)]
+               + [[int_to_note[note], int_to_dur[dur]] for note, dur in zip(notes, durs)] + [['START', 0]]
+               for _, notes, durs in licks]
+    if send_scores:
+        return outputs, [float(score) for score, _, _ in licks]
+    return outputs
+
+def get_lick_file_name(scale, idx):
+    """
+    Small helper Function which returns the file name of the generated lick idx of a scale.
+    """
+    return f'Generated_Lick_{scale}_{idx+1}.mid'
+
 def generate_midi_seq(output, scale, idx):
     """
     Function to translate the output of a sequence to a midi sequence.
@@ -221,23 +768,50 @@ def generate_midi_seq(output, scale, idx):
             midi_stream.append(new_note)
 
     # Write the new generated Lick sequence as midi file
-    midi_stream.write('midi', fp=f'generated_midi/{scale}/Generated_Lick_{scale}_{idx+1}.mid')
+    with timer('write_midi', writer='music21'):
+        midi_stream.write('midi', fp=f'generated_midi/{scale}/{get_lick_file_name(scale, idx)}')
 
 def generate_n_licks(n, jazz_model, notes_informations, durs_informations, 
                      scale='both', note_rand=0.55, dur_rand=0.1, 
-                     length=17, additional=17):
+                     length=17, additional=17, batch_size=64, top_k=None, top_p=None, seed=None,
+                     writer='smf', workers=4, packed=False):
     """
     Function to generate automatically n Licks at once in midi format.
     Scale will determine the saving folder for the Licks.
     Note that the note/informations will determine the scale of the generated lick.
     So the Generated lick needs the information for diatonic notes/durs to generate diatonic licks.
+    The licks are generated in batches of batch_size licks (see generate_batch_notes_durs).
+    Top_k, top_p and the seed are used for drawing the notes/durations (see generate_notes_durs).
+    Packed has to be set for models which were trained with packed windows (see generate_batch_notes_durs).
+    The writer determines how the licks are saved:
+    > smf: Every lick is encoded directly as midi file by a pool of worker threads (see smf.write_midi_files)
+    > zip: All licks are written into the single archive generated_midi/{scale}/Generated_Licks_{scale}.zip
+    > music21: Every lick is written as music21 stream (see generate_midi_seq)
     """
-    
-    # Loop for every generated lick
-    for lick_num in range(n):
-        # Produce the n-th sequence
-        output = generate_notes_durs(jazz_model, notes_informations, durs_informations, 
-                                     note_rand=note_rand, dur_rand=dur_rand, length=length,
-                                     additional_notes=additional)
-        # Write the n-th Lick
-        generate_midi_seq(output, scale, lick_num)
+
+    # One Generator for every batch, so the seed determines all n licks
+    rng = get_rng(seed)
+    archive_file = f'generated_midi/{scale}/Generated_Licks_{scale}.zip'
+
+    # Loop for every batch of generated licks
+    for batch_start in range(0, n, batch_size):
+        # Produce the sequences of the batch
+        outputs = generate_batch_notes_durs(jazz_model, notes_informations, durs_informations,
+                                            min(batch_size, n - batch_start),
+                                            note_rand=note_rand, dur_rand=dur_rand, length=length,
+                                            additional_notes=additional, top_k=top_k, top_p=top_p,
+                                            seed=rng, packed=packed)
+        file_names = [get_lick_file_name(scale, batch_start + offset) for offset in range(len(outputs))]
+
+        # Write the Licks of the batch
+        if writer == 'smf':
+            write_midi_files(outputs, [f'generated_midi/{scale}/{file_name}' for file_name in file_names],
+                             workers=workers)
+        elif writer == 'zip':
+            # The first batch creates a new archive, every other batch is appended
+            write_midi_archive(outputs, file_names, archive_file, mode='w' if batch_start == 0 else 'a')
+        elif writer == 'music21':
+            for offset, output in enumerate(outputs):
+                generate_midi_seq(output, scale, batch_start + offset)
+        else:
+            raise ValueError(f'Unknown writer {writer}')
@@ -3,12 +3,19 @@
 This Python File contains Functions to extract informations from midi files and porcess those informations to train a neural network.
 """
 
-from os import path
+from os import path, stat, makedirs, replace, getpid
 from music21 import note, converter
-from numpy import reshape
-from keras.utils import to_categorical
+from numpy import eye, float32
+from numpy.lib.stride_tricks import sliding_window_view
 from glob import glob
-from pickle import dump
+from pickle import dump, load
+from hashlib import sha1
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from utils.smf import read_midi_tokens
+from utils.augmentation import get_transposed_notes
+from utils.corpus import save_corpus, keep_vocabulary, map_to_int, find_lick_offsets, get_packed_windows, get_packed_inputs
+from utils.instrumentation import timer, count
 
 def read_midi_data(scale, both=True, folder='data'):
     """
@@ -35,7 +42,125 @@ def read_midi_data(scale, both=True, folder='data'):
 
     return midi_data, midi_conv
 
-def extract_notes_and_duration(scale='diatonic', both=True, length=17, show=True, folder='data', save_data=True, send_names=False):
+def parse_midi_file(midi_file, reader='music21'):
+    """
+    Function to parse a single midi file.
+    Returns the notes and durations of the lick (without any Tokens).
+    The reader determines how the midi file is parsed:
+    > music21: Builds a music21 score of the midi file
+    > smf: Reads the midi events directly from the bytes of the file (see smf.read_midi_tokens),
+    which is a lot faster but only supports monophonic licks
+    The Function is defined on module level, so it can be used in a process pool.
+    The parse time is recorded by the instrumentation (in a process pool only in the worker processes).
+    """
+    with timer('parse_midi_file', reader=reader, file=midi_file):
+        return read_midi_tokens(midi_file) if reader == 'smf' else parse_midi_score(midi_file)
+
+def parse_midi_score(midi_file):
+    """
+    Function to parse a single midi file with music21 (see parse_midi_file).
+    """
+    notes, durs = [], []
+
+    # Parse the corresponding midi file per stringname - a score will be returned
+    lick_score = converter.parse(midi_file)
+
+    # Loop through the music score of the midi file
+    for score_element in lick_score.flat:
+        # Check if the element is a note
+        # If so: Append the pitch + duration of the note element
+        if type(score_element) == note.Note:
+            notes.append(str(score_element.nameWithOctave))
+            durs.append(score_element.duration.quarterLength)
+        # Check if the element is a rest
+        # If so: Append the rest + duration
+        elif type(score_element) == note.Rest:
+            notes.append(str(score_element.name))
+            durs.append(score_element.duration.quarterLength)
+
+    return notes, durs
+
+def get_cache_file(midi_file, cache_folder, reader='music21'):
+    """
+    Small helper Function which returns the path of the cache file of a midi file.
+    The cache file is named after the hash of the absolute path of the midi file (+ the used reader).
+    """
+    midi_hash = sha1(f'{path.abspath(midi_file)}:{reader}'.encode()).hexdigest()
+    return path.join(cache_folder, f'{midi_hash}.pkl')
+
+def get_cache_key(midi_file):
+    """
+    Small helper Function which returns the key of a midi file for the cache:
+    A changed midi file will have a different modification time or size.
+    """
+    file_stat = stat(midi_file)
+    return path.abspath(midi_file), file_stat.st_mtime_ns, file_stat.st_size
+
+def load_cached_lick(midi_file, cache_folder, reader='music21'):
+    """
+    Function to load the notes and durations of a midi file from the cache.
+    Returns None if the midi file is not cached or was changed since it was cached.
+    """
+    cache_file = get_cache_file(midi_file, cache_folder, reader)
+    if not path.exists(cache_file):
+        return None
+
+    with open(cache_file, 'rb') as binaries:
+        cache_key, lick = load(binaries)
+
+    return lick if cache_key == get_cache_key(midi_file) else None
+
+def store_cached_lick(midi_file, lick, cache_folder, reader='music21'):
+    """
+    Function to save the notes and durations of a midi file in the cache.
+    The file is written under a temporary name (per process) first, so a cache file is never incomplete,
+    even if several processes cache the same midi file.
+    """
+    cache_file = get_cache_file(midi_file, cache_folder, reader)
+    temp_file = f'{cache_file}.{getpid()}.tmp'
+    with open(temp_file, 'wb') as store:
+        dump((get_cache_key(midi_file), lick), store)
+    replace(temp_file, cache_file)
+
+def parse_midi_files(midi_data, workers=1, cache_folder='stored/cache', reader='music21'):
+    """
+    Function to get the notes and durations of multiple midi files.
+    Already cached midi files (same path, modification time and size) are loaded from the cache folder,
+    every other midi file is parsed with the reader (see parse_midi_file) - with a process pool
+    if workers is above 1 - and added to the cache.
+    If cache_folder is None, every midi file will be parsed.
+    The Function returns a list of (notes, durations) per midi file in the order of midi_data
+    and a Dictionary with the amount of cache hits and misses.
+    """
+    licks = [None] * len(midi_data)
+
+    # Load every cached midi file
+    if cache_folder is not None:
+        makedirs(cache_folder, exist_ok=True)
+        for idx, midi_file in enumerate(midi_data):
+            licks[idx] = load_cached_lick(midi_file, cache_folder, reader)
+
+    # Parse every midi file which is not cached
+    missing = [idx for idx, lick in enumerate(licks) if lick is None]
+    missing_files = [midi_data[idx] for idx in missing]
+    if workers > 1 and len(missing_files) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            parsed = list(pool.map(partial(parse_midi_file, reader=reader), missing_files,
+                                   chunksize=max(1, len(missing_files) // (4 * workers))))
+    else:
+        parsed = [parse_midi_file(midi_file, reader) for midi_file in missing_files]
+
+    for idx, lick in zip(missing, parsed):
+        licks[idx] = lick
+        if cache_folder is not None:
+            store_cached_lick(midi_data[idx], lick, cache_folder, reader)
+
+    stats = {'hits': len(midi_data) - len(missing), 'misses': len(missing)}
+    return licks, stats
+
+def extract_notes_and_duration(scale='diatonic', both=True, length=17, show=True, folder='data', save_data=True, send_names=False,
+                               workers=1, cache_folder='stored/cache', send_stats=False, reader='music21',
+                               transpositions=None):
     """
     This Function will extract the notes from the training data in midi format.
     The scaling material of the training data can be adjusted with the parameters.
@@ -44,6 +169,15 @@ def extract_notes_and_duration(scale='diatonic', both=True, length=17, show=True
     Since the projects goal is to generate Jazz Licks the length should never exeed the default length.
     The default length is based on a classical Jazz Lick with a chain of eights and
     a full note in the 3. measure (tonic)
+    The midi files are parsed with workers processes and cached in the cache_folder
+    (see parse_midi_files), send_stats will additionally return the cache hits/misses.
+    Note: The cache is written even if save_data is not set - cache_folder=None parses every midi file
+    without writing to the cache.
+    The reader can be set to 'smf' for a fast parsing of monophonic licks (see parse_midi_file).
+    Transpositions (semitone offsets) extend the vocabulary of the saved corpus with the transposed notes,
+    so the corpus can be trained with the transposition augmentation (see pipeline.make_dataset).
+    If the corpus already exists, its notes/durations keep their integers (see corpus.keep_vocabulary) -
+    train with the vocabulary of the corpus (corpus.load_vocabulary) instead of build_note_dict.
     """
 
     # Saving extracted notes and durations in its order for every midi file
@@ -51,54 +185,63 @@ def extract_notes_and_duration(scale='diatonic', both=True, length=17, show=True
     durs = []
     midi_names = []
 
-    # Get the midi data and the music 21 converter
-    midi_data, midi_conv = read_midi_data(scale, both, folder=folder)
+    # Get the midi data
+    midi_data, _ = read_midi_data(scale, both, folder=folder)
+
+    # Get the notes and durations of every midi file (cached or parsed)
+    with timer('parse_midi_files', files=len(midi_data), workers=workers):
+        licks, stats = parse_midi_files(midi_data, workers=workers, cache_folder=cache_folder, reader=reader)
+    count('parsed_files', stats['misses'], per='parse_midi_files')
 
     # Loop through every midi file
-    for midi_file in midi_data:
+    for midi_file, (lick_notes, lick_durs) in zip(midi_data, licks):
         if show:
             print(f'Fetch data from : {midi_file}')
         if send_names:
             midi_names.append(midi_file)
 
-        # Parse the corresponding midi file per stringname - a score will be returned
-        lick_score = midi_conv.parse(midi_file)
-
         # Needed? - Test if it makes an impact
         # Delimiter to seperate the informations of each midi file
         # Its important to keep track of every Lick and its musical elements
         notes += length * ['START']
         durs += length * [0]
 
-        # Loop through the music score of each midi file
-        for score_element in lick_score.flat:
-            # Check if the element is a note
-            # If so: Append the pitch + duration of the note element
-            if type(score_element) == note.Note:
-                notes.append(str(score_element.nameWithOctave))
-                durs.append(score_element.duration.quarterLength)
-            # Check if the element is a rest
-            # If so: Append the rest + duration
-            elif type(score_element) == note.Rest:
-                notes.append(str(score_element.name))
-                durs.append(score_element.duration.quarterLength)
+        # Append the notes + durations of the lick
+        notes += lick_notes
+        durs += lick_durs
+
+    if show:
+        print(f'Cache hits: {stats["hits"]} - Cache misses: {stats["misses"]}')
 
     store_folder = scale if not both else 'both'
     
     if save_data:
-        # Save binaries for later
-        with open(path.join(f'stored/notes/{store_folder}'), 'wb') as store:
-            dump(notes, store)
-
-        with open(path.join(f'stored/durs/{store_folder}'), 'wb') as store:
-            dump(durs, store)
-
-    # Return extracted Notes + Durations (+ midi_names)
+        # Save the notes + durations as a compact corpus for later (see corpus.save_corpus)
+        note_to_int, dur_to_int = keep_vocabulary(f'stored/corpus/{store_folder}',
+                                                  *build_note_dict(notes, durs, transpositions))
+        save_corpus(notes, durs, note_to_int, dur_to_int, f'stored/corpus/{store_folder}', length=length,
+                    files=[get_cache_key(midi_file) for midi_file in midi_data])
+
+    # Return extracted Notes + Durations (+ midi_names) (+ cache stats)
+    results = (notes, durs)
     if send_names:
-        return notes, durs, midi_names
-    return notes, durs
+        results += (midi_names, )
+    if send_stats:
+        results += (stats, )
+    return results
 
-def generate_sequence(notes, durs, note_to_int, dur_to_int, scale, length=17):
+def compare_midi_readers(folder='data'):
+    """
+    Function to verify the smf reader against the music21 reader:
+    Every midi file in the folder (and its subfolders) is parsed with both readers.
+    Returns the amount of compared midi files and a list of the midi files with different tokens.
+    """
+    midi_data = sorted(glob(path.join(folder, '**', '*.mid'), recursive=True))
+    different = [midi_file for midi_file in midi_data
+                 if parse_midi_file(midi_file, 'music21') != parse_midi_file(midi_file, 'smf')]
+    return len(midi_data), different
+
+def generate_sequence(notes, durs, note_to_int, dur_to_int, scale, length=17, sparse=False, packed=False):
     """
     This Function will format the previous formated data (notes and durations)
     in a receivable format for the network (sequential data).
@@ -107,72 +250,66 @@ def generate_sequence(notes, durs, note_to_int, dur_to_int, scale, length=17):
     of ( m , length ) since the length regulates the sequence length.
     The outputs naturally contains 2 Arrays (note + duration) with a shape
     of ( m , x ) since the outputs are One-Hot-Coded.
+    If sparse is set, the outputs are not One-Hot-Coded but contain the integer of the
+    note/duration with a shape of ( m, ) - the model needs a sparse loss for this
+    (see generate_lstm_model).
     The number m will take the size note-vector-length - configured length,
     as a result the sequential input will be multiplied with a sliding window.
+    The inputs are read-only views of the mapped notes/durations, so no data is copied.
+    Note: The inputs are not saved (scale is only kept for compatibility),
+    since they can be derived from the saved corpus (see corpus.get_windows).
+    If packed is set, only the windows of the licks are built (see corpus.get_packed_windows):
+    Every window contains only its own lick, the inputs are padded and shifted by 1
+    (see corpus.get_packed_inputs) - the model needs mask_zero (see generate_lstm_model).
     """
 
-    # Collect Data about notes and durations
-    unique_notes = list(note_to_int.keys())
-    unique_durs = list(dur_to_int.keys())
-    size_notes = len(unique_notes)
-    size_durs = len(unique_durs)
-
-    # Data Structure for Inputs/Outputs for Notes and Durations
-    inputs_note, outputs_note = [], []
-    inputs_durs, outputs_durs = [], []
-
-    # Iterate with a sliding window over all notes
-    for num in range(len(notes) - length):
-
-        # Take a Subsequence of notes with the configured length
-        note_seq_in = notes[num:num + length]
-        # Fetch Note from note vector at position num + length
-        note_seq_out = notes[num + length]
-
-        # Convert the input sequence in a sequence of numbers + append
-        inputs_note.append([note_to_int[symbol] for symbol in note_seq_in])
-        # Convert the output Note into a number + append
-        outputs_note.append(note_to_int[note_seq_out])
-
-        # Take a Subsequence of durations with the configured length
-        dur_seq_in = durs[num:num + length]
-        # Fetch Duration from the duration vector at position num + length
-        dur_seq_out = durs[num + length]
-        # Convert the input sequence in a sequence of numbers + append
-        inputs_durs.append([dur_to_int[symbol] for symbol in dur_seq_in])
-        # Convert the output Note into a number + append
-        outputs_durs.append(dur_to_int[dur_seq_out])
-
-    # Save the current length of Arrays in Inputs
-    # The Number will determine m of the shape (m , length)
-    pattern_length = len(inputs_note)
-
-    # Reshaping the input vectors without changing the data within
-    # Important for preventing errors caused by different shapes when training the network
-    inputs_note = reshape(inputs_note, (pattern_length, length))
-    inputs_durs = reshape(inputs_durs, (pattern_length, length))
+    # Convert all notes and durations into numbers at once
+    note_ints = map_to_int(notes, note_to_int)
+    dur_ints = map_to_int(durs, dur_to_int)
+
+    # Sliding window over all notes/durations: Every subsequence with the configured length
+    # The last window is dropped since there is no following note/duration as output
+    inputs_note = sliding_window_view(note_ints, length)[:-1]
+    inputs_durs = sliding_window_view(dur_ints, length)[:-1]
     inputs = [inputs_note, inputs_durs]
 
-    # One Hot Coding the outpute notes and durations
-    # The total size of classes corresponds to the amount of unique notes and unique durations
-    outputs_note = to_categorical(outputs_note, num_classes=size_notes)
-    outputs_durs = to_categorical(outputs_durs, num_classes=size_durs)
+    # Each window is followed by the note/duration at position num + length
+    outputs_note = note_ints[length:]
+    outputs_durs = dur_ints[length:]
+
+    if packed:
+        # Only the windows whose output is part of a lick
+        corpus = {'notes': note_ints, 'durs': dur_ints, 'length': length,
+                  'offsets': find_lick_offsets(note_ints, note_to_int['START'])}
+        window_indices = get_packed_windows(corpus)
+        inputs = list(get_packed_inputs(corpus, window_indices))
+        outputs_note, outputs_durs = outputs_note[window_indices], outputs_durs[window_indices]
+
+    if not sparse:
+        # One Hot Coding the outpute notes and durations
+        # The total size of classes corresponds to the amount of unique notes and unique durations
+        # (Rows of an identity matrix - no need to import keras for this)
+        outputs_note = eye(len(note_to_int), dtype=float32)[outputs_note]
+        outputs_durs = eye(len(dur_to_int), dtype=float32)[outputs_durs]
     outputs = [outputs_note, outputs_durs]
 
-    with open(path.join(f'stored/inputs/{scale}'), 'wb') as store:
-        dump(inputs, store)
-
     return inputs, outputs
 
-def build_note_dict(notes, durs):
+def build_note_dict(notes, durs, transpositions=None):
     """
     This Function creates 2 Dictionarys based on the 2 Input Vectors:
     > 1: Mapping note names to a numerical value
     > 2: Mapping Durations to a numerical value
     These Dictionarys will be further used to create Training data
     for the network, because numbers are needed as a representation for the notes.
+    If transpositions (semitone offsets) are set, the notes transposed by every offset are
+    part of the note Dictionary as well (see augmentation.get_transposed_notes).
     """
 
+    # Transposed notes of the augmentation
+    if transpositions is not None:
+        notes = get_transposed_notes(notes, transpositions)
+
     # Get unique Notes (+ pitch) and Durations
     unique_notes = sorted(list(set(notes)))
     unique_durs = sorted(list(set(durs)))
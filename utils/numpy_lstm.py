@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+This Python File contains a NumPy implementation of the forward pass of the Jazz LSTM
+(see generate_lstm_model in jazz_lstm).
+The trained weights are exported once into a compact npz file, afterwards licks can be
+generated without importing Keras/Tensorflow.
+"""
+
+from numpy import (load, savez_compressed, exp, tanh, zeros, float32, asarray,
+                   concatenate, abs as np_abs, array, where, inf)
+from utils.corpus import PAD
+
+# Every layer of the network which contains weights (in the order of the network)
+WEIGHT_LAYERS = ['note_embedd', 'dur_embed', 'First_LSTM', 'Second_LSTM',
+                 'Adapt_layer', 'note_height', 'duration']
+
+def export_weights(model, file_path):
+    """
+    Function to export the weights of a trained Keras model into a npz file.
+    Each weight is saved as '<layer name>_<index>', where the index corresponds
+    to the order of layer.get_weights():
+    > Embedding: embeddings
+    > LSTM: kernel, recurrent kernel, bias
+    > Dense: kernel, bias
+    Models with mask_zero (packed windows, see jazz_lstm.generate_lstm_model) are marked with 'mask_zero'.
+    """
+    weights = {}
+    for layer_name in WEIGHT_LAYERS:
+        for idx, weight in enumerate(model.get_layer(layer_name).get_weights()):
+            weights[f'{layer_name}_{idx}'] = weight.astype(float32)
+    if model.get_layer('note_embedd').mask_zero:
+        weights['mask_zero'] = array(True)
+
+    savez_compressed(file_path, **weights)
+
+def sigmoid(x):
+    """
+    Logistic function (recurrent activation of the Keras LSTM layer).
+    """
+    return 1 / (1 + exp(-x))
+
+def softmax(x, axis=-1):
+    """
+    Numerically stable softmax function.
+    """
+    x = exp(x - x.max(axis=axis, keepdims=True))
+    return x / x.sum(axis=axis, keepdims=True)
+
+class NumpyJazzLSTM:
+    """
+    NumPy version of the Jazz LSTM based on an exported npz file (see export_weights).
+    The class can be used as a drop-in for the Keras model in generate_notes_durs and
+    generate_batch_notes_durs, since it implements the predict method with the same
+    inputs ([notes, durations] with a shape of ( m, length )) and outputs.
+    Exported models with mask_zero take packed windows (generate_batch_notes_durs with packed):
+    The padding is skipped by the LSTM layers and gets no attention, like in the Keras model.
+    """
+
+    def __init__(self, file_path):
+        with load(file_path) as weights:
+            self.weights = {name: weights[name] for name in weights.files}
+        self.set_dimensions(self.weights['note_embedd_0'], self.weights['dur_embed_0'])
+
+    def set_dimensions(self, note_embedding, dur_embedding):
+        """
+        Fetches the network dimensions from the embeddings and the weights
+        (the embeddings of packed models have an additional row).
+        """
+        self.mask_zero = bool(self.weights.pop('mask_zero', False))
+        n_rows, self.embed = note_embedding.shape
+        self.n_notes = n_rows - self.mask_zero
+        self.n_durs = dur_embedding.shape[0] - self.mask_zero
+        # The bias of the 4 gates (float32 in the quantized model as well)
+        self.rnn_units = self.weights['First_LSTM_2'].shape[0] // 4
+
+    def get_runtime_size(self):
+        """
+        Returns the size of the arrays which the model keeps in memory in bytes.
+        """
+        return sum(weight.nbytes for weight in self.weights.values())
+
+    def matmul(self, x, weight_name):
+        """
+        Matrix multiplication of x with a kernel of the network.
+        """
+        return x @ self.weights[weight_name]
+
+    def dense(self, x, layer_name):
+        """
+        Linear part of a Dense layer (kernel + bias).
+        """
+        return self.matmul(x, f'{layer_name}_0') + self.weights[f'{layer_name}_1']
+
+    def embedding(self, note_input, dur_input):
+        """
+        Embedding + Concat Layer: Returns the input sequence for the first LSTM layer
+        with a shape of ( m, length, 2 * embed ).
+        """
+        note_vecs = self.lookup(note_input, 'note_embedd_0')
+        dur_vecs = self.lookup(dur_input, 'dur_embed_0')
+        return concatenate([note_vecs, dur_vecs], axis=-1)
+
+    def lookup(self, ids, weight_name):
+        """
+        Rows of an embedding for the ids.
+        """
+        return self.weights[weight_name][asarray(ids, dtype=int)]
+
+    def lstm(self, sequence, layer_name, state=None, mask=None):
+        """
+        Forward pass of a LSTM layer over a sequence with a shape of ( m, length, x ).
+        The gates are ordered like in Keras (input, forget, cell, output).
+        Masked steps (mask with a shape of ( m, length )) keep the previous state.
+        Returns all hidden states + the final state (hidden state, cell state).
+        """
+        m, length = sequence.shape[:2]
+        units = self.rnn_units
+        if state is None:
+            state = (zeros((m, units), dtype=float32), zeros((m, units), dtype=float32))
+        hidden, cell = state
+
+        # The input part of every gate is calculated for the whole sequence at once
+        inputs = self.matmul(sequence, f'{layer_name}_0') + self.weights[f'{layer_name}_2']
+        hidden_states = zeros((m, length, units), dtype=float32)
+
+        for step in range(length):
+            gates = inputs[:, step] + self.matmul(hidden, f'{layer_name}_1')
+            input_gate = sigmoid(gates[:, :units])
+            forget_gate = sigmoid(gates[:, units:2 * units])
+            cell_gate = tanh(gates[:, 2 * units:3 * units])
+            output_gate = sigmoid(gates[:, 3 * units:])
+
+            new_cell = forget_gate * cell + input_gate * cell_gate
+            new_hidden = output_gate * tanh(new_cell)
+            if mask is None:
+                cell, hidden = new_cell, new_hidden
+            else:
+                cell = where(mask[:, step, None], new_cell, cell)
+                hidden = where(mask[:, step, None], new_hidden, hidden)
+            hidden_states[:, step] = hidden
+
+        return hidden_states, (hidden, cell)
+
+    def attention(self, hidden_states, mask=None):
+        """
+        Attention Mechanism + Outputs: Calculates the softmax weighted context vector
+        of the hidden states and the probabilities for the next note/duration.
+        Masked steps get no attention.
+        """
+        adapt_func = tanh(self.dense(hidden_states, 'Adapt_layer'))[..., 0]
+        if mask is not None:
+            adapt_func = where(mask, adapt_func, -inf)
+        weights = softmax(adapt_func, axis=1)
+        context = (weights[..., None] * hidden_states).sum(axis=1)
+        return (softmax(self.dense(context, 'note_height')),
+                softmax(self.dense(context, 'duration')))
+
+    def predict(self, inputs, verbose=0, batch_size=None):
+        """
+        Predicts the probabilities of the next note/duration
+        for the inputs [notes, durations] with a shape of ( m, length ).
+        Verbose and batch_size only exist for the compatibility with the Keras model.
+        """
+        note_input, dur_input = inputs
+        mask = asarray(note_input) != PAD if self.mask_zero else None
+        hidden_states, _ = self.lstm(self.embedding(note_input, dur_input), 'First_LSTM', mask=mask)
+        hidden_states, _ = self.lstm(hidden_states, 'Second_LSTM', mask=mask)
+        return list(self.attention(hidden_states, mask))
+
+def check_parity(model, numpy_model, inputs):
+    """
+    Function to compare the predictions of the Keras model with the NumPy model
+    for the same inputs [notes, durations].
+    Returns the maximal absolute difference of the note and the duration probabilities.
+    """
+    keras_notes, keras_durs = model.predict(inputs, verbose=0)
+    numpy_notes, numpy_durs = numpy_model.predict(inputs)
+    return np_abs(keras_notes - numpy_notes).max(), np_abs(keras_durs - numpy_durs).max()
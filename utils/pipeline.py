@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+This Python File contains Functions to stream the training data from a corpus (see corpus.py)
+into the network. Batches of sequential inputs are built on the fly, so the windowed corpus
+never has to be materialized in memory.
+"""
+
+from numpy import arange, searchsorted, flatnonzero, zeros, unique, int32
+from numpy.random import default_rng
+from tensorflow import TensorSpec, int32 as tf_int32
+from tensorflow.data import Dataset, AUTOTUNE
+from tensorflow.data.experimental import assert_cardinality
+from utils.corpus import get_windows, get_packed_windows, get_packed_inputs
+from utils.augmentation import build_shift_table, transpose_windows
+
+def get_window_licks(corpus):
+    """
+    Function to assign every window of the corpus to a lick:
+    A window belongs to the lick of its output (the note/duration following the window).
+    The Tokens after a lick belong to the lick in front of them,
+    Tokens in front of the first lick belong to the first lick.
+    Returns an array with the lick index of every window.
+    """
+    n_windows = len(corpus['notes']) - corpus['length']
+    outputs = arange(n_windows) + corpus['length']
+    lick_idx = searchsorted(corpus['offsets'][:, 0], outputs, side='right') - 1
+    return lick_idx.clip(min=0)
+
+def split_licks(corpus, validation_split=0.3, seed=None, packed=False):
+    """
+    Function to split the windows of a corpus into training and validation data per lick,
+    so windows of the same lick are never part of both sets.
+    The licks for the validation are drawn randomly (reproducible with the seed).
+    If packed is set, only the windows of the licks are used (see corpus.get_packed_windows).
+    Returns the window indices of the training and the validation data.
+    """
+    n_licks = len(corpus['offsets'])
+    n_validation = int(round(n_licks * validation_split))
+
+    validation_licks = zeros(n_licks, dtype=bool)
+    validation_licks[default_rng(seed).permutation(n_licks)[:n_validation]] = True
+
+    window_indices = get_packed_windows(corpus) if packed else arange(len(corpus['notes']) - corpus['length'])
+    is_validation = validation_licks[get_window_licks(corpus)[window_indices]]
+    return window_indices[~is_validation], window_indices[is_validation]
+
+def generate_batches(corpus, window_indices, batch_size=32, shuffle=True, rng=None, shift_table=None,
+                     packed=False):
+    """
+    Generator which yields batches of inputs and outputs for the given windows:
+    ((notes, durations), (next notes, next durations)) with a shape of ( batch_size, length )
+    for the inputs and integer outputs (sparse) with a shape of ( batch_size, ).
+    Only the windows of the current batch are copied out of the corpus.
+    With a shift table (see augmentation.build_shift_table) every window of a batch is transposed
+    by a randomly drawn row of the table - the transposed windows only exist for the current batch.
+    If packed is set, the windows are packed windows (see corpus.get_packed_inputs).
+    """
+    note_windows, dur_windows = get_windows(corpus)
+    length = corpus['length']
+    rng = default_rng() if rng is None else rng
+
+    if shuffle:
+        window_indices = rng.permutation(window_indices)
+
+    for batch_start in range(0, len(window_indices), batch_size):
+        batch = window_indices[batch_start:batch_start + batch_size]
+        if packed:
+            notes, durs = get_packed_inputs(corpus, batch)
+        else:
+            notes, durs = note_windows[batch], dur_windows[batch]
+        next_notes = corpus['notes'][batch + length]
+        if shift_table is not None:
+            notes, next_notes = transpose_windows(shift_table, rng.integers(len(shift_table), size=len(batch)),
+                                                  notes, next_notes, packed=packed)
+        yield ((notes.astype(int32), durs.astype(int32)),
+               (next_notes.astype(int32), corpus['durs'][batch + length].astype(int32)))
+
+def make_dataset(corpus, window_indices, batch_size=32, shuffle=True, seed=None, transpositions=None,
+                 packed=False):
+    """
+    Function to create a tf.data Dataset which streams the batches of generate_batches.
+    The windows are shuffled again in every epoch and the next batches are prefetched,
+    while the network is trained on the current batch.
+    If transpositions (semitone offsets, e.g. augmentation.ALL_KEYS) are set, every window is transposed
+    by a random offset in every epoch - the vocabulary of the corpus has to contain the transposed notes
+    (see midi_tools.extract_notes_and_duration).
+    Packed windows (see split_licks and corpus.get_packed_inputs) need a model with mask_zero.
+    """
+    length = corpus['length']
+    rng = default_rng(seed)
+    shift_table = None
+    if transpositions is not None:
+        # Only the notes of the corpus are transposed
+        shift_table = build_shift_table(corpus['note_to_int'], transpositions,
+                                        [corpus['int_to_note'][idx] for idx in unique(corpus['notes'])])
+    signature = ((TensorSpec(shape=(None, length), dtype=tf_int32),
+                  TensorSpec(shape=(None, length), dtype=tf_int32)),
+                 (TensorSpec(shape=(None, ), dtype=tf_int32),
+                  TensorSpec(shape=(None, ), dtype=tf_int32)))
+
+    dataset = Dataset.from_generator(lambda: generate_batches(corpus, window_indices, batch_size,
+                                                              shuffle=shuffle, rng=rng, shift_table=shift_table,
+                                                              packed=packed),
+                                     output_signature=signature)
+    # The amount of batches is known - important for the progress of keras
+    n_batches = (len(window_indices) + batch_size - 1) // batch_size
+    return dataset.apply(assert_cardinality(n_batches)).prefetch(AUTOTUNE)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+This Python File contains a post-training quantization of the NumPy Jazz LSTM (see numpy_lstm):
+The kernels are converted to int8 with a scale per output channel, the embeddings to int8 with
+a scale per row. The inputs of every matrix multiplication are quantized dynamically (int8 with
+a scale per row), so the products of the matrix multiplications are integer products.
+Only the int8 kernels/embeddings (+ their scales and the float32 biases) stay in memory.
+
+Note: NumPy has no int8 matrix multiplication (integer matmuls don't use BLAS).
+The int8 kernel of a matrix multiplication is therefore widened to float32 for the single product
+(the widened copy is dropped afterwards) - the products of int8 values (at most 127 * 127 * 256 per sum)
+are exactly representable in float32, so the result is identical to an int8 GEMM with int32 accumulation.
+"""
+
+from time import perf_counter
+from numpy import (load, savez_compressed, abs as np_abs, rint, clip, where, float32, int8,
+                   median, asarray)
+from utils.numpy_lstm import NumpyJazzLSTM
+
+# Largest value of a symmetric int8 quantization
+INT8_MAX = 127
+
+# Weights which are quantized: Kernels of the matrix multiplications + the embeddings
+KERNELS = ['First_LSTM_0', 'First_LSTM_1', 'Second_LSTM_0', 'Second_LSTM_1',
+           'Adapt_layer_0', 'note_height_0', 'duration_0']
+EMBEDDINGS = ['note_embedd_0', 'dur_embed_0']
+
+def quantize_symmetric(weight, axis):
+    """
+    Function to quantize an array symmetrically to int8 with a scale for every slice along axis
+    (kernels: axis=0 => one scale per output channel, embeddings: axis=1 => one scale per row).
+    Returns the int8 array and the float32 scales (weight ~ quantized * scales).
+    """
+    scales = np_abs(weight).max(axis=axis, keepdims=True) / INT8_MAX
+    # Slices containing only zeros
+    scales = where(scales == 0, 1, scales).astype(float32)
+    quantized = clip(rint(weight / scales), -INT8_MAX, INT8_MAX).astype(int8)
+    return quantized, scales
+
+def quantize_weights(weights):
+    """
+    Function to quantize the weights of a NumPy Jazz LSTM (Dictionary, see numpy_lstm.export_weights).
+    Returns a Dictionary with '<name>_q' (int8) and '<name>_scale' (float32) for every quantized weight,
+    every other weight (biases) stays float32.
+    """
+    quantized = {}
+    for name, weight in weights.items():
+        if name in KERNELS or name in EMBEDDINGS:
+            quantized[f'{name}_q'], quantized[f'{name}_scale'] = quantize_symmetric(weight, 0 if name in KERNELS else 1)
+        else:
+            quantized[name] = weight
+    return quantized
+
+def export_quantized_weights(file_path, quantized_path):
+    """
+    Function to convert an exported npz file (see numpy_lstm.export_weights) into a quantized npz file.
+    """
+    with load(file_path) as weights:
+        savez_compressed(quantized_path, **quantize_weights({name: weights[name] for name in weights.files}))
+
+class QuantizedJazzLSTM(NumpyJazzLSTM):
+    """
+    Int8 version of the NumPy Jazz LSTM: Can be used like NumpyJazzLSTM (e.g. in generate_batch_notes_durs).
+    The file can be an exported float32 npz file (quantized while loading)
+    or a quantized npz file (see export_quantized_weights).
+    > weights: The float32 biases
+    > kernels / embeddings: The int8 kernels/embeddings + their float32 scales
+    """
+
+    def __init__(self, file_path):
+        with load(file_path) as weights:
+            weights = {name: weights[name] for name in weights.files}
+        if not any(name.endswith('_q') for name in weights):
+            weights = quantize_weights(weights)
+
+        self.weights = {name: weights[name] for name in weights if not name.endswith(('_q', '_scale'))}
+        self.kernels = {name: (weights[f'{name}_q'], weights[f'{name}_scale']) for name in KERNELS}
+        self.embeddings = {name: (weights[f'{name}_q'], weights[f'{name}_scale']) for name in EMBEDDINGS}
+
+        self.set_dimensions(self.embeddings['note_embedd_0'][0], self.embeddings['dur_embed_0'][0])
+
+    def get_runtime_size(self):
+        """
+        Returns the size of the arrays which the model keeps in memory in bytes
+        (int8 kernels/embeddings + scales + biases).
+        """
+        return super().get_runtime_size() + sum(array.nbytes for weight in [*self.kernels.values(),
+                                                                           *self.embeddings.values()]
+                                                for array in weight)
+
+    def lookup(self, ids, weight_name):
+        """
+        Rows of an int8 embedding for the ids, dequantized with the scales of the rows.
+        """
+        embedding, scales = self.embeddings[weight_name]
+        ids = asarray(ids, dtype=int)
+        return embedding[ids].astype(float32) * scales[ids]
+
+    def matmul(self, x, weight_name):
+        """
+        Quantized matrix multiplication: x is quantized to int8 with a scale per row,
+        the integer product (int8 kernel widened for the product, see module docstring)
+        is scaled back with the scales of x and the kernel.
+        """
+        kernel, kernel_scales = self.kernels[weight_name]
+        x_scales = np_abs(x).max(axis=-1, keepdims=True) / INT8_MAX
+        x_scales = where(x_scales == 0, 1, x_scales).astype(float32)
+        x_quantized = rint(x / x_scales)
+        return (x_quantized @ kernel.astype(float32)) * x_scales * kernel_scales
+
+def time_predict(model, inputs, repeat=10):
+    """
+    Small helper Function which returns the median time of model.predict(inputs) in seconds.
+    """
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        model.predict(inputs)
+        times.append(perf_counter() - start)
+    return float(median(times))
+
+def compare_quantized(model, quantized_model, notes_informations, durs_informations,
+                      n=256, batch_size=64, seed=0, repeat=10):
+    """
+    Function to compare a float32 model (NumpyJazzLSTM) with its quantized version:
+    > size_float32 / size_int8: Size of the arrays which the models keep in memory in bytes
+    > latency_float32 / latency_int8: Median time of a prediction with batch_size windows of the training data
+    > max_note_diff / max_dur_diff: Largest difference of the predicted probabilities for these windows
+    > drift: n licks are generated by both models with the same seed, the distributions of their
+      pitches/durations are compared with the statistical tests of evaluate.evaluate_corpora
+      (the float32 licks take the place of the training data)
+    Models with mask_zero get packed windows (see midi_generation.get_model_inputs).
+    Returns a Dictionary with the values and the drift as DataFrame.
+    """
+    # Local imports: Only needed for the comparison
+    from utils.midi_generation import generate_batch_notes_durs, get_model_inputs
+    from utils.evaluate import encode_licks, evaluate_corpora
+
+    inputs = get_model_inputs(asarray(notes_informations[5][:batch_size]), asarray(durs_informations[5][:batch_size]),
+                              notes_informations[3]['START'], model.mask_zero)
+    float_notes, float_durs = model.predict(inputs)
+    int8_notes, int8_durs = quantized_model.predict(inputs)
+
+    note_to_int, dur_to_int = notes_informations[3], durs_informations[3]
+    corpora = []
+    for generator in [model, quantized_model]:
+        outputs = generate_batch_notes_durs(generator, notes_informations, durs_informations, n, seed=seed,
+                                            packed=model.mask_zero)
+        corpora.append(encode_licks([note for output in outputs for note, _ in output],
+                                    [dur for output in outputs for _, dur in output],
+                                    note_to_int, dur_to_int))
+
+    return {'size_float32': model.get_runtime_size(),
+            'size_int8': quantized_model.get_runtime_size(),
+            'latency_float32': time_predict(model, inputs, repeat),
+            'latency_int8': time_predict(quantized_model, inputs, repeat),
+            'max_note_diff': float(np_abs(float_notes - int8_notes).max()),
+            'max_dur_diff': float(np_abs(float_durs - int8_durs).max()),
+            'drift': evaluate_corpora(corpora[0], corpora[1:], ['int8'], note_to_int, dur_to_int,
+                                      scale='float32 vs int8')}
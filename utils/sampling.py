@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+This Python File contains Functions to draw notes/durations from the outputs of the network.
+All Functions work on whole batches of outputs with a shape of ( batch, x )
+and are reproducible with a seeded numpy Generator.
+"""
+
+from numpy import (asarray, broadcast_to, log, exp, clip, where, argmax, argsort, partition,
+                   take_along_axis, put_along_axis, array, inf, finfo, float64)
+from numpy.random import default_rng, Generator
+
+# Smallest positive probability - avoids log(0) = -inf for impossible outputs
+TINY = finfo(float64).tiny
+
+# Generator for calls without an own Generator
+DEFAULT_RNG = default_rng()
+
+def get_rng(seed=None):
+    """
+    Small helper Function which returns a numpy Generator for a seed.
+    A Generator is returned unchanged, None returns a randomly seeded Generator.
+    """
+    return default_rng(seed)
+
+def draw_uniforms(rng, size):
+    """
+    Draws one uniform number per row.
+    The rng can be a single Generator or a list of Generators (one per row),
+    so rows of different requests stay reproducible in a shared batch.
+    """
+    if isinstance(rng, Generator):
+        return rng.random(size)
+    return array([row_rng.random() for row_rng in rng])
+
+def apply_top_k(logits, top_k):
+    """
+    Keeps the top_k most likely elements of every row, every other element gets the logit -inf.
+    """
+    if top_k is None or top_k >= logits.shape[1]:
+        return logits
+    kth_largest = -partition(-logits, top_k - 1, axis=1)[:, top_k - 1:top_k]
+    return where(logits < kth_largest, -inf, logits)
+
+def apply_top_p(probs, top_p):
+    """
+    Nucleus sampling: Keeps the smallest set of most likely elements of every row
+    whose probability adds up to top_p. The most likely element is always kept.
+    Returns the renormalized probabilities.
+    """
+    if top_p is None or top_p >= 1:
+        return probs
+    order = argsort(-probs, axis=1)
+    sorted_probs = take_along_axis(probs, order, axis=1)
+    # An element is kept if the probability of the more likely elements is below top_p
+    keep = (sorted_probs.cumsum(axis=1) - sorted_probs) < top_p
+    keep[:, 0] = True
+    mask = keep.copy()
+    put_along_axis(mask, order, keep, axis=1)
+    probs = where(mask, probs, 0)
+    return probs / probs.sum(axis=1, keepdims=True)
+
+def sample_tokens(outputs, temperature=1.0, top_k=None, top_p=None, rng=None):
+    """
+    Function to draw one element per row of the network outputs (probabilities).
+    > temperature: The more the value is to 1 the more randomized the output will be (see
+    midi_generation.set_randomize_val). A temperature of 0 returns the most likely element.
+    Can be a single value or one value per row.
+    > top_k: Draw only from the top_k most likely elements
+    > top_p: Draw only from the most likely elements which add up to the probability top_p
+    > rng: Generator (or list of Generators per row) for reproducible results (see get_rng)
+    The calculation is done with logarithms, so probabilities of 0 never produce NaN.
+    A single output with a shape of ( x, ) returns a single element.
+    """
+    outputs = asarray(outputs, dtype=float64)
+    single = outputs.ndim == 1
+    if single:
+        outputs = outputs[None]
+
+    temperature = broadcast_to(asarray(temperature, dtype=float64), (len(outputs), ))
+    greedy = temperature <= 0
+
+    # Temperature scaled logarithms + top k
+    logits = log(clip(outputs, TINY, None)) / where(greedy, 1, temperature)[:, None]
+    logits = apply_top_k(logits, top_k)
+
+    # Stable softmax: The largest logit of every row is 0
+    probs = exp(logits - logits.max(axis=1, keepdims=True))
+    probs = apply_top_p(probs / probs.sum(axis=1, keepdims=True), top_p)
+
+    # Inverse transform sampling: First element whose cumulative probability exceeds a uniform number
+    # (scaled with the total of the row, since rounding errors can push the total slightly below 1)
+    uniforms = draw_uniforms(DEFAULT_RNG if rng is None else rng, len(outputs))
+    cumulative = probs.cumsum(axis=1)
+    drawn = (cumulative <= uniforms[:, None] * cumulative[:, -1:]).sum(axis=1)
+
+    # Most likely element for a temperature of 0
+    drawn = where(greedy, argmax(outputs, axis=1), drawn)
+    return drawn[0] if single else drawn
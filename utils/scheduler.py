@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+This Python File contains a scheduler which trains several models (e.g. the diatonic, alterated
+and both models of notebook 1) at the same time in a process pool.
+Every process gets a part of the cpu cores (thread limits for Tensorflow and the math libraries),
+so the processes don't compete for the same cores. The progress of every epoch is reported
+by the processes and a summary is created after the training.
+"""
+
+from os import environ, cpu_count
+from time import perf_counter
+from queue import Empty
+from multiprocessing import get_context, Manager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# The configurations of notebook 1: both, diatonic, alterated
+DEFAULT_CONFIGS = [{'scale': 'diatonic', 'both': True},
+                   {'scale': 'diatonic', 'both': False},
+                   {'scale': 'alterated', 'both': False}]
+
+# Default values of a configuration (see train_config)
+CONFIG_DEFAULTS = {'length': 17, 'ep': 100, 'bs': 32, 'patience': 5, 'checkpoints': False,
+                   'stream': False, 'seed': None, 'model_args': {}}
+
+def get_output_folder(config):
+    """
+    Small helper Function which returns the weights folder of a configuration (like jazz_lstm.train).
+    """
+    return 'both' if config['both'] else config['scale']
+
+def set_thread_limits(threads):
+    """
+    Limits the threads of a process (initializer of the process pool):
+    The environment variables have to be set before numpy/tensorflow are imported,
+    the thread pools of tensorflow are configured directly.
+    """
+    for variable in ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS',
+                     'TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS']:
+        environ[variable] = str(threads)
+    environ.setdefault('TF_CPP_MIN_LOG_LEVEL', '2')
+
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(min(threads, 2))
+
+def train_config(config, progress_queue=None):
+    """
+    Function to train a single configuration (in a worker process) like notebook 1:
+    Extraction of the training data, building the model and the training (see jazz_lstm.train).
+    With stream set, the model is trained with the saved corpus (see jazz_lstm.train_stream).
+    The configuration contains the parameters of extract_notes_and_duration (scale, both, length),
+    of train (ep, bs, patience, checkpoints) and of generate_lstm_model (model_args).
+    Returns a summary of the training: name, weights folder, epochs, losses, samples per second and wall time.
+    """
+    from utils.midi_tools import extract_notes_and_duration, generate_sequence
+    from utils.corpus import load_vocabulary
+    from utils.jazz_lstm import generate_lstm_model, train, train_stream
+    from utils.callbacks import ProgressCallback
+
+    config = {**CONFIG_DEFAULTS, **config}
+    name = config.get('name', get_output_folder(config))
+    callbacks = [ProgressCallback(name, progress_queue)] if progress_queue is not None else []
+    start = perf_counter()
+
+    notes, durs = extract_notes_and_duration(scale=config['scale'], both=config['both'], show=False,
+                                             length=config['length'], save_data=True)
+    # Vocabulary of the saved corpus: Known notes/durations keep their integers (see corpus.keep_vocabulary)
+    note_to_int, dur_to_int = load_vocabulary(f'stored/corpus/{get_output_folder(config)}')
+    training_args = dict(both=config['both'], bs=config['bs'], ep=config['ep'], checkpoints=config['checkpoints'],
+                         patience=config['patience'], callbacks=callbacks)
+
+    if config['stream']:
+        from utils.corpus import load_corpus
+        model = generate_lstm_model(len(note_to_int), len(dur_to_int), sparse=True, **config['model_args'])
+        history = train_stream(load_corpus(f'stored/corpus/{get_output_folder(config)}'), model, config['scale'],
+                               seed=config['seed'], **training_args)
+    else:
+        inputs, outputs = generate_sequence(notes, durs, note_to_int, dur_to_int, config['scale'],
+                                            length=config['length'])
+        model = generate_lstm_model(len(note_to_int), len(dur_to_int), **config['model_args'])
+        history = train(inputs, outputs, model, config['scale'], **training_args)
+
+    losses = history.history['loss']
+    return {'name': name,
+            'folder': f'weights/{get_output_folder(config)}',
+            'epochs': len(losses),
+            'final_loss': losses[-1],
+            'best_loss': min(losses),
+            'samples_per_sec': sum(history.history['samples_per_sec']) / len(losses),
+            'wall': perf_counter() - start}
+
+def train_configs(configs=DEFAULT_CONFIGS, workers=None, threads=None, show=True):
+    """
+    Function to train several configurations (see train_config) at the same time:
+    > workers: Amount of processes (default: one per configuration)
+    > threads: Threads per process (default: cpu cores / workers)
+    Every configuration needs its own weights folder (weights/both or weights/<scale>).
+    The epochs are reported while the models are trained (if show is set).
+    Returns a list with the summary of every configuration (in the order of configs)
+    and the total wall time.
+    """
+    folders = [get_output_folder({**CONFIG_DEFAULTS, **config}) for config in configs]
+    if len(set(folders)) != len(folders):
+        raise ValueError(f'Every configuration needs its own weights folder: {folders}')
+
+    workers = workers or len(configs)
+    threads = threads or max(1, (cpu_count() or 1) // workers)
+    start = perf_counter()
+
+    with Manager() as manager:
+        progress_queue = manager.Queue()
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                                 initializer=set_thread_limits, initargs=(threads, )) as executor:
+            futures = [executor.submit(train_config, config, progress_queue) for config in configs]
+            pending = set(futures)
+            while pending:
+                _, pending = wait(pending, timeout=1, return_when=FIRST_COMPLETED)
+                show_progress(progress_queue, show)
+            show_progress(progress_queue, show)
+            summaries = [future.result() for future in futures]
+
+    total = perf_counter() - start
+    if show:
+        print(format_summary(summaries, total))
+    return summaries, total
+
+def show_progress(progress_queue, show=True):
+    """
+    Small helper Function which prints every reported epoch of the queue.
+    """
+    while True:
+        try:
+            name, epoch, logs = progress_queue.get_nowait()
+        except Empty:
+            return
+        if show:
+            print(f'[{name}] Epoch {epoch + 1}: loss {logs.get("loss", float("nan")):.4f} - '
+                  f'val_loss {logs.get("val_loss", float("nan")):.4f} - '
+                  f'{logs.get("samples_per_sec", 0):.0f} samples/s')
+
+def format_summary(summaries, total):
+    """
+    Returns the summaries of train_configs as table (+ the speedup compared to a sequential training).
+    """
+    lines = [f'{"Name":<14}{"Folder":<22}{"Epochs":>7}{"Best loss":>11}{"Samples/s":>11}{"Wall s":>9}']
+    for summary in summaries:
+        lines.append(f'{summary["name"]:<14}{summary["folder"]:<22}{summary["epochs"]:>7}{summary["best_loss"]:>11.4f}'
+                     f'{summary["samples_per_sec"]:>11.0f}{summary["wall"]:>9.1f}')
+    sequential = sum(summary['wall'] for summary in summaries)
+    lines.append(f'Total wall time: {total:.1f} s (sequential: {sequential:.1f} s, '
+                 f'slowest: {max(summary["wall"] for summary in summaries):.1f} s)')
+    return '\n'.join(lines)
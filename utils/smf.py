@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+This Python File contains Functions to read and write Standard MIDI Files (SMF) directly from/to their bytes.
+Only monophonic melodies are supported, which is sufficient for Jazz Licks.
+The Functions produce the same note/duration tokens as the music21 based
+extraction in midi_tools (pitch name + octave, 'rest' and the quarterLength).
+"""
+
+from mmap import mmap, ACCESS_READ
+from fractions import Fraction
+from math import floor
+from re import compile as re_compile
+from zipfile import ZipFile, ZIP_DEFLATED
+from concurrent.futures import ThreadPoolExecutor
+from utils.instrumentation import timer
+
+# Pitch names of the pitch classes (spelling of music21 for midi pitches)
+PITCH_NAMES = ['C', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G', 'G#', 'A', 'B-', 'B']
+
+# Default quantization grid of music21: 16ths and 8th triplets
+QUARTER_LENGTH_DIVISORS = (4, 3)
+
+# Resolution of written midi files (divisible by 3 and 16, so triplets and 64ths are exact)
+TICKS_PER_QUARTER = 480
+
+# Pitch name with octave: step, accidentals (# or -) and octave
+PITCH_PATTERN = re_compile(r'([A-G])([#-]*)(\d+)$')
+STEP_PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+
+def midi_to_pitch_name(midi_pitch):
+    """
+    Small helper Function to translate a midi pitch into a pitch name with octave (60 => 'C4').
+    """
+    return f'{PITCH_NAMES[midi_pitch % 12]}{midi_pitch // 12 - 1}'
+
+def pitch_name_to_midi(pitch_name):
+    """
+    Small helper Function to translate a pitch name with octave into a midi pitch ('C4' => 60).
+    """
+    match = PITCH_PATTERN.match(pitch_name)
+    if match is None:
+        raise ValueError(f'Unknown pitch name {pitch_name}')
+    step, accidentals, octave = match.groups()
+    return (int(octave) + 1) * 12 + STEP_PITCH_CLASSES[step] + accidentals.count('#') - accidentals.count('-')
+
+def to_quarter_length(value):
+    """
+    Small helper Function to represent a quarterLength like music21:
+    Values which can be represented exactly as a float (e.g. 0.5) are floats,
+    every other value (e.g. triplets) is a Fraction.
+    """
+    value = Fraction(value)
+    # Denominator is a power of 2
+    if value.denominator & (value.denominator - 1) == 0:
+        return float(value)
+    return value
+
+def read_variable_length(data, pos):
+    """
+    Reads a variable length quantity (7 bits per byte) at the position pos.
+    Returns the value and the position after the quantity.
+    """
+    value = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value = (value << 7) | (byte & 0x7F)
+        if not byte & 0x80:
+            return value, pos
+
+def read_track_events(data, pos, end, name='midi data'):
+    """
+    Function to read the events of a single track chunk between pos and end.
+    Returns a list of note events (tick, channel, pitch, is_note_on) and
+    a list of time signatures (tick, numerator, denominator).
+    A data byte without a running status (e.g. after a meta/sysex event) raises a ValueError
+    with the name of the file and the offset of the byte.
+    """
+    tick = 0
+    status = None
+    note_events, time_signatures = [], []
+
+    while pos < end:
+        delta, pos = read_variable_length(data, pos)
+        tick += delta
+
+        # Running status: The status byte can be omitted for consecutive channel messages
+        if data[pos] & 0x80:
+            status = data[pos]
+            pos += 1
+        elif status is None:
+            raise ValueError(f'{name}: Data byte {data[pos]:#04x} without running status at offset {pos}')
+
+        # Meta event: type, length, data
+        if status == 0xFF:
+            meta_type = data[pos]
+            length, pos = read_variable_length(data, pos + 1)
+            if meta_type == 0x58:
+                time_signatures.append((tick, data[pos], 2 ** data[pos + 1]))
+            elif meta_type == 0x2F:
+                break
+            pos += length
+            status = None
+        # Sysex event: length, data
+        elif status in (0xF0, 0xF7):
+            length, pos = read_variable_length(data, pos)
+            pos += length
+            status = None
+        else:
+            kind, channel = status & 0xF0, status & 0x0F
+            # Program change + channel pressure have a single data byte
+            if kind in (0xC0, 0xD0):
+                pos += 1
+            else:
+                if kind in (0x80, 0x90):
+                    # A note on event with velocity 0 is a note off event
+                    is_note_on = kind == 0x90 and data[pos + 1] > 0
+                    note_events.append((tick, channel, data[pos], is_note_on))
+                pos += 2
+
+    return note_events, time_signatures
+
+def read_smf_events(data, name='midi data'):
+    """
+    Function to read the header and every track of a Standard MIDI File.
+    Returns the ticks per quarter note, all notes (on tick, off tick, pitch)
+    and all time signatures (tick, numerator, denominator).
+    The name of the file is part of the errors of invalid files.
+    """
+    if bytes(data[:4]) != b'MThd':
+        raise ValueError(f'{name}: No Standard MIDI File')
+
+    header_length = int.from_bytes(data[4:8], 'big')
+    n_tracks = int.from_bytes(data[10:12], 'big')
+    ticks_per_quarter = int.from_bytes(data[12:14], 'big')
+    if ticks_per_quarter & 0x8000:
+        raise ValueError(f'{name}: SMPTE time division is not supported')
+
+    notes, time_signatures = [], []
+    pos = 8 + header_length
+    for _ in range(n_tracks):
+        chunk_length = int.from_bytes(data[pos + 4:pos + 8], 'big')
+        if bytes(data[pos:pos + 4]) == b'MTrk':
+            note_events, track_signatures = read_track_events(data, pos + 8, pos + 8 + chunk_length, name)
+            time_signatures += track_signatures
+
+            # Pair every note on event with the next note off event of the same pitch
+            open_notes = {}
+            for tick, channel, midi_pitch, is_note_on in note_events:
+                if is_note_on:
+                    open_notes.setdefault((channel, midi_pitch), []).append(tick)
+                elif open_notes.get((channel, midi_pitch)):
+                    notes.append((open_notes[(channel, midi_pitch)].pop(0), tick, midi_pitch))
+        pos += 8 + chunk_length
+
+    # Sort the notes by their start (stable: same start keeps the order of the file)
+    notes.sort(key=lambda midi_note: midi_note[0])
+    return ticks_per_quarter, notes, time_signatures
+
+def nearest_multiple(value, divisor):
+    """
+    Returns the nearest multiple of 1 / divisor as a Fraction and its error
+    (same rounding as music21.common.nearestMultiple).
+    """
+    unit = 1 / divisor
+    mult = floor(value / unit)
+    if unit * mult <= value <= unit * mult + unit / 2:
+        return Fraction(mult, divisor), round(value - unit * mult, 7)
+    return Fraction(mult + 1, divisor), round(unit * (mult + 1) - value, 7)
+
+def quantize(value, divisors=QUARTER_LENGTH_DIVISORS):
+    """
+    Quantizes a quarterLength to the closest grid of the divisors.
+    On equal errors the finer grid (smaller 1 / divisor) is preferred like in music21.
+    Returns the quantized value and the used divisor.
+    """
+    matches = [(error, 1 / divisor, match, divisor)
+               for divisor in divisors
+               for match, error in [nearest_multiple(value, divisor)]]
+    error, _, match, divisor = min(matches)
+    return match, divisor
+
+def quantize_notes(notes, ticks_per_quarter, divisors=QUARTER_LENGTH_DIVISORS):
+    """
+    Quantizes the offsets and durations of the notes (on tick, off tick, pitch) like music21
+    and returns a list of (offset, duration, pitch) with Fractions.
+    Notes which start at the same time (chords) get the pitch None.
+    """
+    smallest_unit = Fraction(1, max(divisors))
+    chord_tolerance = ticks_per_quarter / max(divisors)
+
+    # Group notes starting within the tolerance into chords
+    grouped, idx = [], 0
+    while idx < len(notes):
+        group_end = idx + 1
+        while (group_end < len(notes)
+               and abs(notes[group_end][0] - notes[idx][0]) < chord_tolerance
+               and abs(notes[group_end][1] - notes[idx][1]) <= chord_tolerance):
+            group_end += 1
+        on_tick, off_tick, midi_pitch = notes[idx]
+        grouped.append((on_tick, off_tick, midi_pitch if group_end == idx + 1 else None))
+        idx = group_end
+
+    quantized = []
+    for idx, (on_tick, off_tick, midi_pitch) in enumerate(grouped):
+        offset, _ = quantize(on_tick / ticks_per_quarter, divisors)
+        quarter_length = max(off_tick - on_tick, 0) / ticks_per_quarter
+        duration, _ = quantize(quarter_length, divisors)
+
+        # Avoid tiny gaps to the next note by using the grid of the next offset
+        if idx + 1 < len(grouped):
+            next_offset, next_divisor = quantize(grouped[idx + 1][0] / ticks_per_quarter, divisors)
+            if 0 < next_offset - (offset + duration) < smallest_unit:
+                duration, _ = quantize(quarter_length, (next_divisor, ))
+
+        # Notes always have a duration
+        if duration == 0:
+            duration = smallest_unit
+        quantized.append((offset, duration, midi_pitch))
+
+    return quantized
+
+def get_barlines(time_signatures, ticks_per_quarter, end):
+    """
+    Function to calculate the offsets of every barline up to the offset end
+    based on the time signatures (4/4 if the file has no time signature).
+    """
+    bar_lengths = {Fraction(0): Fraction(4)}
+    for tick, numerator, denominator in sorted(time_signatures):
+        offset, _ = quantize(tick / ticks_per_quarter)
+        bar_lengths[offset] = Fraction(4 * numerator, denominator)
+
+    barlines, offset, bar_length = [Fraction(0)], Fraction(0), bar_lengths[Fraction(0)]
+    while offset < end:
+        offset += bar_length
+        bar_length = bar_lengths.get(offset, bar_length)
+        barlines.append(offset)
+    return barlines
+
+def split_at_barlines(offset, duration, barlines):
+    """
+    Splits an element at every barline it crosses (like tied notes in music21).
+    Returns a list of (offset, duration).
+    """
+    pieces, end = [], offset + duration
+    for barline in barlines:
+        if offset < barline < end:
+            pieces.append((offset, barline - offset))
+            offset = barline
+    pieces.append((offset, end - offset))
+    return pieces
+
+def decode_tokens(ticks_per_quarter, notes, time_signatures, divisors=QUARTER_LENGTH_DIVISORS):
+    """
+    Function to translate the notes of a midi file (see read_smf_events) into tokens:
+    > Offsets and durations are quantized to the grid of the divisors
+    > Notes crossing a barline are split (the pieces after the barline are ordered like music21)
+    > Gaps (and the rest of the last measure) are filled with rests
+    > Chords are skipped
+    Returns the notes (pitch name + octave or 'rest') and durations (quarterLength).
+    """
+    notes_out, durs_out = [], []
+    quantized = quantize_notes(notes, ticks_per_quarter, divisors)
+    if not quantized:
+        return notes_out, durs_out
+
+    end = max(offset + duration for offset, duration, _ in quantized)
+    barlines = get_barlines(time_signatures, ticks_per_quarter, end)
+
+    # Collect every element with its offset: Rests for all gaps
+    # + Notes (and chords) split at the barlines
+    # The pieces after a barline are marked as continuations (see the sorting below)
+    elements, covered = [], Fraction(0)
+    for offset, duration, midi_pitch in quantized:
+        if offset > covered:
+            elements += [(rest_offset, idx > 0, rest_duration, 'rest') for idx, (rest_offset, rest_duration)
+                         in enumerate(split_at_barlines(covered, offset - covered, barlines))]
+        elements += [(piece_offset, idx > 0, piece_duration, midi_pitch) for idx, (piece_offset, piece_duration)
+                     in enumerate(split_at_barlines(offset, duration, barlines))]
+        covered = max(covered, offset + duration)
+
+    # Fill the last measure with a rest
+    if covered < barlines[-1]:
+        elements.append((covered, False, barlines[-1] - covered, 'rest'))
+
+    # Like music21: A continuation is inserted into its measure after the elements of the measure,
+    # so an element starting at the same barline comes first (stable: same key keeps the order)
+    for _, _, duration, midi_pitch in sorted(elements, key=lambda element: element[:2]):
+        # Skip chords
+        if midi_pitch is None:
+            continue
+        notes_out.append('rest' if midi_pitch == 'rest' else midi_to_pitch_name(midi_pitch))
+        durs_out.append(to_quarter_length(duration))
+
+    return notes_out, durs_out
+
+def read_midi_tokens(midi_file, divisors=QUARTER_LENGTH_DIVISORS):
+    """
+    Function to read the notes and durations of a monophonic midi file directly from its bytes,
+    without building a music21 score.
+    The file is memory-mapped where possible.
+    Returns the notes (pitch name + octave or 'rest') and durations (quarterLength) of the lick
+    in the same format as midi_tools.parse_midi_file (see decode_tokens).
+    """
+    with open(midi_file, 'rb') as midi:
+        try:
+            with mmap(midi.fileno(), 0, access=ACCESS_READ) as data:
+                ticks_per_quarter, notes, time_signatures = read_smf_events(data, midi_file)
+        # Empty files (or file systems without mmap support)
+        except (ValueError, OSError):
+            midi.seek(0)
+            ticks_per_quarter, notes, time_signatures = read_smf_events(midi.read(), midi_file)
+
+    return decode_tokens(ticks_per_quarter, notes, time_signatures, divisors)
+
+def read_archive_tokens(archive_file, divisors=QUARTER_LENGTH_DIVISORS):
+    """
+    Function to read every midi file of a zip archive (see write_midi_archive).
+    Returns a Dictionary which maps the name of every midi file to its notes and durations.
+    """
+    with ZipFile(archive_file, 'r') as archive:
+        return {name: decode_tokens(*read_smf_events(archive.read(name), f'{archive_file}:{name}'), divisors)
+                for name in archive.namelist() if name.endswith('.mid')}
+
+def encode_variable_length(value):
+    """
+    Encodes a value as variable length quantity (7 bits per byte, see read_variable_length).
+    """
+    encoded = [value & 0x7F]
+    value >>= 7
+    while value:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    return bytes(reversed(encoded))
+
+def encode_lick(output, ticks_per_quarter=TICKS_PER_QUARTER, velocity=90, tempo=120, time_signature=(4, 4)):
+    """
+    Function to encode a generated lick (list of [note, duration], see midi_generation.generate_notes_durs)
+    as the bytes of a Standard MIDI File (format 0) with a single track:
+    > Tempo and time signature meta events + Program change to a piano
+    > A note on / note off event for every note, rests are only gaps
+    > Tokens (START and duration 0) are skipped
+    The ticks are calculated from the exact offset of every element, so triplets don't add up rounding errors.
+    Returns the bytes of the midi file.
+    """
+    numerator, denominator = time_signature
+    # Tempo (microseconds per quarter), time signature (with 24 clocks per click, 8 32ths per quarter)
+    # and program change of channel 0 to the piano
+    track = bytearray(b'\x00\xFF\x51\x03' + (60_000_000 // tempo).to_bytes(3, 'big'))
+    track += b'\x00\xFF\x58\x04' + bytes([numerator, denominator.bit_length() - 1, 24, 8])
+    track += b'\x00\xC0\x00'
+
+    offset, last_tick = Fraction(0), 0
+    for note, dur in output:
+        # Skip every Token
+        if note == 'START' or dur == 0:
+            continue
+        start_tick = round(offset * ticks_per_quarter)
+        offset += Fraction(dur)
+        if note == 'rest':
+            continue
+
+        end_tick = round(offset * ticks_per_quarter)
+        midi_pitch = pitch_name_to_midi(note)
+        track += encode_variable_length(start_tick - last_tick) + bytes([0x90, midi_pitch, velocity])
+        track += encode_variable_length(end_tick - start_tick) + bytes([0x80, midi_pitch, 0])
+        last_tick = end_tick
+
+    # Rests at the end of the lick extend the track
+    track += encode_variable_length(round(offset * ticks_per_quarter) - last_tick) + b'\xFF\x2F\x00'
+
+    header = b'MThd' + (6).to_bytes(4, 'big') + (0).to_bytes(2, 'big') + (1).to_bytes(2, 'big')
+    header += ticks_per_quarter.to_bytes(2, 'big')
+    return header + b'MTrk' + len(track).to_bytes(4, 'big') + bytes(track)
+
+def write_midi(output, midi_file, **encode_args):
+    """
+    Function to write a generated lick directly as midi file (see encode_lick).
+    """
+    with timer('write_midi', writer='smf'):
+        with open(midi_file, 'wb') as midi:
+            midi.write(encode_lick(output, **encode_args))
+
+def write_midi_files(outputs, midi_files, workers=4, **encode_args):
+    """
+    Function to write many generated licks at once:
+    The licks are encoded and written by a pool of worker threads.
+    outputs and midi_files are lists of the same length.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        # list: Raise the exceptions of the workers
+        list(executor.map(lambda output, midi_file: write_midi(output, midi_file, **encode_args),
+                          outputs, midi_files))
+
+def write_midi_archive(outputs, names, archive_file, mode='w', **encode_args):
+    """
+    Function to write many generated licks into a single zip archive instead of single files
+    (one file system operation per run instead of one per lick).
+    Names are the file names of the licks inside the archive, the mode 'a' appends to an existing archive.
+    The archive can be read with read_archive_tokens (or unpacked for music21/Musescore).
+    """
+    with ZipFile(archive_file, mode, compression=ZIP_DEFLATED) as archive:
+        for output, name in zip(outputs, names):
+            archive.writestr(name, encode_lick(output, **encode_args))
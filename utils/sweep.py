@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+This Python File contains a hyperparameter sweep with successive halving:
+All candidates (combinations of the search space) are trained for a few epochs,
+only the best part of the candidates (lowest validation loss) is trained further.
+So most of the training time is spent on the promising candidates.
+The candidates of a rung are trained at the same time in a process pool (see scheduler),
+every candidate is checkpointed in weights/sweep/<candidate id> and the leaderboard
+is saved as weights/sweep/leaderboard.json after every rung.
+The checkpoints and the early stopping of a candidate monitor the validation loss,
+so the checkpoint of the next rung is the epoch its ranking is based on.
+"""
+
+from os import path, makedirs, cpu_count
+from json import dump, dumps
+from hashlib import sha1
+from itertools import product
+from math import ceil
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from numpy.random import default_rng
+from utils.scheduler import set_thread_limits
+
+# Search space: Parameters of generate_lstm_model (embed, rnn_units) + batch size
+DEFAULT_SPACE = {'embed': [50, 100], 'rnn_units': [128, 256], 'bs': [16, 32]}
+MODEL_PARAMS = ['embed', 'rnn_units']
+
+def build_candidates(space, n=None, seed=0):
+    """
+    Function to build the candidates of a search space (Dictionary: parameter => list of values):
+    Every combination of the values, or n randomly drawn combinations if n is set.
+    Every candidate gets an id based on its parameters (so a candidate keeps its folder in later sweeps).
+    Returns a list of Dictionaries with the id and the parameters.
+    """
+    names = sorted(space)
+    combinations = list(product(*[space[name] for name in names]))
+    if n is not None and n < len(combinations):
+        combinations = [combinations[idx] for idx in sorted(default_rng(seed).choice(len(combinations), n, replace=False))]
+
+    candidates = []
+    for values in combinations:
+        params = dict(zip(names, values))
+        cid = sha1(dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+        candidates.append({'cid': cid, 'params': params})
+    return candidates
+
+def get_rung_epochs(min_epochs, max_epochs, eta):
+    """
+    Small helper Function which returns the amount of epochs of every rung:
+    min_epochs, min_epochs * eta, min_epochs * eta^2 ... up to max_epochs.
+    """
+    epochs = [min_epochs]
+    while epochs[-1] * eta < max_epochs:
+        epochs.append(epochs[-1] * eta)
+    if epochs[-1] < max_epochs:
+        epochs.append(max_epochs)
+    return epochs
+
+def train_candidate(candidate, epochs, scale='diatonic', both=True, length=17, patience=5, resume=False):
+    """
+    Function to train a candidate (in a worker process) for the given amount of epochs.
+    With resume set, the training continues with the checkpoint of the last rung (weights/sweep/<cid>/weights.h5,
+    the epoch with the best validation loss), otherwise a checkpoint of an earlier sweep is overwritten.
+    Note: The state of the optimizer is not saved, so it starts again in every rung.
+    Returns the best validation loss, the last loss and the trained epochs of the rung.
+    """
+    from utils.midi_tools import extract_notes_and_duration, build_note_dict, generate_sequence
+    from utils.jazz_lstm import generate_lstm_model, train
+
+    notes, durs = extract_notes_and_duration(scale=scale, both=both, show=False, length=length, save_data=False,
+                                             cache_folder=None)
+    note_to_int, dur_to_int = build_note_dict(notes, durs)
+    inputs, outputs = generate_sequence(notes, durs, note_to_int, dur_to_int, scale, length=length)
+
+    params = candidate['params']
+    model = generate_lstm_model(len(note_to_int), len(dur_to_int),
+                                **{name: params[name] for name in MODEL_PARAMS if name in params})
+    folder = f'sweep/{candidate["cid"]}'
+    checkpoint = f'weights/{folder}/weights.h5'
+    if resume and path.exists(checkpoint):
+        model.load_weights(checkpoint)
+    makedirs(f'weights/{folder}', exist_ok=True)
+
+    history = train(inputs, outputs, model, folder, both=False, bs=params.get('bs', 32), ep=epochs,
+                    checkpoints=False, patience=params.get('patience', patience), monitor='val_loss')
+    return {'val_loss': min(history.history['val_loss']),
+            'loss': history.history['loss'][-1],
+            'epochs': len(history.history['loss'])}
+
+def successive_halving(space=DEFAULT_SPACE, n=None, min_epochs=2, max_epochs=30, eta=3,
+                       scale='diatonic', both=True, length=17, patience=5,
+                       workers=None, threads=None, seed=0, show=True):
+    """
+    Function to run a sweep with (synchronous) successive halving:
+    > Rung 0: Every candidate is trained for min_epochs epochs
+    > Rung k: The best 1/eta candidates of rung k-1 (lowest validation loss) are trained
+      until they reached min_epochs * eta^k epochs (at most max_epochs)
+    The candidates of a rung are trained in a process pool (workers processes with threads threads each).
+    scale, both, length select the training data like extract_notes_and_duration, patience is used
+    for the early stopping (the search space can contain 'patience' per candidate as well).
+    Returns the leaderboard (see write_leaderboard).
+    """
+    candidates = build_candidates(space, n, seed)
+    rung_epochs = get_rung_epochs(min_epochs, max_epochs, eta)
+    workers = workers or min(len(candidates), cpu_count() or 1)
+    threads = threads or max(1, (cpu_count() or 1) // workers)
+
+    results = {candidate['cid']: {**candidate, 'epochs': 0, 'rung': 0, 'val_loss': None, 'status': 'running'}
+               for candidate in candidates}
+    survivors = candidates
+
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                             initializer=set_thread_limits, initargs=(threads, )) as executor:
+        for rung, epochs in enumerate(rung_epochs):
+            # Every candidate is trained up to the epochs of the rung
+            futures = {candidate['cid']: executor.submit(train_candidate, candidate,
+                                                         epochs - results[candidate['cid']]['epochs'],
+                                                         scale, both, length, patience, rung > 0)
+                       for candidate in survivors}
+            for cid, future in futures.items():
+                rung_result = future.result()
+                results[cid].update(rung=rung, val_loss=rung_result['val_loss'], loss=rung_result['loss'],
+                                    epochs=results[cid]['epochs'] + rung_result['epochs'])
+
+            # Keep the best 1 / eta candidates
+            survivors = sorted(survivors, key=lambda candidate: results[candidate['cid']]['val_loss'])
+            if rung < len(rung_epochs) - 1:
+                n_keep = max(1, ceil(len(survivors) / eta))
+                for candidate in survivors[n_keep:]:
+                    results[candidate['cid']]['status'] = f'pruned after {epochs} epochs'
+                survivors = survivors[:n_keep]
+
+            leaderboard = write_leaderboard(results, rung_epochs, len(candidates))
+            if show:
+                print(f'Rung {rung}: {len(futures)} candidates trained to {epochs} epochs, '
+                      f'best validation loss {leaderboard["candidates"][0]["val_loss"]:.4f} '
+                      f'({leaderboard["candidates"][0]["cid"]})')
+
+    for candidate in survivors:
+        results[candidate['cid']]['status'] = 'survivor'
+    return write_leaderboard(results, rung_epochs, len(candidates))
+
+def write_leaderboard(results, rung_epochs, n_candidates, file_path='weights/sweep/leaderboard.json'):
+    """
+    Function to save the leaderboard of a sweep as JSON:
+    Every candidate (id, parameters, trained epochs, last rung, best validation loss of the last rung,
+    status, checkpoint) sorted by the rung (descending) and the validation loss,
+    + the spent epochs compared to training every candidate for all epochs.
+    Returns the leaderboard.
+    """
+    ranked = sorted(results.values(), key=lambda result: (-result['rung'], result['val_loss']
+                                                          if result['val_loss'] is not None else float('inf')))
+    leaderboard = {'rung_epochs': rung_epochs,
+                   'spent_epochs': sum(result['epochs'] for result in results.values()),
+                   'full_epochs': n_candidates * rung_epochs[-1],
+                   'candidates': [{**result, 'checkpoint': f'weights/sweep/{result["cid"]}/weights.h5'}
+                                  for result in ranked]}
+
+    makedirs(path.dirname(file_path), exist_ok=True)
+    with open(file_path, 'w') as stored:
+        dump(leaderboard, stored, indent=2)
+    return leaderboard